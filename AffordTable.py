@@ -0,0 +1,152 @@
+import functools
+import os
+from itertools import combinations
+
+import numpy as np
+
+from GameState import CARD_COSTS, GOLD_INDEX
+from ResultCache import DEFAULT_CACHE_DIR
+from Splendor import CARD_CATALOG, COLORS
+
+# where the turns-to-afford table is kept between runs, unless told otherwise
+DEFAULT_AFFORD_TABLE_PATH = os.environ.get("SPLENDOR_AFFORD_TABLE", os.path.join(DEFAULT_CACHE_DIR, "afford_table.npy"))
+
+# the table holds every shortfall of up to the highest cost of one color in the CARD_CATALOG,
+# for every number of coins a player still has room for (up to Player.max_coins); larger
+# shortfalls, e.g. of cards made up outside the catalog, are worked out by compute_turns_to_afford
+MAX_SHORTFALL = max(max(cost.values()) for level, color, points, cost in CARD_CATALOG)
+MAX_ROOM = 10
+AFFORD_TABLE_SHAPE = (MAX_SHORTFALL + 1,) * len(COLORS) + (MAX_ROOM + 1,)
+# the entry of a shortfall that cannot be made up without running out of room for coins
+UNREACHABLE = 255
+
+
+def get_take_actions(room):
+    """
+    The coins a player with room for some more coins can take in one turn, as GameState
+    allows it: min(3, room) coins of different colors, or two coins of one color.
+    Returns:
+        list: Per action, the number of coins it takes of each color.
+    """
+
+    actions = []
+    for colors in combinations(range(len(COLORS)), min(3, room)):
+        actions.append(tuple(1 if index in colors else 0 for index in range(len(COLORS))))
+    if room >= 2:
+        for color in range(len(COLORS)):
+            actions.append(tuple(2 if index == color else 0 for index in range(len(COLORS))))
+    return actions
+
+
+def build_afford_table():
+    """
+    Works out the fewest coin-taking turns to make up every shortfall, for every room left.
+    A turn that takes coins the player does not need still fills up their room, so a
+    shortfall can become unreachable.  The bank is assumed to have the coins.
+    Each room only depends on smaller rooms, so the table is filled a room at a time,
+    with every shortfall of that room at once.
+    Returns:
+        np.ndarray: The number of turns (or UNREACHABLE) indexed by the shortfall of each color, then the room.
+    """
+
+    table = np.full(AFFORD_TABLE_SHAPE, UNREACHABLE, dtype=np.uint8)
+    table[(0,) * len(COLORS)] = 0
+    positions = np.arange(MAX_SHORTFALL + 1)
+    for room in range(1, MAX_ROOM + 1):
+        best = table[..., room]
+        for taken in get_take_actions(room):
+            # the turns still needed after this one, for every shortfall
+            after = table[..., room - sum(taken)]
+            for axis, count in enumerate(taken):
+                if count:
+                    after = np.take(after, np.maximum(positions - count, 0), axis=axis)
+            best = np.minimum(best, np.where(after == UNREACHABLE, UNREACHABLE, after + 1).astype(np.uint8))
+        best[(0,) * len(COLORS)] = 0
+        table[..., room] = best
+    return table
+
+
+def save_afford_table(path, table):
+    # written aside then renamed, so worker processes never map a half written table
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as table_file:
+        np.save(table_file, table)
+    os.replace(tmp_path, path)
+
+
+@functools.lru_cache(maxsize=None)
+def get_afford_table(path=DEFAULT_AFFORD_TABLE_PATH):
+    """
+    Memory-maps the table in a file, once per process, building and saving it first
+    if the file is missing or holds a table of another shape.
+    Returns:
+        np.ndarray: The read-only table (see build_afford_table).
+    """
+
+    if os.path.exists(path):
+        table = np.load(path, mmap_mode="r")
+        if table.shape == AFFORD_TABLE_SHAPE and table.dtype == np.uint8:
+            return table
+    save_afford_table(path, build_afford_table())
+    return np.load(path, mmap_mode="r")
+
+
+@functools.lru_cache(maxsize=None)
+def compute_turns_to_afford(shortfall, room):
+    """
+    Works out one entry of the table directly, by the same rules as build_afford_table,
+    for any shortfall.
+    Args:
+        shortfall (tuple): The coins still missing of each color.
+        room (int): How many more coins the player can hold, up to MAX_ROOM.
+    Returns:
+        int: The fewest turns of taking coins before the player can pay, or UNREACHABLE.
+    """
+
+    if not any(shortfall):
+        return 0
+    best = UNREACHABLE
+    for taken in get_take_actions(room) if room else []:
+        turns = compute_turns_to_afford(tuple(max(missing - count, 0) for missing, count in zip(shortfall, taken)),
+                                        room - sum(taken))
+        if turns != UNREACHABLE:
+            best = min(best, turns + 1)
+    return best
+
+
+def get_turns_to_afford(shortfall, room, gold=0, table=None):
+    """
+    Args:
+        shortfall (tuple): The coins still missing of each color.
+        room (int): How many more coins the player can hold.
+        gold (int): The wild coins the player holds, which cover the largest shortfalls first.
+        table (np.ndarray, optional): The table to look in; by default get_afford_table().
+    Returns:
+        int: The fewest turns of taking coins before the player can pay, or UNREACHABLE.
+    """
+
+    if gold:
+        shortfall = list(shortfall)
+        for _ in range(gold):
+            index = max(range(len(shortfall)), key=shortfall.__getitem__)
+            if shortfall[index] == 0:
+                break
+            shortfall[index] -= 1
+    room = min(max(room, 0), MAX_ROOM)
+    if max(shortfall) > MAX_SHORTFALL:
+        return compute_turns_to_afford(tuple(shortfall), room)
+    table = get_afford_table() if table is None else table
+    return int(table[tuple(shortfall) + (room,)])
+
+
+def get_card_turns(player, card_id, max_coins=10, table=None):
+    """
+    The turns a PlayerState of a GameState needs before it can buy a card.
+    Returns:
+        int: The fewest turns of taking coins, or UNREACHABLE.
+    """
+
+    shortfall = tuple(max(cost - bonus - coins, 0)
+                      for cost, bonus, coins in zip(CARD_COSTS[card_id], player.bonuses, player.coins))
+    return get_turns_to_afford(shortfall, max_coins - sum(player.coins), player.coins[GOLD_INDEX], table)
@@ -0,0 +1,302 @@
+import numpy as np
+
+from Results import FINAL_STATES, NO_FINAL_STATE, NO_WINNER
+from Results import get_two_coin_percentages, get_average_scores
+
+# the range of the num_turns histograms of games without a turn limit
+DEFAULT_MAX_NUM_TURNS = 500
+
+
+class RunningStats:
+    """
+    Keeps the count, mean, variance, min and max of a stream of values
+    without keeping the values themselves (Welford's algorithm).
+    Two RunningStats can be merged, e.g. when they come from different workers.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def add_values(self, values):
+        """
+        Adds many values at once.
+        Args:
+            values (np.ndarray): The values to add.
+        """
+
+        if len(values) == 0:
+            return
+        other = RunningStats()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = values.min().item()
+        other.max = values.max().item()
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Adds the values seen by another RunningStats to this one (Chan et al.).
+        Returns:
+            RunningStats: This instance.
+        """
+
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def get_variance(self):
+        return self.m2 / self.count if self.count else None
+
+    def get_std(self):
+        return self.get_variance() ** 0.5 if self.count else None
+
+
+class Histogram:
+    """
+    A histogram with fixed, equal width bins between low and high.
+    Values below low or at/above high are not put in any bin, but counted apart.
+    Its counts also serve as a quantile sketch of the values added to it:
+    quantiles are exact up to the bin width.
+    Attributes:
+        low (float): The lower edge of the first bin.
+        high (float): The upper edge of the last bin.
+        counts (np.ndarray): The number of values in each bin.
+        underflow (int): The number of values below low.
+        overflow (int): The number of values at or above high.
+    """
+
+    def __init__(self, low, high, num_bins):
+        self.low = low
+        self.high = high
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def get_edges(self):
+        return np.linspace(self.low, self.high, len(self.counts) + 1)
+
+    def get_bins(self, values):
+        width = (self.high - self.low) / len(self.counts)
+        return np.floor((np.asarray(values, dtype=float) - self.low) / width).astype(np.int64)
+
+    def add(self, value):
+        self.add_values(np.array([value]))
+
+    def add_values(self, values):
+        bins = self.get_bins(values)
+        inside = (bins >= 0) & (bins < len(self.counts))
+        self.counts += np.bincount(bins[inside], minlength=len(self.counts))
+        self.underflow += int((bins < 0).sum())
+        self.overflow += int((bins >= len(self.counts)).sum())
+
+    def merge(self, other):
+        """
+        Adds the counts of another Histogram with the same bins to this one.
+        Returns:
+            Histogram: This instance.
+        """
+
+        if (other.low, other.high, len(other.counts)) != (self.low, self.high, len(self.counts)):
+            raise ValueError("Can only merge histograms with the same bins")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def get_quantile(self, q):
+        """
+        Estimates a quantile of the values added, interpolating within the bin it falls in.
+        Args:
+            q (float): The quantile, between 0 and 1.
+        Returns:
+            float: The estimated quantile, or None if no values were added.  A quantile
+                   among the values out of range is only known to be below low or at
+                   least high, and is given as low or high.
+        """
+
+        total = self.counts.sum() + self.underflow + self.overflow
+        if total == 0:
+            return None
+        target = q * total - self.underflow
+        if target <= 0 and self.underflow:
+            return float(self.low)
+        if target > self.counts.sum():
+            return float(self.high)
+        cumulative = np.cumsum(self.counts)
+        i = min(int(np.searchsorted(cumulative, target)), len(self.counts) - 1)
+        before = cumulative[i] - self.counts[i]
+        fraction = (target - before) / self.counts[i] if self.counts[i] else 0.0
+        edges = self.get_edges()
+        return float(edges[i] + fraction * (edges[i + 1] - edges[i]))
+
+
+class ResultsAggregator:
+    """
+    Summarizes the results of a stream of games in memory that does not grow with
+    the number of games.  It is fed one game record (see Results.get_game_result)
+    at a time, or whole results arrays, and aggregators from parallel workers can be merged.
+    Attributes:
+        num_players (int): The number of players in each game.
+        strategies (list): The strategy of each player seat.
+        stats (dict): RunningStats of num_turns, two_coin_percentage and average_score.
+        histograms (dict): Histograms of num_turns, num_turns_stuck, two_coin_percentage
+                           and average_score_winning.  The num_turns ones cover games of
+                           up to max_num_turns turns.
+        final_states (np.ndarray): How many games ended in each of the FINAL_STATES.
+        seat_wins (np.ndarray): How many games each player seat won.
+    """
+
+    def __init__(self, num_players, strategies, max_num_turns=None, max_average_score=30):
+        """
+        Args:
+            max_num_turns (int, optional): The turn limit of the games, DEFAULT_MAX_NUM_TURNS if they have none.
+        """
+
+        if max_num_turns is None:
+            max_num_turns = DEFAULT_MAX_NUM_TURNS
+        self.num_players = num_players
+        self.strategies = list(strategies)
+        self.stats = {
+            "num_turns": RunningStats(),
+            "two_coin_percentage": RunningStats(),
+            "average_score": RunningStats(),
+        }
+        self.histograms = {
+            # a game that hits the limit has played exactly max_num_turns turns
+            "num_turns": Histogram(0, max_num_turns + 1, max_num_turns + 1),
+            "num_turns_stuck": Histogram(0, max_num_turns + 1, max_num_turns + 1),
+            "two_coin_percentage": Histogram(0, 101, 101),
+            "average_score_winning": Histogram(0, max_average_score, 4 * max_average_score),
+        }
+        self.final_states = np.zeros(len(FINAL_STATES), dtype=np.int64)
+        self.seat_wins = np.zeros(num_players, dtype=np.int64)
+
+    def add(self, record):
+        """
+        Adds the result of one game.
+        Args:
+            record (tuple): The game's record, as returned by Results.get_game_result.
+        """
+
+        num_turns, num_turns_take_two_coins, final_state, winner, scores = record
+        two_coins = (100 * num_turns_take_two_coins) // max(num_turns, 1)
+        average_score = sum(scores[:self.num_players]) / self.num_players
+
+        self.stats["num_turns"].add(num_turns)
+        self.stats["two_coin_percentage"].add(two_coins)
+        self.stats["average_score"].add(average_score)
+        self.histograms["num_turns"].add(num_turns)
+        self.histograms["two_coin_percentage"].add(two_coins)
+        if final_state != NO_FINAL_STATE:
+            self.final_states[final_state] += 1
+        if final_state == FINAL_STATES.index("players_stuck"):
+            self.histograms["num_turns_stuck"].add(num_turns)
+        if final_state == FINAL_STATES.index("winning_points"):
+            self.histograms["average_score_winning"].add(average_score)
+        if winner != NO_WINNER:
+            self.seat_wins[winner] += 1
+
+    def add_results(self, results):
+        """
+        Adds the results of many games at once.
+        Args:
+            results (np.ndarray): A results array (see Results.RESULT_DTYPE).
+        """
+
+        num_turns = results["num_turns"]
+        two_coins = get_two_coin_percentages(results)
+        average_scores = get_average_scores(results, self.num_players)
+        codes = results["final_state"]
+        winners = results["winner"]
+
+        self.stats["num_turns"].add_values(num_turns)
+        self.stats["two_coin_percentage"].add_values(two_coins)
+        self.stats["average_score"].add_values(average_scores)
+        self.histograms["num_turns"].add_values(num_turns)
+        self.histograms["two_coin_percentage"].add_values(two_coins)
+        self.histograms["num_turns_stuck"].add_values(num_turns[codes == FINAL_STATES.index("players_stuck")])
+        self.histograms["average_score_winning"].add_values(average_scores[codes == FINAL_STATES.index("winning_points")])
+        self.final_states += np.bincount(codes[codes != NO_FINAL_STATE], minlength=len(FINAL_STATES))
+        self.seat_wins += np.bincount(winners[winners != NO_WINNER], minlength=self.num_players)[:self.num_players]
+
+    def merge(self, other):
+        """
+        Adds everything another aggregator of the same kind of games has seen to this one.
+        Returns:
+            ResultsAggregator: This instance.
+        """
+
+        if other.num_players != self.num_players:
+            raise ValueError("Can only merge aggregators of games with the same number of players")
+        for name, stats in self.stats.items():
+            stats.merge(other.stats[name])
+        for name, histogram in self.histograms.items():
+            histogram.merge(other.histograms[name])
+        self.final_states += other.final_states
+        self.seat_wins += other.seat_wins
+        return self
+
+    def get_num_games(self):
+        return self.stats["num_turns"].count
+
+    def get_strategy_wins(self):
+        """
+        Returns:
+            dict: How many games were won by each strategy, over all seats playing it.
+        """
+
+        strategy_wins = {}
+        for strategy, wins in zip(self.strategies, self.seat_wins):
+            strategy_wins[strategy] = strategy_wins.get(strategy, 0) + int(wins)
+        return strategy_wins
+
+    def get_summary(self, player_labels):
+        """
+        Summarizes what has been aggregated into plain numbers that can be written out as JSON.
+        Args:
+            player_labels (list): A label for each player seat.
+        Returns:
+            dict: The summary of the results.
+        """
+
+        num_turns = self.stats["num_turns"]
+        num_turns_histogram = self.histograms["num_turns"]
+        return {
+            "num_games": self.get_num_games(),
+            "num_turns_mean": num_turns.mean if num_turns.count else None,
+            "num_turns_std": num_turns.get_std(),
+            "num_turns_min": num_turns.min,
+            "num_turns_max": num_turns.max,
+            "num_turns_quantiles": {str(q): num_turns_histogram.get_quantile(q) for q in (0.1, 0.5, 0.9)},
+            "two_coin_percentage_mean": self.stats["two_coin_percentage"].mean if num_turns.count else None,
+            "average_score_mean": self.stats["average_score"].mean if num_turns.count else None,
+            "final_states": {state: int(count) for state, count in zip(FINAL_STATES, self.final_states)},
+            "player_wins": {label: int(wins) for label, wins in zip(player_labels, self.seat_wins)},
+            "strategy_wins": self.get_strategy_wins(),
+            # the values of each histogram outside its range, counted apart from its bins
+            "histogram_overflow": {name: histogram.underflow + histogram.overflow
+                                   for name, histogram in self.histograms.items()},
+        }
@@ -0,0 +1,72 @@
+import numpy as np
+
+from AffordTable import UNREACHABLE, get_card_turns
+from GameState import CARD_COSTS, CARD_POINTS, TakeCoins, get_legal_actions
+from Splendor import COLORS
+
+
+def get_take_matrix(takes):
+    """
+    Returns:
+        np.ndarray: Per TakeCoins action, the number of coins it takes of each color.
+    """
+
+    matrix = np.zeros((len(takes), len(COLORS)), dtype=np.int16)
+    for row, take in zip(matrix, takes):
+        for color in take.colors:
+            row[COLORS.index(color)] += 1
+    return matrix
+
+
+def get_market_targets(state, seat=None):
+    """
+    The cards of the market a player is working towards, each weighted by the points it
+    is worth per turn still needed to afford it (see AffordTable).  Cards the player can
+    already afford, or never will with the room they have left for coins, are left out.
+    Args:
+        state (GameState): The position.
+        seat (int, optional): The player; by default the player to move.
+    Returns:
+        list: (card_id, weight) per target card.
+    """
+
+    player = state.players[state.turn if seat is None else seat]
+    targets = []
+    for deck in state.decks:
+        for card_id in deck[:state.rules.num_cards_visible]:
+            turns = get_card_turns(player, card_id, state.rules.max_coins)
+            if 0 < turns < UNREACHABLE:
+                targets.append((card_id, (1 + CARD_POINTS[card_id]) / turns))
+    return targets
+
+
+def plan_coin_take(state, targets=None):
+    """
+    Picks the coins the player to move should take, looking at every legal take at once
+    (three different colors, two of one color, or fewer colors when the bank or the
+    player's room runs short): each take is scored by the coins it adds towards each
+    target card, times the target's weight, summed over the targets.
+    Args:
+        state (GameState): The position.
+        targets (list, optional): (card_id, weight) per target card; by default get_market_targets(state).
+    Returns:
+        TakeCoins or None: The best take, or None if no coins can be taken.
+    """
+
+    takes = [action for action in get_legal_actions(state) if isinstance(action, TakeCoins)]
+    if not takes:
+        return None
+    if targets is None:
+        targets = get_market_targets(state)
+    if not targets:
+        return takes[0]
+
+    player = state.players[state.turn]
+    held = np.array(player.bonuses, dtype=np.int16) + np.array(player.coins[:len(COLORS)], dtype=np.int16)
+    costs = np.array([CARD_COSTS[card_id] for card_id, weight in targets], dtype=np.int16)
+    weights = np.array([weight for card_id, weight in targets], dtype=np.float64)
+    shortfalls = np.maximum(costs - held, 0)
+
+    # progress[take, target]: the coins of the take the target still needs
+    progress = np.minimum(get_take_matrix(takes)[:, None, :], shortfalls[None, :, :]).sum(axis=2)
+    return takes[int(np.argmax(progress @ weights))]
@@ -0,0 +1,101 @@
+from collections import Counter
+from math import comb
+
+from GameState import CARD_LEVELS
+from Splendor import CARD_CATALOG, COLORS
+
+# what tells the unseen cards apart for a strategy: color, points and cost class (the total cost)
+CARD_KINDS = tuple((color, points, sum(cost.values())) for level, color, points, cost in CARD_CATALOG)
+
+
+class DeckTracker:
+    """
+    Keeps count of the cards of each level nobody has seen yet, i.e. the cards of each
+    deck behind the market, by kind (see CARD_KINDS), without looking at their order.
+    Every refill draws uniformly from them, so the counts give the exact distribution of
+    the next refill of a level.  The probabilities are cached per level until a card of
+    that level leaves the unseen cards.
+    Attributes:
+        counts (list): A Counter of the unseen cards of each kind, per level.
+        num_unseen (list): The number of unseen cards per level.
+    """
+
+    def __init__(self, unseen):
+        """
+        Args:
+            unseen (list): The card_ids of the unseen cards of each level.
+        """
+
+        self.counts = [Counter(CARD_KINDS[card_id] for card_id in card_ids) for card_ids in unseen]
+        self.num_unseen = [len(card_ids) for card_ids in unseen]
+        self.cache = [{} for _ in unseen]
+
+    @classmethod
+    def from_game(cls, game):
+        return cls([[card.card_id for card in cards[game.num_cards_visible:]] for cards in game.cards])
+
+    @classmethod
+    def from_state(cls, state):
+        return cls([list(deck[state.rules.num_cards_visible:]) for deck in state.decks])
+
+    def remove(self, card_id):
+        """
+        Takes a card out of the unseen cards, e.g. when it is turned over to refill the market.
+        """
+
+        level = CARD_LEVELS[card_id]
+        kind = CARD_KINDS[card_id]
+        self.counts[level][kind] -= 1
+        if self.counts[level][kind] == 0:
+            del self.counts[level][kind]
+        self.num_unseen[level] -= 1
+        self.cache[level].clear()
+
+    def get_refill_distribution(self, level):
+        """
+        Returns:
+            dict: The probability of each kind (color, points, cost class) of being the next
+                  card of the level to come up; empty when the deck has run out.
+        """
+
+        key = ("distribution",)
+        if key not in self.cache[level]:
+            total = self.num_unseen[level]
+            self.cache[level][key] = {kind: count / total for kind, count in self.counts[level].items()}
+        return self.cache[level][key]
+
+    def get_refill_probability(self, level, color=None, points=None, cost_class=None, draws=1):
+        """
+        The probability that at least one of the next refills of a level is a matching card
+        (hypergeometric, since the cards are drawn without replacement).
+        Args:
+            level (int): The level of the deck.
+            color (str, optional): Only cards of this color match.
+            points (int, optional): Only cards worth at least this many points match.
+            cost_class (int, optional): Only cards costing at most this many coins in total match.
+            draws (int): How many cards will be turned over.
+        Returns:
+            float: The probability.
+        """
+
+        key = (color, points, cost_class, draws)
+        if key not in self.cache[level]:
+            total = self.num_unseen[level]
+            matching = sum(count for (kind_color, kind_points, kind_cost), count in self.counts[level].items()
+                           if (color is None or kind_color == color)
+                           and (points is None or kind_points >= points)
+                           and (cost_class is None or kind_cost <= cost_class))
+            draws = min(draws, total)
+            self.cache[level][key] = 1 - comb(total - matching, draws) / comb(total, draws) if draws > 0 else 0.0
+        return self.cache[level][key]
+
+    def get_color_probabilities(self, level):
+        """
+        Returns:
+            dict: The probability of each color being the next card of the level to come up.
+        """
+
+        probabilities = dict.fromkeys(COLORS, 0.0)
+        for (color, points, cost_class), probability in self.get_refill_distribution(level).items():
+            probabilities[color] += probability
+        return probabilities
@@ -0,0 +1,330 @@
+import argparse
+import math
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from Experiment import get_game_seed
+from GameState import get_final_state, step
+from Splendor import Game, CHEAPEST_STRATEGY, POINTS_STRATEGY
+from StateEncoder import infer_action
+
+
+class ReferenceEngine:
+    """
+    Plays a game turn by turn with the reference Game.  Alternate engines subclass it
+    (or just provide the same methods) and are built with the same keyword arguments as Game.
+    """
+
+    def __init__(self, **game_kwargs):
+        self.game = Game(**game_kwargs)
+
+    def play_turn(self):
+        self.game.take_turn()
+        self.game.next_turn()
+
+    def get_state(self):
+        return self.game.get_state()
+
+    def is_over(self):
+        return self.game.is_game_over()
+
+
+class StepEngine(ReferenceEngine):
+    """
+    Lets the players' strategies decide each turn, but plays their actions with the pure
+    GameState.step, so the game goes on from the states step() computes.
+    """
+
+    def play_turn(self):
+        before = self.game.get_state()
+        self.game.take_turn()
+        action = infer_action(before, self.game.get_state())
+        self.game.set_state(step(before, action))
+
+
+class PackedEngine(ReferenceEngine):
+    """
+    Round-trips the game through its packed state (Game.to_bytes and Game.from_bytes)
+    before every turn, carrying the random number generator over.
+    """
+
+    def play_turn(self):
+        random_state = self.game.random.getstate()
+        self.game = Game.from_bytes(self.game.to_bytes())
+        self.game.random.setstate(random_state)
+        super().play_turn()
+
+
+ENGINES = {
+    "step": StepEngine,
+    "packed": PackedEngine,
+}
+
+
+class Divergence(NamedTuple):
+    """
+    Where an alternate engine first disagrees with the reference.
+    Attributes:
+        game_number (int): The first game that diverged.
+        seed (int): The seed of that game, enough to replay it on its own.
+        turn (int): The number of turns played when the states first differed.
+        path (str): The first part of the state that differs, e.g. "players[1].coins".
+        reference, alternate: That part of the state in each engine.
+    """
+
+    game_number: int
+    seed: int
+    turn: int
+    path: str
+    reference: object
+    alternate: object
+
+
+def get_canonical_state(state):
+    """
+    Drops what the rules do not care about: the order players bought their cards and met their nobles in.
+    """
+
+    players = tuple(player._replace(cards=tuple(sorted(player.cards)), nobles=tuple(sorted(player.nobles)))
+                    for player in state.players)
+    return state._replace(players=players)
+
+
+def find_difference(reference, alternate, path="state"):
+    """
+    Returns:
+        tuple or None: The path of the first difference between two (nested) states and
+                       the values there, or None if they are equal.
+    """
+
+    if reference == alternate:
+        return None
+    if isinstance(reference, tuple) and isinstance(alternate, tuple) and len(reference) == len(alternate):
+        fields = getattr(reference, "_fields", None)
+        for index, (reference_value, alternate_value) in enumerate(zip(reference, alternate)):
+            sub_path = f"{path}.{fields[index]}" if fields else f"{path}[{index}]"
+            difference = find_difference(reference_value, alternate_value, sub_path)
+            if difference is not None:
+                return difference
+    return path, reference, alternate
+
+
+def compare_game(engine_class, game_seed, game_number=0, reference_class=ReferenceEngine, **game_kwargs):
+    """
+    Plays one game with the reference and an alternate engine in lockstep, comparing
+    their states before the first turn and after every turn.
+    Returns:
+        Divergence or None: The first divergence, or None if the engines agreed throughout.
+    """
+
+    reference = reference_class(seed=game_seed, **game_kwargs)
+    alternate = engine_class(seed=game_seed, **game_kwargs)
+    turn = 0
+    while True:
+        difference = find_difference(get_canonical_state(reference.get_state()), get_canonical_state(alternate.get_state()))
+        if difference is None:
+            reference_over = reference.is_over()
+            difference = find_difference(reference_over, alternate.is_over(), "game_over")
+        if difference is not None:
+            return Divergence(game_number, game_seed, turn, *difference)
+        if reference_over:
+            return None
+        reference.play_turn()
+        try:
+            alternate.play_turn()
+        except ValueError as error:
+            return Divergence(game_number, game_seed, turn, "play_turn", None, str(error))
+        turn += 1
+
+
+def compare_games(engine_class, seed, igames, game_kwargs):
+    """
+    Compares a range of games in lockstep.
+    Returns:
+        Divergence or None: The divergence of the first game that diverged.
+    """
+
+    for igame in igames:
+        divergence = compare_game(engine_class, get_game_seed(seed, igame), igame, **game_kwargs)
+        if divergence is not None:
+            return divergence
+    return None
+
+
+def run_lockstep(engine_class, num_games, seed=0, workers=None, chunk_size=20, **game_kwargs):
+    """
+    Compares an alternate engine with the reference Game in lockstep, game by game, on
+    the same seeds (see Experiment.get_game_seed) and strategies.
+    Args:
+        engine_class (type): The alternate engine (see ReferenceEngine).
+        game_kwargs: The settings of the games, e.g. num_players, strategies and max_turns.
+    Returns:
+        Divergence or None: The divergence of the lowest numbered game that diverged, at
+                            its first differing turn, or None if no game diverged.
+    """
+
+    chunks = [range(start, min(start + chunk_size, num_games)) for start in range(0, num_games, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compare_games, engine_class, seed, chunk, game_kwargs) for chunk in chunks]
+        # the chunks are in game order, so the first divergence found is the lowest numbered one
+        for future in futures:
+            divergence = future.result()
+            if divergence is not None:
+                for other in futures:
+                    other.cancel()
+                return divergence
+    return None
+
+
+def play_outcomes(engine_class, seeds, game_kwargs):
+    """
+    Plays one game per seed to the end.
+    Returns:
+        list: The final state, winner seat and number of turns of each game.
+    """
+
+    outcomes = []
+    for game_seed in seeds:
+        engine = engine_class(seed=game_seed, **game_kwargs)
+        while not engine.is_over():
+            engine.play_turn()
+        state = engine.get_state()
+        final_state, winner = get_final_state(state)
+        outcomes.append((final_state, winner, state.num_turns))
+    return outcomes
+
+
+def get_chi_square_p_value(statistic, degrees_of_freedom):
+    """
+    The probability of a chi-square statistic at least this large, i.e. the regularized
+    upper incomplete gamma function Q(k / 2, x / 2), by its series or continued fraction.
+    """
+
+    if statistic <= 0 or degrees_of_freedom <= 0:
+        return 1.0
+    a = degrees_of_freedom / 2
+    x = statistic / 2
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1 / a
+        for n in range(1, 1000):
+            term *= x / (a + n)
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # Lentz's method for the continued fraction
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for n in range(1, 1000):
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        fraction *= d * c
+        if abs(d * c - 1) < 1e-15:
+            break
+    return min(1.0, fraction * math.exp(log_prefix))
+
+
+def compare_outcomes(reference_outcomes, alternate_outcomes):
+    """
+    Tests whether two engines' games end alike: a chi-square test of homogeneity of how
+    they end (final state and winner seat), and a two-sample z test of their lengths.
+    Returns:
+        dict: The statistics and p-values.
+    """
+
+    reference_counts = Counter((final_state, winner) for final_state, winner, num_turns in reference_outcomes)
+    alternate_counts = Counter((final_state, winner) for final_state, winner, num_turns in alternate_outcomes)
+    categories = sorted(set(reference_counts) | set(alternate_counts), key=str)
+    num_reference = len(reference_outcomes)
+    num_alternate = len(alternate_outcomes)
+    statistic = 0.0
+    for category in categories:
+        total = reference_counts[category] + alternate_counts[category]
+        for counts, num_games in ((reference_counts, num_reference), (alternate_counts, num_alternate)):
+            expected = total * num_games / (num_reference + num_alternate)
+            statistic += (counts[category] - expected) ** 2 / expected
+
+    def get_mean_and_variance(outcomes):
+        turns = [num_turns for final_state, winner, num_turns in outcomes]
+        mean = sum(turns) / len(turns)
+        return mean, sum((value - mean) ** 2 for value in turns) / max(len(turns) - 1, 1)
+
+    reference_mean, reference_variance = get_mean_and_variance(reference_outcomes)
+    alternate_mean, alternate_variance = get_mean_and_variance(alternate_outcomes)
+    standard_error = math.sqrt(reference_variance / num_reference + alternate_variance / num_alternate)
+    z = (alternate_mean - reference_mean) / standard_error if standard_error > 0 else 0.0
+    return {
+        "outcome_counts": {str(category): (reference_counts[category], alternate_counts[category]) for category in categories},
+        "chi_square": statistic,
+        "outcome_p_value": get_chi_square_p_value(statistic, len(categories) - 1),
+        "turns_mean": (reference_mean, alternate_mean),
+        "turns_z": z,
+        "turns_p_value": math.erfc(abs(z) / math.sqrt(2)),
+    }
+
+
+def run_statistical(engine_class, num_games=100000, seed=0, workers=None, chunk_size=500, alpha=0.001, **game_kwargs):
+    """
+    Compares how an alternate engine's games end with the reference Game's, for engines
+    that are not expected to play exactly the same games.  Each engine plays its own
+    games (the alternate's seeds are derived from seed + 1), so the samples are independent.
+    Args:
+        alpha (float): The p-value below which the engines are reported as different.
+    Returns:
+        dict: The comparison (see compare_outcomes), and whether the engines agree.
+    """
+
+    def get_chunks(engine_seed):
+        return [[get_game_seed(engine_seed, igame) for igame in range(start, min(start + chunk_size, num_games))]
+                for start in range(0, num_games, chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        reference_futures = [executor.submit(play_outcomes, ReferenceEngine, chunk, game_kwargs) for chunk in get_chunks(seed)]
+        alternate_futures = [executor.submit(play_outcomes, engine_class, chunk, game_kwargs) for chunk in get_chunks(seed + 1)]
+        reference_outcomes = [outcome for future in reference_futures for outcome in future.result()]
+        alternate_outcomes = [outcome for future in alternate_futures for outcome in future.result()]
+
+    comparison = compare_outcomes(reference_outcomes, alternate_outcomes)
+    comparison["agree"] = comparison["outcome_p_value"] >= alpha and comparison["turns_p_value"] >= alpha
+    return comparison
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare an alternate engine with the reference Game.")
+    parser.add_argument("engine", choices=sorted(ENGINES))
+    parser.add_argument("--mode", choices=["lockstep", "statistical"], default="lockstep")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--num-players", type=int, default=2)
+    parser.add_argument("--strategies", nargs="+", default=[CHEAPEST_STRATEGY, POINTS_STRATEGY])
+    parser.add_argument("--max-turns", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    game_kwargs = dict(num_players=args.num_players, strategies=args.strategies, max_turns=args.max_turns)
+    if args.mode == "lockstep":
+        divergence = run_lockstep(ENGINES[args.engine], args.games, seed=args.seed, workers=args.workers, **game_kwargs)
+        if divergence is None:
+            print(f"{args.engine}: no divergence in {args.games} games")
+        else:
+            print(f"{args.engine}: game {divergence.game_number} (seed {divergence.seed}) diverges at turn "
+                  f"{divergence.turn}: {divergence.path} is {divergence.reference!r} in the reference, "
+                  f"{divergence.alternate!r} in {args.engine}")
+    else:
+        comparison = run_statistical(ENGINES[args.engine], args.games, seed=args.seed, workers=args.workers, **game_kwargs)
+        for name, value in comparison.items():
+            print(f"{name}: {value}")
+
+if __name__ == "__main__":
+    main()
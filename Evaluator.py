@@ -0,0 +1,108 @@
+import functools
+import os
+
+import numpy as np
+
+from GameState import get_legal_actions, step
+from StateEncoder import ENCODING_VERSION, FEATURE_SIZE, encode_state
+
+# where the LEARNED strategy loads its weights from, unless told otherwise
+DEFAULT_WEIGHTS_PATH = os.environ.get("SPLENDOR_WEIGHTS", "weights.npz")
+
+
+class ValueEvaluator:
+    """
+    Estimates how a position will end for a player (from -1, lost, to 1, won) from its
+    encoded features (see StateEncoder.encode_state), with a small neural network:
+    the features are standardized, then go through tanh layers.  With a single layer
+    this is a linear evaluator squashed by tanh.
+    Attributes:
+        mean, std (np.ndarray): Standardize the features.
+        layers (list): The (weights, biases) of each layer.
+    """
+
+    def __init__(self, layers, mean=None, std=None):
+        self.layers = [(np.asarray(weights, dtype=np.float32), np.asarray(biases, dtype=np.float32))
+                       for weights, biases in layers]
+        self.mean = np.zeros(FEATURE_SIZE, dtype=np.float32) if mean is None else np.asarray(mean, dtype=np.float32)
+        self.std = np.ones(FEATURE_SIZE, dtype=np.float32) if std is None else np.asarray(std, dtype=np.float32)
+
+    @classmethod
+    def create(cls, hidden_sizes=(), seed=0, mean=None, std=None):
+        """
+        Creates an evaluator with small random weights.
+        Args:
+            hidden_sizes (tuple): The size of each hidden layer; none for a linear evaluator.
+        """
+
+        rng = np.random.default_rng(seed)
+        sizes = [FEATURE_SIZE] + list(hidden_sizes) + [1]
+        layers = [(rng.normal(0, 1 / np.sqrt(size_in), (size_in, size_out)), np.zeros(size_out))
+                  for size_in, size_out in zip(sizes[:-1], sizes[1:])]
+        return cls(layers, mean, std)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as weights:
+            if int(weights["encoding_version"]) != ENCODING_VERSION:
+                raise ValueError(f"{path} was trained on encoding version {int(weights['encoding_version'])}, not {ENCODING_VERSION}")
+            num_layers = int(weights["num_layers"])
+            layers = [(weights[f"weights{layer}"], weights[f"biases{layer}"]) for layer in range(num_layers)]
+            return cls(layers, weights["mean"], weights["std"])
+
+    def save(self, path):
+        arrays = {}
+        for layer, (weights, biases) in enumerate(self.layers):
+            arrays[f"weights{layer}"] = weights
+            arrays[f"biases{layer}"] = biases
+        np.savez(path, encoding_version=ENCODING_VERSION, num_layers=len(self.layers),
+                 mean=self.mean, std=self.std, **arrays)
+
+    def forward(self, features):
+        """
+        Evaluates a batch of features, keeping the output of every layer (for training).
+        Args:
+            features (np.ndarray): One row of FEATURE_SIZE per position.
+        Returns:
+            list: The input of the first layer, then the output of each layer.
+        """
+
+        outputs = [(features - self.mean) / self.std]
+        for weights, biases in self.layers:
+            outputs.append(np.tanh(outputs[-1] @ weights + biases))
+        return outputs
+
+    def evaluate(self, features):
+        """
+        Returns:
+            np.ndarray: The value of each row of features.
+        """
+
+        return self.forward(features)[-1][:, 0]
+
+    def choose_action(self, state):
+        """
+        Picks the legal action of the player to move whose resulting position is worth
+        the most to that player.  The resulting positions are encoded from that player's
+        seat (marked as the seat to move, like the positions of the player its value was
+        trained on), into one matrix and evaluated together.
+        Returns:
+            BuyCard, TakeCoins or Pass: The action.
+        """
+
+        actions = get_legal_actions(state)
+        if len(actions) == 1:
+            return actions[0]
+        features = np.empty((len(actions), FEATURE_SIZE), dtype=np.float32)
+        for row, action in zip(features, actions):
+            encode_state(step(state, action), out=row, seat=state.turn)
+        return actions[int(np.argmax(self.evaluate(features)))]
+
+
+@functools.lru_cache(maxsize=None)
+def get_evaluator(path=DEFAULT_WEIGHTS_PATH):
+    """
+    Loads the weights in a file, once per process.
+    """
+
+    return ValueEvaluator.load(path)
@@ -1,11 +1,142 @@
 import copy
 import os
 import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.figure import Figure
 
 from Splendor import Game
 from Splendor import RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY
+from Aggregator import ResultsAggregator
+from Instrumentation import TurnInstrumentation
+from Profiling import profile_call, merge_stats, write_collapsed_stacks
+from Progress import ExperimentProgress
+from ResultCache import get_cache_key
+from Results import FINAL_STATES
+from Results import get_game_result, results_to_array, get_summary
+from Results import get_two_coin_percentages, get_average_scores
+
+
+def render_figure(path, kind, title, x, y, xlabel, ylabel, rotate_xticks=False):
+    """
+    Renders a single bar or histogram figure straight to a PNG file.
+    This uses the Agg canvas without pyplot, so it never opens a window
+    and can safely run in worker processes.
+    Args:
+        path (str): Where to save the PNG.
+        kind (str): "bar" to draw a bar per x value, "hist" to draw x as bin edges of y counts.
+        title, xlabel, ylabel (str): The labels of the figure.
+        x, y (array): The bar positions (or bin edges) and heights.
+        rotate_xticks (bool): Whether to rotate the x tick labels.
+    Returns:
+        str: The path of the saved figure.
+    """
+
+    fig = Figure()
+    ax = fig.subplots()
+    if kind == "hist":
+        ax.stairs(y, x, fill=True, edgecolor='black')
+    else:
+        ax.bar(x, y, edgecolor='black')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if rotate_xticks:
+        ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+
+def _render_figure_spec(spec):
+    return render_figure(**spec)
+
+
+def get_game_seed(seed, igame):
+    """
+    Derives the seed of one game of an experiment from the experiment's master seed,
+    so that any range of its games can be replayed on its own.
+    """
+
+    return seed * 2**32 + igame
+
+
+def play_games(game_class, num_players, max_turns, winning_points, strategy, strategies, seeds, out=None, profile=False):
+    """
+    Plays one non-interactive game per seed and returns their results.
+    This is a plain module level function so that it can be run in worker processes.
+    Args:
+        out (np.ndarray, optional): A results array to write the games' records into,
+                                    one per seed, instead of a new array.
+        profile (bool): Whether to play the games under cProfile, in whichever process
+                        this runs in, and return its raw stats too (see Profiling.profile_call).
+    Returns:
+        np.ndarray: The results of the games (see Results.RESULT_DTYPE), in the order of
+                    the seeds; with profile, a tuple of the results and the raw stats.
+    """
+
+    if profile:
+        return profile_call(play_games, game_class, num_players, max_turns, winning_points, strategy, strategies, seeds, out)
+    records = []
+    for igame, seed in enumerate(seeds):
+        game = game_class(
+            max_turns=max_turns,
+            num_players=num_players,
+            winning_points=winning_points,
+            strategy=strategy,
+            strategies=strategies,
+            seed=seed
+        )
+        game.play_game(interactive=False)
+        if out is None:
+            records.append(get_game_result(game))
+        else:
+            out[igame] = get_game_result(game)
+    return results_to_array(records) if out is None else out
+
+
+def get_integer_histogram(values):
+    """
+    Counts how often each integer between the smallest and largest value occurs.
+    Returns:
+        tuple: The integer values and their counts.
+    """
+
+    if len(values) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    low = values.min()
+    counts = np.bincount(values - low)
+    return np.arange(low, low + len(counts)), counts
+
+
+def get_histogram_bars(histogram):
+    """
+    Trims the empty bins off both ends of a unit width Aggregator.Histogram.
+    Returns:
+        tuple: The lower edge of each remaining bin and its count.
+    """
+
+    nonzero = np.flatnonzero(histogram.counts)
+    if len(nonzero) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    low, high = nonzero[0], nonzero[-1] + 1
+    return histogram.get_edges()[low:high].astype(int), histogram.counts[low:high]
+
+
+def get_histogram_stairs(histogram):
+    """
+    Trims the empty bins off both ends of an Aggregator.Histogram.
+    Returns:
+        tuple: The bin edges and the counts of the remaining bins.
+    """
+
+    nonzero = np.flatnonzero(histogram.counts)
+    if len(nonzero) == 0:
+        return [], []
+    low, high = nonzero[0], nonzero[-1] + 1
+    return histogram.get_edges()[low:high + 1], histogram.counts[low:high]
 
 
 class Experiment:
@@ -27,6 +158,38 @@ class Experiment:
         The strategy function to be used by the players (default is RANDOM_STRATEGY).
     results : list
         A list to store the results of each game played.
+    seed : int, optional
+        The master seed of the experiment.  If given, every game is seeded from it
+        (see get_game_seed), so the experiment can be reproduced.
+    cache : ResultCache, optional
+        A cache to load the results of games played before from, and to store new
+        results in (default is None).  Needs a seed; only the result records and
+        the aggregated results are kept, not the games.
+    keep_results : bool, optional
+        Whether to keep every game played (default is True).  If not, only the
+        aggregated results are kept, so memory does not grow with the number of games.
+    aggregator : ResultsAggregator
+        The streaming summary of all the games played.
+    instrumentation : Instrumentation.TurnInstrumentation or None
+        With instrument=True, where the time spent in each phase of the turns of all
+        the games played by run(), and why their turns were stuck, is added up.  Each
+        game kept in results also has its own.  Games loaded from a cache are not instrumented.
+    profile : bool, optional
+        Whether to profile the games with cProfile (default is False): in this process
+        for run(), in the worker processes that play them for SharedResults.run_shared
+        and SelfPlay.generate_self_play, and in every shard worker for a
+        Shards.ShardCoordinator made from the experiment (see merge_profile_stats there).
+    profile_stats : pstats.Stats or None
+        The profiles of all the processes that played games, merged; analyze_results
+        saves them as profile.pstats and profile.collapsed (for flame graphs).
+    status_path : str, optional
+        While the games are played, a JSON file of live progress metrics rewritten every
+        few seconds (see Progress.ExperimentProgress); by default none.
+    metrics_port : int, optional
+        While the games are played, serve the same metrics on http://127.0.0.1:<port>/metrics
+        in the Prometheus text format (0 picks a free port); by default none.
+    progress : Progress.ExperimentProgress or None
+        The live metrics of the last run, if asked for.
     Methods:
     --------
     run():
@@ -39,7 +202,8 @@ class Experiment:
 
 
 
-    def __init__(self, name, game_class, num_games, max_turns=None, num_players=4, winning_points=15, strategy=RANDOM_STRATEGY, strategies=None):
+    def __init__(self, name, game_class, num_games, max_turns=None, num_players=4, winning_points=15, strategy=RANDOM_STRATEGY, strategies=None, seed=None, cache=None, keep_results=True, instrument=False, profile=False,
+                 status_path=None, metrics_port=None):
         self.name = name
         self.game_class = game_class
         self.num_games = num_games
@@ -48,7 +212,23 @@ class Experiment:
         self.winning_points = winning_points
         self.strategies = strategies
         self.strategy = strategy
+        self.seed = seed
+        if cache is not None and seed is None:
+            raise ValueError("A cached experiment needs a seed")
+        self.cache = cache
+        self.keep_results = keep_results
         self.results = []
+        self.result_records = []
+        self.result_arrays = []
+        # set by SharedResults.run_shared, to keep its shared memory alive
+        self.shared_results = None
+        self.aggregator = ResultsAggregator(num_players, self.get_player_strategies(), max_num_turns=max_turns)
+        self.instrumentation = TurnInstrumentation() if instrument else None
+        self.profile = profile
+        self.profile_stats = None
+        self.status_path = status_path
+        self.metrics_port = metrics_port
+        self.progress = None
 
     def run(self):
         """
@@ -62,24 +242,165 @@ class Experiment:
             None
         """
 
+        self.progress = self.start_progress(self.num_games)
+        try:
+            if self.profile:
+                _, raw_stats = profile_call(self.play)
+                self.add_profile_stats(raw_stats)
+            else:
+                self.play()
+        finally:
+            if self.progress is not None:
+                self.progress.close()
+
+    def start_progress(self, num_games):
+        """
+        Starts publishing live metrics, if the experiment has a status_path or a metrics_port.
+        Args:
+            num_games (int): The number of games that are going to be played.
+        Returns:
+            Progress.ExperimentProgress or None: The progress to add the games to as they are played.
+        """
+
+        if self.status_path is None and self.metrics_port is None:
+            return None
+        progress = ExperimentProgress(self.name, num_games, self.get_player_labels(),
+                                      status_path=self.status_path, port=self.metrics_port)
+        return progress.start()
+
+    def play(self):
+        """
+        Plays the games of the experiment in this process (see run).
+        """
+
+        if self.cache is not None:
+            self.run_cached()
+            return
+
         for igame in range(self.num_games):
             game = self.game_class(
                 max_turns=self.max_turns, 
                 num_players=self.num_players,
                 winning_points=self.winning_points,
                 strategy=self.strategy,
-                strategies=self.strategies
+                strategies=self.strategies,
+                seed=None if self.seed is None else get_game_seed(self.seed, igame)
             )
             # game = self.game_class(max_turns=100, winning_points=1, strategy=RANDOM_STRATEGY)
+            if self.instrumentation is not None:
+                game.enable_instrumentation()
+            start_time = time.perf_counter()
             game.play_game(interactive=False)
+            if self.instrumentation is not None:
+                self.instrumentation.merge(game.instrumentation)
             # input(f"finished game {igame}")
-            self.results.append(copy.copy(game))
+            record = get_game_result(game)
+            self.aggregator.add(record)
+            if self.progress is not None:
+                self.progress.add_record(record, busy_seconds=time.perf_counter() - start_time)
+            if self.keep_results:
+                self.results.append(copy.copy(game))
+                self.result_records.append(record)
+
+    def run_cached(self):
+        """
+        Like run, but loads the games that are already in the cache, and only plays
+        (and then caches) the ranges of games that are not.
+        Returns:
+            None
+        """
+
+        config = self.get_game_config()
+        key = get_cache_key(config, self.seed)
+        missing_ranges = list(self.cache.get_missing_ranges(key, 0, self.num_games))
+        if self.progress is not None:
+            # only the games played count, not those loaded from the cache
+            self.progress.num_games = sum(stop - start for start, stop in missing_ranges)
+        for start, stop in missing_ranges:
+            seeds = [get_game_seed(self.seed, igame) for igame in range(start, stop)]
+            start_time = time.perf_counter()
+            results = play_games(seeds=seeds, **config)
+            if self.progress is not None:
+                self.progress.add_results(results, busy_seconds=time.perf_counter() - start_time)
+            # evicting now could drop ranges of this run before they are loaded
+            self.cache.store(key, start, stop, results, config=dict(config, seed=self.seed), evict=False)
+        self.add_results(self.cache.load(key, 0, self.num_games))
+        self.cache.evict()
+
+    def add_results(self, results):
+        """
+        Adds the results of games played elsewhere (e.g. loaded from a cache or
+        merged from shards) to the experiment.
+        Args:
+            results (np.ndarray): A results array (see Results.RESULT_DTYPE).
+        """
+
+        self.aggregator.add_results(results)
+        if self.keep_results:
+            self.result_arrays.append(results)
+
+    def add_profile_stats(self, raw_stats):
+        """
+        Merges the profile of some of the experiment's games, e.g. from a worker process.
+        Args:
+            raw_stats (dict): The raw stats of the profile (see Profiling.profile_call).
+        """
+
+        self.profile_stats = merge_stats(self.profile_stats, raw_stats)
+
+    def get_game_config(self):
+        """
+        Returns:
+            dict: The game class and the parameters each game of the experiment is created with.
+        """
+
+        return {
+            "game_class": self.game_class,
+            "num_players": self.num_players,
+            "max_turns": self.max_turns,
+            "winning_points": self.winning_points,
+            "strategy": self.strategy,
+            "strategies": self.strategies,
+        }
 
     def get_results(self):
         return self.results
-    
 
-    def analyze_results(self):
+    def get_results_array(self):
+        """
+        Returns:
+            np.ndarray: The results of the games played as a structured array (see Results.RESULT_DTYPE).
+        """
+
+        if self.result_records:
+            return np.concatenate([results_to_array(self.result_records)] + self.result_arrays)
+        if len(self.result_arrays) == 1:
+            # e.g. a view of shared memory, which is not copied
+            return self.result_arrays[0]
+        return np.concatenate(self.result_arrays) if self.result_arrays else results_to_array([])
+
+    def get_aggregator(self):
+        return self.aggregator
+
+    def get_player_strategies(self):
+        """
+        Returns:
+            list: The strategy of each player seat.
+        """
+
+        strategies = self.strategies if self.strategies is not None else [self.strategy] * self.num_players
+        return list(strategies[:self.num_players])
+
+    def get_player_labels(self):
+        """
+        Returns:
+            list: A label of the form "name=strategy" for each player seat.
+        """
+
+        return [f"player{i + 1}={strategy}" for i, strategy in enumerate(self.get_player_strategies())]
+
+
+    def analyze_results(self, workers=None):
         """
         Analyzes the results of the games and generates various histograms and bar charts.
         This method performs the following analyses:
@@ -88,9 +409,14 @@ class Experiment:
         3. Histogram of the number of turns played in games where players got stuck.
         4. Bar chart of the final states of the games.
         5. Histogram of the average scores in games that ended with winning points.
-        The histograms and bar charts are displayed using matplotlib.
+        6. Bar chart of the number of wins of each player.
+        The figures are rendered off screen and saved as PNGs, along with a summary.json
+        of the results, in a directory named after the experiment.
+        Args:
+            workers (int, optional): The number of processes to render the figures with.
+                                     By default they are rendered one after the other.
         Returns:
-            None
+            dict: The summary of the results.
         """
 
         # Create a directory based on the name of the experiment to store the results
@@ -108,79 +434,80 @@ class Experiment:
             "winning_points": self.winning_points,
             "strategy": self.strategy, 
             "strategies": self.strategies,
+            "seed": self.seed,
             # "results": [game.__dict__ for game in self.results]
         }
 
         with open(os.path.join(results_dir, 'experiment_attributes.json'), 'w') as json_file:
             json.dump(experiment_attributes, json_file, indent=4)
 
-        num_turns = [game.num_turns for game in self.results]
-        plt.hist(num_turns, bins=range(min(num_turns), max(num_turns) + 1), edgecolor='black')
-        title = f"{self.name}: Number of Turns Played"
-        plt.title(title)
-        plt.xlabel('Number of Turns')
-        plt.ylabel('Frequency')
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
-
-        num_turns = [int(100*(game.num_turns_take_two_coins / game.num_turns)) for game in self.results]
-        plt.hist(num_turns, bins=range(min(num_turns), max(num_turns) + 1), edgecolor='black')
-        title = f"{self.name}: Number of Turns Take Two div Played"
-        plt.title(title)
-        plt.xlabel('Number of Turns')
-        plt.ylabel('Frequency')
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
-
-        num_turns = [game.num_turns for game in self.results if game.final_state=="players_stuck"]
-        plt.hist(num_turns, bins=range(min(num_turns), max(num_turns) + 1), edgecolor='black')
-        title = f"{self.name}: Number of Turns Played (stuck)"
-        plt.title(title)
-        plt.xlabel('Number of Turns')
-        plt.ylabel('Frequency')
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
-
-        final_states = [game.final_state for game in self.results]
-        unique_states = list(set(final_states))
-        state_counts = {state: final_states.count(state) for state in unique_states}
-
-        plt.bar(state_counts.keys(), state_counts.values(), edgecolor='black')
-        title =f"{self.name}: Final States"
-        plt.title(title)
-        plt.xlabel('Final State')
-        plt.ylabel('Frequency')
-        plt.xticks(rotation=45)
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
-
-        average_scores = [game.get_average_score() for game in self.results if game.final_state == "winning_points"]
-        plt.hist(average_scores, bins=20, edgecolor='black')
-        title = f"{self.name}: Average Scores (winning)"
-        plt.title(title)
-        plt.xlabel('Average Score')
-        plt.ylabel('Frequency')
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
+        player_labels = self.get_player_labels()
+        if self.keep_results:
+            results = self.get_results_array()
+            summary = get_summary(results, self.num_players, player_labels)
+        else:
+            summary = self.aggregator.get_summary(player_labels)
+        with open(os.path.join(results_dir, 'summary.json'), 'w') as json_file:
+            json.dump(summary, json_file, indent=4)
+        if self.instrumentation is not None:
+            with open(os.path.join(results_dir, 'instrumentation.json'), 'w') as json_file:
+                json.dump(self.instrumentation.to_dict(), json_file, indent=4)
+        if self.profile_stats is not None:
+            self.profile_stats.dump_stats(os.path.join(results_dir, 'profile.pstats'))
+            write_collapsed_stacks(self.profile_stats, os.path.join(results_dir, 'profile.collapsed'))
+
+        specs = []
+
+        def add_figure(kind, title, x, y, xlabel, ylabel, rotate_xticks=False):
+            if len(x) == 0:
+                return
+            title = f"{self.name}: {title}"
+            specs.append(dict(
+                path=os.path.join(results_dir, f"{title}.png"),
+                kind=kind, title=title, x=x, y=y,
+                xlabel=xlabel, ylabel=ylabel, rotate_xticks=rotate_xticks))
+
+        if self.keep_results:
+            num_turns = get_integer_histogram(results["num_turns"])
+            two_coins = get_integer_histogram(get_two_coin_percentages(results))
+            stuck = results["final_state"] == FINAL_STATES.index("players_stuck")
+            num_turns_stuck = get_integer_histogram(results["num_turns"][stuck])
+            winning = results["final_state"] == FINAL_STATES.index("winning_points")
+            if winning.any():
+                counts, edges = np.histogram(get_average_scores(results[winning], self.num_players), bins=20)
+            else:
+                counts, edges = [], []
+            average_scores = (edges, counts)
+        else:
+            histograms = self.aggregator.histograms
+            num_turns = get_histogram_bars(histograms["num_turns"])
+            two_coins = get_histogram_bars(histograms["two_coin_percentage"])
+            num_turns_stuck = get_histogram_bars(histograms["num_turns_stuck"])
+            average_scores = get_histogram_stairs(histograms["average_score_winning"])
+
+        add_figure("bar", "Number of Turns Played", *num_turns, 'Number of Turns', 'Frequency')
+        add_figure("bar", "Number of Turns Take Two div Played", *two_coins, 'Number of Turns', 'Frequency')
+        add_figure("bar", "Number of Turns Played (stuck)", *num_turns_stuck, 'Number of Turns', 'Frequency')
+
+        state_counts = {state: count for state, count in summary["final_states"].items() if count}
+        add_figure("bar", "Final States", list(state_counts.keys()), list(state_counts.values()),
+                   'Final State', 'Frequency', rotate_xticks=True)
+
+        add_figure("hist", "Average Scores (winning)", *average_scores, 'Average Score', 'Frequency')
 
         # Plot the number of wins for each player
-        player_wins = {}
-        for game in self.results:
-            if game.winner is None:
-                continue
-            winner = game.winner.name + "=" + game.winner.strategy
-            if winner not in player_wins:
-                player_wins[winner] = 0
-            player_wins[winner] += 1
-
-        plt.bar(player_wins.keys(), player_wins.values(), edgecolor='black')
-        title = f"{self.name}: Player Wins"
-        plt.title(title)
-        plt.xlabel('Player')
-        plt.ylabel('Number of Wins')
-        plt.xticks(rotation=45)
-        plt.savefig(os.path.join(results_dir, f"{title}.png"))
-        plt.show()
+        player_wins = {label: count for label, count in summary["player_wins"].items() if count}
+        add_figure("bar", "Player Wins", list(player_wins.keys()), list(player_wins.values()),
+                   'Player', 'Number of Wins', rotate_xticks=True)
+
+        if workers is not None and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(_render_figure_spec, specs))
+        else:
+            for spec in specs:
+                render_figure(**spec)
+
+        return summary
 
 
 def main():
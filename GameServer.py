@@ -0,0 +1,443 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import time
+
+from Aggregator import Histogram, RunningStats
+from GameState import BuyCard, TakeCoins, get_legal_actions
+from Results import get_game_result
+from Splendor import CARD_CATALOG, COLORS, GOLD, NOBLE_CATALOG, STRATEGIES, Game
+
+# the strategy of the seats played by the agent that started the game
+AGENT = "AGENT"
+
+# how long an agent has to answer a turn, in seconds
+DEFAULT_MOVE_DEADLINE = 1.0
+
+# how many players a game can have
+MIN_PLAYERS = 2
+MAX_PLAYERS = 4
+
+# unless an agent asks for a limit, games stop after this many turns
+DEFAULT_MAX_TURNS = 500
+
+# the latencies of agents are kept in this many bins between 0 and the deadline
+NUM_LATENCY_BINS = 100
+
+
+def encode_card(card_id):
+    level, color, points, cost = CARD_CATALOG[card_id]
+    return {"card_id": card_id, "level": level, "color": color, "points": points, "cost": cost}
+
+
+def encode_state(state):
+    """
+    Describes a GameState as JSON for agents: everything a player at the table can see,
+    i.e. the market but not the order of the decks.
+    """
+
+    num_visible = state.rules.num_cards_visible
+    return {
+        "bank": dict(zip(COLORS + [GOLD], state.bank)),
+        "market": [[encode_card(card_id) for card_id in deck[:num_visible]] for deck in state.decks],
+        "deck_sizes": [max(len(deck) - num_visible, 0) for deck in state.decks],
+        "nobles": [{"noble_id": noble_id, "requirements": NOBLE_CATALOG[noble_id]} for noble_id in state.nobles],
+        "players": [{
+            "coins": dict(zip(COLORS + [GOLD], player.coins)),
+            "bonuses": dict(zip(COLORS, player.bonuses)),
+            "points": player.points,
+            "cards": list(player.cards),
+            "nobles": list(player.nobles),
+        } for player in state.players],
+        "turn": state.turn,
+        "num_turns": state.num_turns,
+    }
+
+
+def encode_action(action):
+    if isinstance(action, BuyCard):
+        return {"type": "buy", "card_id": action.card_id}
+    if isinstance(action, TakeCoins):
+        return {"type": "take", "colors": list(action.colors)}
+    return {"type": "pass"}
+
+
+class AgentLatency:
+    """
+    How quickly an agent answers its turns, in milliseconds, over all its connections.
+    """
+
+    def __init__(self, deadline):
+        self.stats = RunningStats()
+        self.histogram = Histogram(0, deadline * 1000, NUM_LATENCY_BINS)
+        self.num_timeouts = 0
+
+    def add(self, latency_ms):
+        self.stats.add(latency_ms)
+        self.histogram.add(latency_ms)
+
+    def get_summary(self):
+        return {
+            "num_moves": self.stats.count,
+            "num_timeouts": self.num_timeouts,
+            "mean_ms": self.stats.mean if self.stats.count else None,
+            "p50_ms": self.histogram.get_quantile(0.5),
+            "p95_ms": self.histogram.get_quantile(0.95),
+            "max_ms": self.stats.max,
+        }
+
+
+class AgentSession:
+    """
+    One connection of an agent: it writes messages to the agent and matches the
+    actions the agent sends back with the turns waiting for them.  The games of a
+    connection wait for the agent to read what was sent to it (see send), so an agent
+    that reads slowly slows down its games rather than growing the server's buffers.
+    """
+
+    def __init__(self, server, writer, name):
+        self.server = server
+        self.writer = writer
+        self.name = name
+        self.pending = {}
+        self.closed = False
+
+    def write(self, message):
+        """
+        Buffers a message for the agent; the caller drains the writer.
+        """
+
+        if not self.closed:
+            self.writer.write((json.dumps(message) + "\n").encode())
+
+    async def send(self, message):
+        """
+        Writes a message to the agent and waits until the writer's buffer is back under its limit.
+        """
+
+        self.write(message)
+        if self.closed:
+            return
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    def receive_action(self, message):
+        future = self.pending.get((message.get("game"), message.get("turn")))
+        if future is not None and not future.done():
+            future.set_result(message.get("action"))
+
+    def close(self):
+        self.closed = True
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"{self.name} disconnected"))
+
+    async def request_action(self, game_id, state, actions):
+        """
+        Sends a turn to the agent and waits for its answer until the move deadline.
+        Returns:
+            BuyCard, TakeCoins, Pass or None: The action chosen, or None if the agent
+                                              did not answer in time (or with a legal action).
+        """
+
+        if self.closed:
+            return None
+        latency = self.server.get_latency(self.name)
+        key = (game_id, state.num_turns)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        await self.send({
+            "type": "turn",
+            "game": game_id,
+            "turn": state.num_turns,
+            "seat": state.turn,
+            "state": encode_state(state),
+            "actions": [encode_action(action) for action in actions],
+            "deadline_ms": self.server.move_deadline * 1000,
+        })
+        # the deadline starts once the turn has been handed over to the agent
+        start = time.monotonic()
+        try:
+            index = await asyncio.wait_for(future, self.server.move_deadline)
+        except asyncio.TimeoutError:
+            latency.num_timeouts += 1
+            return None
+        except ConnectionError:
+            return None
+        finally:
+            self.pending.pop(key, None)
+        latency.add((time.monotonic() - start) * 1000)
+        if not isinstance(index, int) or not 0 <= index < len(actions):
+            await self.send({"type": "error", "game": game_id, "message": f"action must be an index below {len(actions)}"})
+            return None
+        return actions[index]
+
+
+class GameServer:
+    """
+    Hosts games for agents running in other processes, which connect over TCP or a
+    Unix socket and speak line-delimited JSON:
+        agent:  {"type": "hello", "agent": "<name>"}
+        agent:  {"type": "new_game", "ref": ..., "strategies": ["AGENT", "CHEAPEST"], "seed": 1, ...}
+        server: {"type": "game_started", "ref": ..., "game": <id>}
+        server: {"type": "turn", "game": <id>, "turn": <n>, "state": {...}, "actions": [...], "deadline_ms": ...}
+        agent:  {"type": "action", "game": <id>, "turn": <n>, "action": <index of one of the actions>}
+        server: {"type": "game_over", "game": <id>, "final_state": ..., "winner": <seat or null>, "scores": [...]}
+    Seats whose strategy is AGENT are played by the agent that started the game, the
+    others by the engine.  An agent that misses the deadline of a turn gets a random
+    legal action played for it.  Every game runs as a task on one event loop; engine
+    work runs in the loop's default executor so the loop keeps serving all the games.
+    Attributes:
+        move_deadline (float): The seconds an agent has to answer a turn.
+        results (list): The record of each finished game (see Results.get_game_result).
+        latencies (dict): The AgentLatency of each agent name.
+    """
+
+    def __init__(self, move_deadline=DEFAULT_MOVE_DEADLINE):
+        self.move_deadline = move_deadline
+        self.results = []
+        self.latencies = {}
+        self.game_ids = itertools.count()
+        self.connection_ids = itertools.count()
+        self.tasks = set()
+        self.connections = set()
+        self.sessions = set()
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """
+        Starts listening on a Unix socket if a path is given, otherwise on TCP.
+        Returns:
+            str or tuple: The path, or the host and (possibly picked) port, listened on.
+        """
+
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=path)
+            return path
+        self.server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """
+        Stops listening, and drops the games in progress and the connections.
+        """
+
+        self.server.close()
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # closing the connections lets their handlers see the end of the stream and return
+        for session in list(self.sessions):
+            session.writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def wait_for_games(self):
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks), return_exceptions=True)
+
+    def get_latency(self, name):
+        if name not in self.latencies:
+            self.latencies[name] = AgentLatency(self.move_deadline)
+        return self.latencies[name]
+
+    def get_latency_report(self):
+        return {name: latency.get_summary() for name, latency in self.latencies.items()}
+
+    async def handle_connection(self, reader, writer):
+        session = AgentSession(self, writer, f"agent{next(self.connection_ids)}")
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        self.sessions.add(session)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    self.handle_message(session, message)
+                except (ValueError, KeyError, TypeError) as error:
+                    session.write({"type": "error", "message": str(error)})
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            self.sessions.discard(session)
+            session.close()
+            writer.close()
+
+    def handle_message(self, session, message):
+        """
+        Handles a message of an agent; what it sends back is drained by handle_connection.
+        """
+
+        if message["type"] == "hello":
+            session.name = str(message["agent"])
+        elif message["type"] == "action":
+            session.receive_action(message)
+        elif message["type"] == "new_game":
+            strategies = message["strategies"]
+            unknown = [strategy for strategy in strategies if strategy not in STRATEGIES and strategy != AGENT]
+            settings = {
+                "max_turns": message.get("max_turns", DEFAULT_MAX_TURNS),
+                "winning_points": message.get("winning_points", 15),
+                "seed": message.get("seed"),
+            }
+            # JSON booleans are ints to Python, but not to agents
+            not_integers = [name for name, value in settings.items()
+                            if not (isinstance(value, int) and not isinstance(value, bool))
+                            and not (name == "seed" and value is None)]
+            error = None
+            if not MIN_PLAYERS <= len(strategies) <= MAX_PLAYERS:
+                error = f"A game needs {MIN_PLAYERS} to {MAX_PLAYERS} players, got {len(strategies)}"
+            elif unknown:
+                error = f"Unknown strategies {unknown}"
+            elif not_integers:
+                error = f"{', '.join(not_integers)} must be integers"
+            if error is not None:
+                session.write({"type": "error", "ref": message.get("ref"), "message": error})
+                return
+            game = Game(num_players=len(strategies), strategies=strategies, **settings)
+            game_id = next(self.game_ids)
+            session.write({"type": "game_started", "ref": message.get("ref"), "game": game_id})
+            task = asyncio.create_task(self.play_game(session, game_id, game))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            raise ValueError(f"Unknown message type {message['type']}")
+
+    @staticmethod
+    def take_turn(game, action):
+        game.take_turn(action)
+        if not game.validate_game_state():
+            raise RuntimeError("Game state is invalid.")
+        game.next_turn()
+
+    @classmethod
+    def advance(cls, game, action=None):
+        """
+        Plays the agent's action, if any, then the engine's seats until it is the agent's
+        turn again or the game is over, all in one go so each turn of the agent costs a
+        single trip to the executor.
+        Returns:
+            tuple: Whether the game is over, and if not, the state and the agent's legal actions.
+        """
+
+        if action is not None:
+            cls.take_turn(game, action)
+        while not game.is_game_over():
+            if game.get_current_player().strategy == AGENT:
+                state = game.get_state()
+                return False, state, get_legal_actions(state)
+            cls.take_turn(game, None)
+        return True, None, None
+
+    async def play_game(self, session, game_id, game):
+        loop = asyncio.get_running_loop()
+        try:
+            game_over, state, actions = await loop.run_in_executor(None, self.advance, game)
+            while not game_over:
+                action = await session.request_action(game_id, state, actions)
+                if action is None:
+                    action = game.random.choice(actions)
+                game_over, state, actions = await loop.run_in_executor(None, self.advance, game, action)
+        except Exception as error:
+            # the agent would otherwise wait for this game forever
+            logging.exception(f"game {game_id} of {session.name} failed")
+            await session.send({"type": "error", "game": game_id, "message": f"{type(error).__name__}: {error}"})
+            return
+
+        self.results.append(get_game_result(game))
+        await session.send({
+            "type": "game_over",
+            "game": game_id,
+            "final_state": game.final_state,
+            "winner": game.players.index(game.winner) if game.winner is not None else None,
+            "scores": [player.get_total_points() for player in game.players],
+        })
+        logging.info(f"game {game_id} of {session.name} is over: {game.final_state}")
+
+
+class StandInAgent:
+    """
+    A minimal agent for a GameServer, e.g. for tests: it starts some games and
+    answers each turn with the first legal action it is offered (buying a card
+    whenever it can), optionally after a delay.
+    """
+
+    def __init__(self, name="stand-in", delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.results = {}
+        self.errors = []
+
+    def choose(self, message):
+        return 0
+
+    async def play(self, games, host="127.0.0.1", port=None, path=None):
+        """
+        Args:
+            games (list): The new_game messages to send (without the type).
+        Returns:
+            dict: The game_over message of each game, by game id.  The error messages of
+                  games that were refused or failed are kept in errors.
+        """
+
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        writer.write((json.dumps({"type": "hello", "agent": self.name}) + "\n").encode())
+        for ref, game in enumerate(games):
+            writer.write((json.dumps(dict(game, type="new_game", ref=ref)) + "\n").encode())
+        await writer.drain()
+
+        answers = set()
+        while len(self.results) + len(self.errors) < len(games):
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["type"] == "turn":
+                answers.add(asyncio.create_task(self.answer(writer, message)))
+            elif message["type"] == "game_over":
+                self.results[message["game"]] = message
+            elif message["type"] == "error" and ("ref" in message or "game" in message):
+                self.errors.append(message)
+        for answer in answers:
+            answer.cancel()
+        writer.close()
+        return self.results
+
+    async def answer(self, writer, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        action = {"type": "action", "game": message["game"], "turn": message["turn"], "action": self.choose(message)}
+        writer.write((json.dumps(action) + "\n").encode())
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Host Splendor games for agents over line-delimited JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--deadline", type=float, default=DEFAULT_MOVE_DEADLINE, help="seconds per move")
+    args = parser.parse_args()
+
+    async def serve():
+        server = GameServer(move_deadline=args.deadline)
+        address = await server.start(host=args.host, port=args.port, path=args.unix)
+        print(f"listening on {address}")
+        await server.server.serve_forever()
+
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    main()
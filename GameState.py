@@ -0,0 +1,335 @@
+from itertools import combinations
+from typing import NamedTuple
+
+from Splendor import CARD_CATALOG, COLORS, GOLD, NOBLE_CATALOG, NOBLE_POINTS, BONUS_SHIFTS, Coin
+from Splendor import pack_bonuses, meets_requirements
+
+# the coin counts of a state hold one entry per color, then gold
+GOLD_INDEX = len(COLORS)
+NO_COINS = (0,) * (len(COLORS) + 1)
+NO_BONUSES = (0,) * len(COLORS)
+
+# the catalog in the shape step() needs it: per card_id, its level, color index, points and cost per color
+CARD_LEVELS = tuple(level for level, color, points, cost in CARD_CATALOG)
+CARD_COLORS = tuple(COLORS.index(color) for level, color, points, cost in CARD_CATALOG)
+CARD_POINTS = tuple(points for level, color, points, cost in CARD_CATALOG)
+CARD_COSTS = tuple(tuple(cost.get(color, 0) for color in COLORS) for level, color, points, cost in CARD_CATALOG)
+CARD_BONUSES = tuple(1 << BONUS_SHIFTS[color] for level, color, points, cost in CARD_CATALOG)
+
+# per noble_id, its requirements packed like PlayerState.packed_bonuses
+NOBLE_REQUIREMENTS = tuple(pack_bonuses(requirements) for requirements in NOBLE_CATALOG)
+
+
+class Rules(NamedTuple):
+    """
+    The settings of a game, which never change while it is played; every state of a game shares them.
+    """
+
+    num_players: int
+    winning_points: int
+    max_turns: int = None
+    max_coins_per_turn: int = 3
+    min_coins_for_two: int = 4
+    num_cards_visible: int = 4
+    max_coins: int = 10
+
+
+class PlayerState(NamedTuple):
+    """
+    Attributes:
+        coins (tuple): The number of coins of each color (in COLORS order), then of gold.
+        bonuses (tuple): The number of cards of each color.
+        points (int): The points of the player's cards and nobles.
+        cards (tuple): The card_ids of the player's cards, in the order they were bought.
+        nobles (tuple): The noble_ids of the nobles that visited the player.
+        packed_bonuses (int): The bonuses packed a byte per color (see Splendor.pack_bonuses).
+    """
+
+    coins: tuple = NO_COINS
+    bonuses: tuple = NO_BONUSES
+    points: int = 0
+    cards: tuple = ()
+    nobles: tuple = ()
+    packed_bonuses: int = 0
+
+
+class GameState(NamedTuple):
+    """
+    An immutable snapshot of a game.  step() returns a new state that shares every
+    part the action did not change (the rules, the untouched decks and players)
+    with the state it came from, so branching into many hypothetical futures only
+    allocates what each of them changes.
+    Attributes:
+        rules (Rules): The settings of the game.
+        bank (tuple): The number of coins of each color, then of gold, on the board.
+        decks (tuple): Per level, the card_ids of its deck; the first num_cards_visible are the market.
+        players (tuple): A PlayerState per seat.
+        nobles (tuple): The noble_ids of the nobles on the board.
+        turn (int): The seat of the player whose turn it is.
+        num_turns (int): The number of turns taken.
+        num_stuck_turns (int): The number of turns in a row in which nothing could be done.
+        num_turns_take_two_coins (int): The number of turns in which two coins of a color were taken.
+    """
+
+    rules: Rules
+    bank: tuple
+    decks: tuple
+    players: tuple
+    nobles: tuple = ()
+    turn: int = 0
+    num_turns: int = 0
+    num_stuck_turns: int = 0
+    num_turns_take_two_coins: int = 0
+
+
+class TakeCoins(NamedTuple):
+    """
+    Take one coin of each of up to max_coins_per_turn different colors, or two coins
+    of one color, e.g. TakeCoins(("red", "red")).
+    """
+
+    colors: tuple
+
+
+class BuyCard(NamedTuple):
+    """
+    Buy a card of the market.
+    """
+
+    card_id: int
+
+
+class Pass(NamedTuple):
+    """
+    Do nothing, because nothing can be done; this counts as a stuck turn.
+    """
+
+
+def get_payment(player, card_id):
+    """
+    Works out what a player would spend to buy a card, the same way Player.get_payment does:
+    each color is covered by bonuses, then coins of that color, then gold.
+    Returns:
+        tuple or None: The coins spent per color and gold, or None if the player cannot afford the card.
+    """
+
+    spent = []
+    gold = 0
+    for cost, bonus, coins in zip(CARD_COSTS[card_id], player.bonuses, player.coins):
+        pay = min(max(cost - bonus, 0), coins)
+        spent.append(pay)
+        gold += max(cost - bonus, 0) - pay
+    if gold > player.coins[GOLD_INDEX]:
+        return None
+    spent.append(gold)
+    return tuple(spent)
+
+
+def is_legal_take(state, colors):
+    """
+    Returns:
+        bool: Whether the current player may take coins of these colors.
+    """
+
+    rules = state.rules
+    player = state.players[state.turn]
+    if not colors or sum(player.coins) + len(colors) > rules.max_coins:
+        return False
+    indices = [COLORS.index(color) for color in colors if color in COLORS]
+    if len(indices) != len(colors):
+        return False
+    if len(colors) == 2 and indices[0] == indices[1]:
+        return state.bank[indices[0]] >= rules.min_coins_for_two
+    return (len(set(indices)) == len(indices) <= rules.max_coins_per_turn
+            and all(state.bank[index] > 0 for index in indices))
+
+
+def step(state, action):
+    """
+    Plays the current player's action, lets a noble visit them if their cards now
+    reach its requirements (the same way Game.visit_noble does) and passes the turn on.
+    Args:
+        state (GameState): The state to play from; it is not changed.
+        action (TakeCoins, BuyCard or Pass): The action of the current player.
+    Returns:
+        GameState: The state after the action.
+    Raises:
+        ValueError: If the action is not allowed in this state.
+    """
+
+    seat = state.turn
+    player = state.players[seat]
+    bank = state.bank
+    decks = state.decks
+    nobles = state.nobles
+    num_stuck_turns = 0
+    num_turns_take_two_coins = state.num_turns_take_two_coins
+
+    if isinstance(action, TakeCoins):
+        if not is_legal_take(state, action.colors):
+            raise ValueError(f"{action} is not allowed")
+        bank = list(bank)
+        coins = list(player.coins)
+        for color in action.colors:
+            index = COLORS.index(color)
+            bank[index] -= 1
+            coins[index] += 1
+        bank = tuple(bank)
+        player = player._replace(coins=tuple(coins))
+        if len(action.colors) == 2 and action.colors[0] == action.colors[1]:
+            num_turns_take_two_coins += 1
+    elif isinstance(action, BuyCard):
+        card_id = action.card_id
+        level = CARD_LEVELS[card_id]
+        deck = decks[level]
+        if card_id not in deck[:state.rules.num_cards_visible]:
+            raise ValueError(f"{action} is not a card of the market")
+        spent = get_payment(player, card_id)
+        if spent is None:
+            raise ValueError(f"{action} cannot be afforded")
+        bank = tuple(count + pay for count, pay in zip(bank, spent))
+        bonuses = list(player.bonuses)
+        bonuses[CARD_COLORS[card_id]] += 1
+        player = player._replace(
+            coins=tuple(count - pay for count, pay in zip(player.coins, spent)),
+            bonuses=tuple(bonuses),
+            points=player.points + CARD_POINTS[card_id],
+            cards=player.cards + (card_id,),
+            packed_bonuses=player.packed_bonuses + CARD_BONUSES[card_id])
+        decks = decks[:level] + (tuple(other for other in deck if other != card_id),) + decks[level + 1:]
+    elif isinstance(action, Pass):
+        num_stuck_turns = state.num_stuck_turns + 1
+    else:
+        raise ValueError(f"Unknown action {action}")
+
+    for noble_id in nobles:
+        if meets_requirements(player.packed_bonuses, NOBLE_REQUIREMENTS[noble_id]):
+            player = player._replace(points=player.points + NOBLE_POINTS, nobles=player.nobles + (noble_id,))
+            nobles = tuple(other for other in nobles if other != noble_id)
+            break
+
+    return GameState(
+        rules=state.rules,
+        bank=bank,
+        decks=decks,
+        players=state.players[:seat] + (player,) + state.players[seat + 1:],
+        nobles=nobles,
+        turn=(seat + 1) % len(state.players),
+        num_turns=state.num_turns + 1,
+        num_stuck_turns=num_stuck_turns,
+        num_turns_take_two_coins=num_turns_take_two_coins)
+
+
+def get_legal_actions(state):
+    """
+    Lists what the current player can do: buy any affordable card of the market, take
+    one coin of each of as many different colors as allowed, or two coins of one color.
+    Only when none of these are possible, Pass.
+    Returns:
+        list: The actions.
+    """
+
+    rules = state.rules
+    player = state.players[state.turn]
+    actions = [BuyCard(card_id) for deck in state.decks for card_id in deck[:rules.num_cards_visible]
+               if get_payment(player, card_id) is not None]
+
+    room = rules.max_coins - sum(player.coins)
+    available = [color for color, count in zip(COLORS, state.bank) if count > 0]
+    num_colors = min(rules.max_coins_per_turn, len(available), room)
+    if num_colors > 0:
+        actions += [TakeCoins(colors) for colors in combinations(available, num_colors)]
+    if room >= 2:
+        actions += [TakeCoins((color, color)) for color, count in zip(COLORS, state.bank)
+                    if count >= rules.min_coins_for_two]
+    return actions or [Pass()]
+
+
+def get_final_state(state):
+    """
+    Checks whether the game is over, the same way Game.is_game_over does.
+    Returns:
+        tuple: The final state (one of FINAL_STATES) and the winner's seat, each None if there is none.
+    """
+
+    rules = state.rules
+    if rules.max_turns is not None and state.num_turns >= rules.max_turns:
+        return "max_turns", None
+    for seat, player in enumerate(state.players):
+        if player.points >= rules.winning_points:
+            return "winning_points", seat
+    if state.num_stuck_turns == rules.num_players:
+        return "players_stuck", None
+    return None, None
+
+
+def get_game_state(game):
+    """
+    Takes a snapshot of a (mutable) Game.
+    Returns:
+        GameState: The state of the game.
+    """
+
+    rules = Rules(
+        num_players=game.num_players,
+        winning_points=game.winning_points,
+        max_turns=game.max_turns,
+        max_coins_per_turn=game.max_coins_per_turn,
+        min_coins_for_two=game.min_coins_for_two,
+        num_cards_visible=game.num_cards_visible,
+        max_coins=game.players[0].max_coins if game.players else 10)
+    players = []
+    for player in game.players:
+        coins_dict = player.get_coins_dict()
+        cards_dict = player.get_cards_dict()
+        players.append(PlayerState(
+            coins=tuple(coins_dict[color] for color in COLORS) + (coins_dict.get(GOLD, 0),),
+            bonuses=tuple(cards_dict[color] for color in COLORS),
+            points=player.get_total_points(),
+            cards=tuple(card.card_id for card in player.cards),
+            nobles=tuple(noble.noble_id for noble in player.nobles),
+            packed_bonuses=player.packed_bonuses))
+    return GameState(
+        rules=rules,
+        bank=tuple(len(game.coins[color]) for color in COLORS) + (len(game.gold),),
+        decks=tuple(tuple(card.card_id for card in cards) for cards in game.cards),
+        players=tuple(players),
+        nobles=tuple(noble.noble_id for noble in game.nobles),
+        turn=game.turn,
+        num_turns=game.num_turns,
+        num_stuck_turns=game.num_stuck_turns,
+        num_turns_take_two_coins=game.num_turns_take_two_coins)
+
+
+def set_game_state(game, state):
+    """
+    Makes a (mutable) Game match a state of it, e.g. one reached with step().
+    The game keeps its players (and their strategies) and its card and noble objects.
+    """
+
+    nobles = {noble.noble_id: noble for noble in game.nobles}
+    nobles.update((noble.noble_id, noble) for player in game.players for noble in player.nobles)
+    game.nobles = [nobles[noble_id] for noble_id in state.nobles]
+    for noble in game.nobles:
+        noble.owner = None
+
+    game.deck_tracker = None
+    cards = {card.card_id: card for cards in game.cards for card in cards}
+    cards.update((card.card_id, card) for player in game.players for card in player.cards)
+    game.cards = [[cards[card_id] for card_id in deck] for deck in state.decks]
+    game.coins = {color: [Coin(color, None) for _ in range(count)] for color, count in zip(COLORS, state.bank)}
+    game.gold = [Coin(GOLD, None, wild=True) for _ in range(state.bank[GOLD_INDEX])]
+    for player, player_state in zip(game.players, state.players):
+        player.cards = []
+        player.packed_bonuses = 0
+        for card_id in player_state.cards:
+            player.add_card(cards[card_id])
+        player.nobles = [nobles[noble_id] for noble_id in player_state.nobles]
+        for noble in player.nobles:
+            noble.owner = player.name
+        player.coins = [Coin(color, player.name) for color, count in zip(COLORS, player_state.coins) for _ in range(count)]
+        player.coins += [Coin(GOLD, player.name, wild=True) for _ in range(player_state.coins[GOLD_INDEX])]
+    game.turn = state.turn
+    game.num_turns = state.num_turns
+    game.num_stuck_turns = state.num_stuck_turns
+    game.num_turns_take_two_coins = state.num_turns_take_two_coins
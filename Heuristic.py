@@ -0,0 +1,125 @@
+import functools
+import json
+import os
+
+from AffordTable import get_card_turns
+from GameState import CARD_COSTS, CARD_POINTS, TakeCoins, get_legal_actions, step
+
+# where the HEURISTIC strategy loads its weights from, unless told otherwise
+DEFAULT_HEURISTIC_PATH = os.environ.get("SPLENDOR_HEURISTIC", "heuristic.json")
+
+# what the heuristic looks at in the position an action leads to, for the player who took it
+HEURISTIC_FEATURES = [
+    "points",         # the player's points
+    "cards",          # the number of cards (permanent bonuses) the player has
+    "coins",          # the number of coins the player holds
+    "shortfall",      # the coins still missing for the cheapest card of the market
+    "target_points",  # the points of that card
+    "turns",          # the fewest turns of taking coins before the player can buy a card of the market
+    "diversity",      # the number of colors the player has a bonus in
+    "two_coins",      # 1 if the action took two coins of one color
+]
+
+# weights that play about like CHEAPEST_STRATEGY: buy whatever is closest, preferring points
+DEFAULT_HEURISTIC_WEIGHTS = {
+    "points": 3.0,
+    "cards": 1.0,
+    "coins": 0.1,
+    "shortfall": -1.0,
+    "target_points": 0.5,
+    "turns": 0.0,
+    "diversity": 0.2,
+    "two_coins": 0.0,
+}
+
+# the turns feature when no card of the market can be reached, one more than any reachable card takes
+UNREACHABLE_TURNS = 6
+
+
+def get_heuristic_features(state, seat, action, with_turns=True):
+    """
+    Args:
+        state (GameState): The position an action led to.
+        seat (int): The seat of the player who took the action.
+        action (BuyCard, TakeCoins or Pass): The action.
+        with_turns (bool): Whether to work out the turns feature, the most costly one;
+                           it is 0 otherwise.
+    Returns:
+        dict: The value of each of the HEURISTIC_FEATURES.
+    """
+
+    player = state.players[seat]
+    shortfall = None
+    target_points = 0
+    turns = UNREACHABLE_TURNS if with_turns else 0
+    for deck in state.decks:
+        for card_id in deck[:state.rules.num_cards_visible]:
+            if with_turns:
+                turns = min(turns, get_card_turns(player, card_id, state.rules.max_coins))
+            missing = sum(max(cost - bonus - coins, 0)
+                          for cost, bonus, coins in zip(CARD_COSTS[card_id], player.bonuses, player.coins))
+            if shortfall is None or missing < shortfall or (missing == shortfall and CARD_POINTS[card_id] > target_points):
+                shortfall = missing
+                target_points = CARD_POINTS[card_id]
+    two_coins = isinstance(action, TakeCoins) and len(action.colors) == 2 and action.colors[0] == action.colors[1]
+    return {
+        "points": player.points,
+        "cards": len(player.cards),
+        "coins": sum(player.coins),
+        "shortfall": shortfall or 0,
+        "target_points": target_points,
+        "turns": turns,
+        "diversity": sum(1 for bonus in player.bonuses if bonus > 0),
+        "two_coins": 1 if two_coins else 0,
+    }
+
+
+def choose_heuristic_action(state, weights):
+    """
+    Picks the legal action of the player to move whose resulting position scores highest:
+    the sum of each of the HEURISTIC_FEATURES times its weight.
+    Returns:
+        BuyCard, TakeCoins or Pass: The action.
+    """
+
+    actions = get_legal_actions(state)
+    if len(actions) == 1:
+        return actions[0]
+    best_action = None
+    best_score = None
+    with_turns = weights.get("turns", 0.0) != 0
+    for action in actions:
+        features = get_heuristic_features(step(state, action), state.turn, action, with_turns)
+        score = sum(weights.get(name, 0.0) * value for name, value in features.items())
+        if best_score is None or score > best_score:
+            best_action = action
+            best_score = score
+    return best_action
+
+
+def save_heuristic_weights(path, weights, **info):
+    """
+    Writes a strategy file for the HEURISTIC strategy.
+    Args:
+        info: Anything else worth keeping with the weights, e.g. how they were tuned.
+    """
+
+    with open(path, 'w') as json_file:
+        json.dump(dict(info, strategy="HEURISTIC", weights=weights), json_file, indent=4)
+
+
+def load_heuristic_weights(path):
+    with open(path) as json_file:
+        strategy_file = json.load(json_file)
+    return dict(DEFAULT_HEURISTIC_WEIGHTS, **strategy_file["weights"])
+
+
+@functools.lru_cache(maxsize=None)
+def get_heuristic_weights(path=DEFAULT_HEURISTIC_PATH):
+    """
+    Loads the weights in a strategy file, once per process; without the file, the defaults.
+    """
+
+    if not os.path.exists(path):
+        return dict(DEFAULT_HEURISTIC_WEIGHTS)
+    return load_heuristic_weights(path)
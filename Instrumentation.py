@@ -0,0 +1,91 @@
+import functools
+import time
+
+# where a turn spends its time; "turn" is whatever take_turn does outside the other phases
+PHASES = ["card_evaluation", "affordability", "coin_selection", "payment", "validation", "turn"]
+
+# why a player's turn was stuck (see Game.get_stuck_cause)
+STUCK_CAUSES = ["coin_cap", "bank_empty", "no_needed_color", "no_affordable_card"]
+
+
+class TurnInstrumentation:
+    """
+    Times the phases of turns and counts why turns were stuck, for one game or, merged,
+    for many.  The time of a phase called from within another one only counts for the
+    inner phase, so no time is counted twice.
+    Attributes:
+        phase_seconds (dict): The time spent in each of the PHASES.
+        phase_calls (dict): How many times each phase was entered.
+        stuck_causes (dict): How many stuck turns each of the STUCK_CAUSES explains.
+        num_games (int): The number of games recorded.
+        num_turns (int): The number of turns recorded.
+    """
+
+    def __init__(self):
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.phase_calls = dict.fromkeys(PHASES, 0)
+        self.stuck_causes = dict.fromkeys(STUCK_CAUSES, 0)
+        self.num_games = 0
+        self.num_turns = 0
+        # per phase being timed: its name, when it started and the time of the phases within it
+        self.stack = []
+
+    def enter(self, phase):
+        self.stack.append([phase, time.perf_counter(), 0.0])
+
+    def exit(self):
+        phase, start, inner_seconds = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.phase_seconds[phase] += elapsed - inner_seconds
+        self.phase_calls[phase] += 1
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def add_stuck_turn(self, cause):
+        self.stuck_causes[cause] += 1
+
+    def merge(self, other):
+        """
+        Adds the records of another instrumentation, e.g. of another game, to this one.
+        """
+
+        for phase in PHASES:
+            self.phase_seconds[phase] += other.phase_seconds[phase]
+            self.phase_calls[phase] += other.phase_calls[phase]
+        for cause in STUCK_CAUSES:
+            self.stuck_causes[cause] += other.stuck_causes[cause]
+        self.num_games += other.num_games
+        self.num_turns += other.num_turns
+
+    def to_dict(self):
+        return {
+            "num_games": self.num_games,
+            "num_turns": self.num_turns,
+            "phase_seconds": dict(self.phase_seconds),
+            "phase_calls": dict(self.phase_calls),
+            "microseconds_per_turn": {phase: 1e6 * seconds / max(self.num_turns, 1)
+                                      for phase, seconds in self.phase_seconds.items()},
+            "stuck_causes": dict(self.stuck_causes),
+        }
+
+
+def instrumented(phase):
+    """
+    Times a method of a Game or a Player as one of the PHASES when the object has an
+    instrumentation; otherwise the method is called straight away, so the cost when
+    instrumentation is off is one attribute check.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if instrumentation is None:
+                return method(self, *args, **kwargs)
+            instrumentation.enter(phase)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                instrumentation.exit()
+        return wrapper
+    return decorator
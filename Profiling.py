@@ -0,0 +1,109 @@
+import cProfile
+import pstats
+
+# stacks deeper than this are cut off in the collapsed stacks
+MAX_STACK_DEPTH = 64
+
+
+class _RawStats:
+    """
+    Lets pstats.Stats load the raw stats of a profile run elsewhere, e.g. in a worker process.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_call(function, *args, **kwargs):
+    """
+    Calls a function under cProfile.
+    Returns:
+        tuple: What the function returned, and the raw stats of the profile (a picklable
+               dict, see merge_stats).
+    """
+
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    profiler.create_stats()
+    return result, profiler.stats
+
+
+def merge_stats(stats, raw_stats):
+    """
+    Adds the raw stats of a profile to merged stats.
+    Args:
+        stats (pstats.Stats or None): The stats merged so far.
+        raw_stats (dict): The raw stats of a profile (see profile_call).
+    Returns:
+        pstats.Stats or None: The merged stats.
+    """
+
+    if not raw_stats:
+        return stats
+    if stats is None:
+        return pstats.Stats(_RawStats(dict(raw_stats)))
+    return stats.add(pstats.Stats(_RawStats(dict(raw_stats))))
+
+
+def get_function_label(function):
+    filename, line, name = function
+    if filename == "~":
+        # a builtin, e.g. "<built-in method builtins.len>"
+        return name
+    return f"{filename.rsplit('/', 1)[-1]}:{name}:{line}"
+
+
+def get_collapsed_stacks(stats, max_depth=MAX_STACK_DEPTH):
+    """
+    Turns profile stats into collapsed stacks ("root;caller;function microseconds" per
+    line), the input of flame graph tools.  cProfile only records which function called
+    which, not whole stacks, so each function's time is shared out over the paths it is
+    reached by in proportion to the time spent in it through each of its callers.
+    Recursion is cut at the first repeated function.
+    Returns:
+        dict: The microseconds of own time of each stack (a tuple of function labels).
+    """
+
+    raw_stats = stats.stats
+    callees = {}
+    for function, (calls, primitive_calls, own_time, cumulative_time, callers) in raw_stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((function, caller_stats[3]))
+
+    stacks = {}
+
+    def walk(function, path, fraction):
+        calls, primitive_calls, own_time, cumulative_time, callers = raw_stats[function]
+        if cumulative_time * fraction * 1e6 < 1:
+            return
+        path = path + (get_function_label(function),)
+        microseconds = own_time * fraction * 1e6
+        if microseconds >= 1:
+            stacks[path] = stacks.get(path, 0) + microseconds
+        if len(path) >= max_depth:
+            return
+        for callee, edge_time in callees.get(function, []):
+            callee_time = raw_stats[callee][3]
+            if callee_time <= 0 or get_function_label(callee) in path:
+                continue
+            walk(callee, path, fraction * min(edge_time / callee_time, 1.0))
+
+    for function, (calls, primitive_calls, own_time, cumulative_time, callers) in raw_stats.items():
+        if not callers:
+            walk(function, (), 1.0)
+    return {stack: int(round(microseconds)) for stack, microseconds in stacks.items() if round(microseconds) > 0}
+
+
+def write_collapsed_stacks(stats, path, max_depth=MAX_STACK_DEPTH):
+    """
+    Writes the collapsed stacks of profile stats (see get_collapsed_stacks) to a file,
+    heaviest first.
+    """
+
+    stacks = get_collapsed_stacks(stats, max_depth)
+    with open(path, 'w') as stacks_file:
+        for stack, microseconds in sorted(stacks.items(), key=lambda item: item[1], reverse=True):
+            stacks_file.write(f"{';'.join(stack)} {microseconds}\n")
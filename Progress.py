@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from Results import FINAL_STATES, NO_WINNER, results_to_array
+
+# how often the status file is rewritten, in seconds
+DEFAULT_STATUS_INTERVAL = 5.0
+METRICS_PREFIX = "splendor_experiment"
+
+
+class ProgressHandler(BaseHTTPRequestHandler):
+    """
+    Serves the metrics of the server's ExperimentProgress: /metrics in the Prometheus
+    text format, /status as JSON.
+    """
+
+    def do_GET(self):
+        progress = self.server.progress
+        if self.path == "/metrics":
+            body = progress.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/status":
+            body = json.dumps(progress.get_metrics(), indent=4).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"progress endpoint: {format % args}")
+
+
+class ExperimentProgress:
+    """
+    Live metrics of an experiment being played: games completed, throughput, ETA, how
+    busy each worker is, how the games ended so far and each seat's share of the wins.
+    They can be served over HTTP (see ProgressHandler) and written to a status file,
+    which is rewritten every interval seconds while the experiment runs.
+    Games are added from the thread playing them (or collecting them from worker
+    processes); the server and the status file read them from their own threads.
+    Attributes:
+        name (str): The name of the experiment, a label of every metric.
+        num_games (int): The number of games the run will play.
+        port (int or None): The port of the HTTP endpoint once started (a free one if 0 was asked for).
+    """
+
+    def __init__(self, name, num_games, player_labels, status_path=None, port=None, host="127.0.0.1",
+                 interval=DEFAULT_STATUS_INTERVAL):
+        self.name = name
+        self.num_games = num_games
+        self.player_labels = list(player_labels)
+        self.status_path = status_path
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.games_completed = 0
+        self.turns_completed = 0
+        self.final_states = np.zeros(len(FINAL_STATES), dtype=np.int64)
+        self.seat_wins = np.zeros(len(self.player_labels), dtype=np.int64)
+        self.worker_games = {}
+        self.worker_busy_seconds = {}
+        self.start_time = None
+        self.end_time = None
+        self.server = None
+        self.threads = []
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.start_time = time.monotonic()
+        if self.port is not None:
+            self.server = ThreadingHTTPServer((self.host, self.port), ProgressHandler)
+            self.server.progress = self
+            self.port = self.server.server_address[1]
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        if self.status_path is not None:
+            self.threads.append(threading.Thread(target=self.write_status_periodically, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def close(self):
+        """
+        Stops the endpoint and writes the final status.
+        """
+
+        self.end_time = time.monotonic()
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.status_path is not None:
+            self.write_status()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_results(self, results, worker="main", busy_seconds=0.0):
+        """
+        Args:
+            results (np.ndarray): The results of games just played (see Results.RESULT_DTYPE).
+            worker (str): Who played them, e.g. a worker process.
+            busy_seconds (float): How long the worker took to play them.
+        """
+
+        final_states = results["final_state"]
+        winners = results["winner"]
+        with self.lock:
+            self.games_completed += len(results)
+            self.turns_completed += int(results["num_turns"].sum())
+            self.final_states += np.bincount(final_states[final_states >= 0], minlength=len(FINAL_STATES))
+            self.seat_wins += np.bincount(winners[winners != NO_WINNER], minlength=len(self.seat_wins))[:len(self.seat_wins)]
+            self.worker_games[worker] = self.worker_games.get(worker, 0) + len(results)
+            self.worker_busy_seconds[worker] = self.worker_busy_seconds.get(worker, 0.0) + busy_seconds
+
+    def add_record(self, record, worker="main", busy_seconds=0.0):
+        """
+        Adds one game (see Results.get_game_result).
+        """
+
+        self.add_results(results_to_array([record]), worker, busy_seconds)
+
+    def get_metrics(self):
+        """
+        Returns:
+            dict: A snapshot of the metrics.
+        """
+
+        with self.lock:
+            now = self.end_time if self.end_time is not None else time.monotonic()
+            elapsed = now - self.start_time if self.start_time is not None else 0.0
+            games_per_second = self.games_completed / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.num_games - self.games_completed, 0)
+            total_wins = int(self.seat_wins.sum())
+            return {
+                "name": self.name,
+                "num_games": self.num_games,
+                "games_completed": self.games_completed,
+                "turns_completed": self.turns_completed,
+                "elapsed_seconds": elapsed,
+                "games_per_second": games_per_second,
+                "turns_per_second": self.turns_completed / elapsed if elapsed > 0 else 0.0,
+                "eta_seconds": remaining / games_per_second if games_per_second > 0 else None,
+                "final_states": {state: int(count) for state, count in zip(FINAL_STATES, self.final_states)},
+                "win_shares": {label: int(wins) / total_wins if total_wins else 0.0
+                               for label, wins in zip(self.player_labels, self.seat_wins)},
+                "workers": {str(worker): {
+                    "games": self.worker_games[worker],
+                    "busy_seconds": self.worker_busy_seconds[worker],
+                    "utilization": self.worker_busy_seconds[worker] / elapsed if elapsed > 0 else 0.0,
+                } for worker in self.worker_games},
+            }
+
+    def to_prometheus(self):
+        """
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+
+        metrics = self.get_metrics()
+        experiment = self.name.replace('\\', '\\\\').replace('"', '\\"')
+        lines = []
+
+        def add(name, kind, help_text, samples):
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join([f'experiment="{experiment}"'] + [f'{key}="{label}"' for key, label in labels])
+                lines.append(f"{METRICS_PREFIX}_{name}{{{label_text}}} {float(value)}")
+
+        add("games", "gauge", "Games the run will play.", [((), metrics["num_games"])])
+        add("games_completed", "counter", "Games played so far.", [((), metrics["games_completed"])])
+        add("turns_completed", "counter", "Turns played so far.", [((), metrics["turns_completed"])])
+        add("elapsed_seconds", "gauge", "Seconds since the run started.", [((), metrics["elapsed_seconds"])])
+        add("games_per_second", "gauge", "Games played per second since the run started.", [((), metrics["games_per_second"])])
+        add("turns_per_second", "gauge", "Turns played per second since the run started.", [((), metrics["turns_per_second"])])
+        if metrics["eta_seconds"] is not None:
+            add("eta_seconds", "gauge", "Seconds until the run is expected to finish.", [((), metrics["eta_seconds"])])
+        add("final_states", "counter", "Games played so far by how they ended.",
+            [((("final_state", state),), count) for state, count in metrics["final_states"].items()])
+        add("win_share", "gauge", "Each seat's share of the games won so far.",
+            [((("player", label),), share) for label, share in metrics["win_shares"].items()])
+        add("worker_games", "counter", "Games played by each worker.",
+            [((("worker", worker),), stats["games"]) for worker, stats in metrics["workers"].items()])
+        add("worker_utilization", "gauge", "The fraction of the run each worker spent playing games.",
+            [((("worker", worker),), stats["utilization"]) for worker, stats in metrics["workers"].items()])
+        return "\n".join(lines) + "\n"
+
+    def write_status(self):
+        # written aside then renamed, so readers never see a half written file
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, 'w') as json_file:
+            json.dump(self.get_metrics(), json_file, indent=4)
+        os.replace(tmp_path, self.status_path)
+
+    def write_status_periodically(self):
+        self.write_status()
+        while not self.stop_event.wait(self.interval):
+            self.write_status()
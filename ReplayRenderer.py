@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pygame
+
+import SplendorPyGame
+from SplendorPyGame import BoardRenderer, WHITE
+from Experiment import get_game_seed
+
+# how long each frame of a GIF is shown, in milliseconds
+GIF_FRAME_DURATION = 200
+
+REPLAY_FORMATS = ["png", "gif"]
+
+
+def init_headless():
+    """
+    Initializes pygame without a window; run once per process before rendering.
+    """
+
+    if SplendorPyGame.screen is None:
+        SplendorPyGame.initPyGame(headless=True)
+
+
+def iter_replay_frames(game, every=1):
+    """
+    Plays a game turn by turn, rendering the board offscreen after every few turns.
+    The same surface is updated (only its changed regions) and yielded for each
+    frame, so copy it if it must outlive the next frame.
+    Args:
+        game (Game): The game to play; it must not have been played yet.
+        every (int): Render a frame every this many turns.  The start and the end
+                     of the game are always rendered.
+    Yields:
+        pygame.Surface: The board.
+    """
+
+    init_headless()
+    surface = pygame.Surface((SplendorPyGame.SCREEN_WIDTH, SplendorPyGame.SCREEN_HEIGHT))
+    surface.fill(WHITE)
+    renderer = BoardRenderer(surface)
+    renderer.render(game)
+    yield surface
+    while not game.is_game_over():
+        game.take_turn()
+        if not game.validate_game_state():
+            raise RuntimeError("Game state is invalid.")
+        game.next_turn()
+        if game.num_turns % every == 0 or game.is_game_over():
+            renderer.render(game)
+            yield surface
+
+
+def save_png_sequence(game, output_dir, every=1):
+    """
+    Renders a game to one PNG per frame, named frame00000.png, frame00001.png, ...
+    Returns:
+        list: The paths of the PNGs.
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for iframe, surface in enumerate(iter_replay_frames(game, every)):
+        path = os.path.join(output_dir, f"frame{iframe:05d}.png")
+        pygame.image.save(surface, path)
+        paths.append(path)
+    return paths
+
+
+def save_gif(game, path, every=1, frame_duration=GIF_FRAME_DURATION):
+    """
+    Renders a game to an animated GIF (this needs Pillow).
+    Returns:
+        str: The path of the GIF.
+    """
+
+    from PIL import Image
+
+    frames = []
+    for surface in iter_replay_frames(game, every):
+        frame = Image.frombytes("RGB", surface.get_size(), pygame.image.tobytes(surface, "RGB"))
+        frames.append(frame.quantize(colors=64))
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=frame_duration, loop=0)
+    return path
+
+
+def render_replay(job):
+    """
+    Replays a game and renders it.
+    Args:
+        job (dict): The game_class and keyword arguments of the game (including its seed),
+                    plus where the replay goes ("output": a directory for "png", a file for "gif"),
+                    its "format" and optionally "every".
+    Returns:
+        str or list: The path of the GIF, or the paths of the PNGs.
+    """
+
+    job = dict(job)
+    game_class = job.pop("game_class")
+    output = job.pop("output")
+    replay_format = job.pop("format")
+    every = job.pop("every", 1)
+    game = game_class(**job)
+    if replay_format == "png":
+        return save_png_sequence(game, output, every)
+    elif replay_format == "gif":
+        return save_gif(game, output, every)
+    raise ValueError(f"Unknown replay format {replay_format}, expected one of {REPLAY_FORMATS}")
+
+
+def get_experiment_replay_jobs(experiment, igames, output_dir, replay_format="gif", every=1):
+    """
+    Builds the jobs (see render_replay) replaying some games of a seeded experiment.
+    Returns:
+        list: One job per game, writing to output_dir/game<igame>[.gif].
+    """
+
+    if experiment.seed is None:
+        raise ValueError("Only the games of a seeded experiment can be replayed")
+    jobs = []
+    for igame in igames:
+        output = os.path.join(output_dir, f"game{igame}" + (".gif" if replay_format == "gif" else ""))
+        job = experiment.get_game_config()
+        job.update(seed=get_game_seed(experiment.seed, igame), output=output, format=replay_format, every=every)
+        jobs.append(job)
+    return jobs
+
+
+def render_replays(jobs, workers=None):
+    """
+    Renders many replays in parallel, each worker process rendering headless.
+    Args:
+        jobs (list): The replays to render (see render_replay).
+        workers (int, optional): The number of processes; by default one per core.
+    Returns:
+        list: What render_replay returned for each job, in order.
+    """
+
+    for job in jobs:
+        output_dir = os.path.dirname(job["output"]) if job["format"] == "gif" else job["output"]
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_headless) as executor:
+        return list(executor.map(render_replay, jobs))
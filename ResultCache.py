@@ -0,0 +1,183 @@
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+
+import CardsLevel0
+import CardsLevel1
+import CardsLevel2
+import Results
+from Results import RESULT_DTYPE
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "splendor")
+
+# 1 GB
+DEFAULT_MAX_BYTES = 2**30
+
+
+def get_engine_version(game_class):
+    """
+    Fingerprints the code that decides the results of a game: the module of the game
+    class, the card definitions and the layout of the results.  Any edit to these
+    gives a new fingerprint, so results of an older engine are never reused.
+    Returns:
+        str: The fingerprint.
+    """
+
+    digest = hashlib.sha1()
+    for module in [inspect.getmodule(game_class), CardsLevel0, CardsLevel1, CardsLevel2, Results]:
+        with open(inspect.getsourcefile(module), 'rb') as source_file:
+            digest.update(source_file.read())
+    return digest.hexdigest()[:16]
+
+
+def get_cache_key(config, seed):
+    """
+    Args:
+        config (dict): The game_class, num_players, max_turns, winning_points, strategy
+                       and strategies of an experiment (see Experiment.get_game_config).
+        seed (int): The master seed of the experiment.
+    Returns:
+        str: The content address of the experiment's results.
+    """
+
+    key = {name: value for name, value in config.items() if name != "game_class"}
+    key["game_class"] = config["game_class"].__name__
+    key["engine_version"] = get_engine_version(config["game_class"])
+    key["seed"] = seed
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    An on disk cache of experiment results.
+    Results are stored per cache key (see get_cache_key) as ranges of games,
+    game i of an experiment being the one played with get_game_seed(seed, i), so
+    an experiment can reuse whatever ranges of its games were played before.
+    When the cache grows past max_bytes the least recently used ranges are evicted.
+    Attributes:
+        cache_dir (str): The directory the results are stored in.
+        max_bytes (int): The most the stored results may take up on disk.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get_ranges(self, key):
+        """
+        Returns:
+            list: The sorted (start, stop) ranges of games stored for the key.
+        """
+
+        key_dir = self.get_key_dir(key)
+        if not os.path.isdir(key_dir):
+            return []
+        ranges = []
+        for file_name in os.listdir(key_dir):
+            if file_name.endswith(".npy"):
+                start, stop = file_name[:-len(".npy")].split("_")
+                ranges.append((int(start), int(stop)))
+        return sorted(ranges)
+
+    def get_missing_ranges(self, key, start, stop):
+        """
+        Returns:
+            list: The (start, stop) ranges of games between start and stop that are not stored for the key.
+        """
+
+        missing = []
+        for range_start, range_stop in self.get_ranges(key):
+            if range_stop <= start or range_start >= stop:
+                continue
+            if range_start > start:
+                missing.append((start, range_start))
+            start = max(start, range_stop)
+            if start >= stop:
+                break
+        if start < stop:
+            missing.append((start, stop))
+        return missing
+
+    def load(self, key, start, stop):
+        """
+        Loads the results of games start to stop, which must all be stored for the key.
+        Returns:
+            np.ndarray: The results (see Results.RESULT_DTYPE), in the order of the games.
+        """
+
+        if self.get_missing_ranges(key, start, stop):
+            raise KeyError(f"Games {start} to {stop} are not all cached for {key}")
+        results = np.zeros(stop - start, dtype=RESULT_DTYPE)
+        for range_start, range_stop in self.get_ranges(key):
+            low, high = max(start, range_start), min(stop, range_stop)
+            if low >= high:
+                continue
+            path = self.get_range_path(key, range_start, range_stop)
+            stored = np.load(path)
+            results[low - start:high - start] = stored[low - range_start:high - range_start]
+            # mark as recently used
+            os.utime(path)
+        return results
+
+    def get_range_path(self, key, start, stop):
+        return os.path.join(self.get_key_dir(key), f"{start}_{stop}.npy")
+
+    def store(self, key, start, stop, results, config=None, evict=True):
+        """
+        Stores the results of games start to stop for the key, then evicts
+        the least recently used ranges if the cache is over its size cap.
+        Args:
+            config (dict, optional): Stored next to the results, to make the cache easier to inspect.
+            evict (bool): Whether to evict now; a caller that is about to load ranges it
+                          just stored can evict once it has loaded them instead.
+        """
+
+        if len(results) != stop - start:
+            raise ValueError(f"Expected {stop - start} results, not {len(results)}")
+        key_dir = self.get_key_dir(key)
+        os.makedirs(key_dir, exist_ok=True)
+        if config is not None:
+            with open(os.path.join(key_dir, "config.json"), 'w') as json_file:
+                json.dump(config, json_file, indent=4, default=str)
+        # write then rename, so readers never see a partial file
+        path = self.get_range_path(key, start, stop)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as npy_file:
+            np.save(npy_file, np.asarray(results, dtype=RESULT_DTYPE))
+        os.replace(tmp_path, path)
+        if evict:
+            self.evict()
+
+    def get_size(self):
+        return sum(os.path.getsize(path) for path in self.get_range_paths())
+
+    def get_range_paths(self):
+        paths = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            paths += [os.path.join(root, file_name) for file_name in file_names if file_name.endswith(".npy")]
+        return paths
+
+    def evict(self):
+        """
+        Removes the least recently used ranges until the cache fits in max_bytes.
+        Returns:
+            int: The number of ranges removed.
+        """
+
+        entries = [(os.path.getmtime(path), os.path.getsize(path), path) for path in self.get_range_paths()]
+        size = sum(entry_size for _, entry_size, _ in entries)
+        num_evicted = 0
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            os.remove(path)
+            size -= entry_size
+            num_evicted += 1
+        return num_evicted
@@ -0,0 +1,135 @@
+import numpy as np
+
+# the ways a game can end, in the order of their codes in the results
+from Splendor import FINAL_STATES
+
+# code used when a game has no final state or no winner (yet)
+NO_FINAL_STATE = -1
+NO_WINNER = -1
+
+# the most players a game of Splendor can have
+MAX_PLAYERS = 4
+
+# one fixed-width record per game played
+RESULT_DTYPE = np.dtype([
+    ("num_turns", np.int32),
+    ("num_turns_take_two_coins", np.int32),
+    ("final_state", np.int8),
+    ("winner", np.int8),
+    ("scores", np.int16, (MAX_PLAYERS,)),
+])
+
+
+def get_game_result(game):
+    """
+    Reduces a finished game to the fixed-width record stored for it in the results.
+    Args:
+        game (Game): The game that was played.
+    Returns:
+        tuple: The record for the game, in the layout of RESULT_DTYPE.
+    """
+
+    if len(game.players) > MAX_PLAYERS:
+        raise ValueError(f"Results only hold up to {MAX_PLAYERS} players, not {len(game.players)}")
+    final_state = FINAL_STATES.index(game.final_state) if game.final_state in FINAL_STATES else NO_FINAL_STATE
+    winner = game.players.index(game.winner) if game.winner is not None else NO_WINNER
+    scores = [player.get_total_points() for player in game.players]
+    scores += [0] * (MAX_PLAYERS - len(scores))
+    return (game.num_turns, game.num_turns_take_two_coins, final_state, winner, scores)
+
+
+def results_to_array(results):
+    """
+    Converts a list of game records (see get_game_result) into a results array.
+    Args:
+        results (list): The records of the games played.
+    Returns:
+        np.ndarray: A structured array of RESULT_DTYPE, one element per game.
+    """
+
+    return np.array(results, dtype=RESULT_DTYPE)
+
+
+def get_two_coin_percentages(results):
+    """
+    Returns:
+        np.ndarray: For each game, the percentage of turns in which two coins were taken.
+    """
+
+    num_turns = np.maximum(results["num_turns"], 1)
+    return (100 * results["num_turns_take_two_coins"]) // num_turns
+
+
+def get_average_scores(results, num_players):
+    """
+    Returns:
+        np.ndarray: For each game, the average score of its players.
+    """
+
+    return results["scores"][:, :num_players].mean(axis=1)
+
+
+def get_final_state_counts(results):
+    """
+    Returns:
+        dict: How many games ended in each of the FINAL_STATES.
+    """
+
+    codes = results["final_state"]
+    counts = np.bincount(codes[codes != NO_FINAL_STATE], minlength=len(FINAL_STATES))
+    return {state: int(count) for state, count in zip(FINAL_STATES, counts)}
+
+
+def get_win_counts(results, player_labels):
+    """
+    Args:
+        player_labels (list): A label for each player seat.
+    Returns:
+        dict: How many games each player seat won.
+    """
+
+    winners = results["winner"]
+    counts = np.bincount(winners[winners != NO_WINNER], minlength=len(player_labels))
+    return {label: int(count) for label, count in zip(player_labels, counts)}
+
+
+def get_mean_turns_by_final_state(results):
+    """
+    Returns:
+        dict: The mean number of turns of the games that ended in each of the FINAL_STATES,
+              or None for states no game ended in.
+    """
+
+    codes = results["final_state"]
+    played = codes != NO_FINAL_STATE
+    counts = np.bincount(codes[played], minlength=len(FINAL_STATES))
+    totals = np.bincount(codes[played], weights=results["num_turns"][played], minlength=len(FINAL_STATES))
+    return {state: (float(total / count) if count else None)
+            for state, total, count in zip(FINAL_STATES, totals, counts)}
+
+
+def get_summary(results, num_players, player_labels):
+    """
+    Summarizes a results array into plain numbers that can be written out as JSON.
+    Args:
+        results (np.ndarray): The results array of the games played.
+        num_players (int): The number of players in each game.
+        player_labels (list): A label for each player seat.
+    Returns:
+        dict: The summary of the results.
+    """
+
+    num_turns = results["num_turns"]
+    two_coins = get_two_coin_percentages(results)
+    return {
+        "num_games": int(len(results)),
+        "num_turns_mean": float(num_turns.mean()) if len(results) else None,
+        "num_turns_std": float(num_turns.std()) if len(results) else None,
+        "num_turns_min": int(num_turns.min()) if len(results) else None,
+        "num_turns_max": int(num_turns.max()) if len(results) else None,
+        "two_coin_percentage_mean": float(two_coins.mean()) if len(results) else None,
+        "average_score_mean": float(get_average_scores(results, num_players).mean()) if len(results) else None,
+        "final_states": get_final_state_counts(results),
+        "num_turns_mean_by_final_state": get_mean_turns_by_final_state(results),
+        "player_wins": get_win_counts(results, player_labels),
+    }
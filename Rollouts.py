@@ -0,0 +1,116 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+from Experiment import get_game_seed
+from Splendor import Game
+
+# z of the two-sided 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+
+def get_wilson_interval(successes, trials, z=CONFIDENCE_Z):
+    """
+    The Wilson score interval of a proportion, which stays sensible for proportions near 0 or 1.
+    Returns:
+        tuple: The low and high ends of the interval, or (None, None) without trials.
+    """
+
+    if trials == 0:
+        return None, None
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    center = (p + z**2 / (2 * trials)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2)) / denominator
+    return max(center - spread, 0.0), min(center + spread, 1.0)
+
+
+def redraw_decks(game):
+    """
+    Reshuffles the hidden part of each deck (every card but the market), since
+    nobody playing from this position knows the order it will be drawn in.
+    """
+
+    for level, cards in enumerate(game.cards):
+        hidden = cards[game.num_cards_visible:]
+        game.random.shuffle(hidden)
+        game.cards[level] = cards[:game.num_cards_visible] + hidden
+
+
+def play_rollouts(data, seeds, game_class=Game):
+    """
+    Plays one rollout per seed from a packed position (see Game.to_bytes) to the end of the game.
+    Returns:
+        list: The seat of the winner (or None) and the number of turns played, per rollout.
+    """
+
+    outcomes = []
+    for seed in seeds:
+        game = game_class.from_bytes(data, seed=seed)
+        start_turns = game.num_turns
+        redraw_decks(game)
+        game.play_game(interactive=False)
+        winner = game.players.index(game.winner) if game.winner is not None else None
+        outcomes.append((winner, game.num_turns - start_turns))
+    return outcomes
+
+
+def get_rollout_summary(outcomes, player_labels):
+    """
+    Summarizes the outcomes of rollouts (see play_rollouts).
+    Returns:
+        dict: Per player, the probability of winning with its 95% confidence interval;
+              the same for no one winning; and the mean number of remaining turns with its 95% confidence interval.
+    """
+
+    num_rollouts = len(outcomes)
+    wins = [0] * len(player_labels)
+    for winner, num_turns in outcomes:
+        if winner is not None:
+            wins[winner] += 1
+    num_no_winner = num_rollouts - sum(wins)
+
+    def get_probability(successes):
+        low, high = get_wilson_interval(successes, num_rollouts)
+        return {"probability": successes / num_rollouts if num_rollouts else None, "low": low, "high": high}
+
+    turns = [num_turns for winner, num_turns in outcomes]
+    turns_mean = sum(turns) / num_rollouts if num_rollouts else None
+    turns_interval = (None, None)
+    if num_rollouts > 1:
+        std = math.sqrt(sum((num_turns - turns_mean)**2 for num_turns in turns) / (num_rollouts - 1))
+        spread = CONFIDENCE_Z * std / math.sqrt(num_rollouts)
+        turns_interval = (turns_mean - spread, turns_mean + spread)
+
+    return {
+        "num_rollouts": num_rollouts,
+        "win_probabilities": {label: get_probability(count) for label, count in zip(player_labels, wins)},
+        "no_winner": get_probability(num_no_winner),
+        "remaining_turns_mean": turns_mean,
+        "remaining_turns_low": turns_interval[0],
+        "remaining_turns_high": turns_interval[1],
+    }
+
+
+def run_rollouts(game, num_rollouts, seed=0, workers=None, chunk_size=50):
+    """
+    Estimates how likely each player is to win a game in progress, by playing it
+    to the end many times from its current position with the players' current
+    strategies and the hidden part of the decks redrawn for each rollout.
+    The game itself is not changed: each rollout starts from its packed state (see Game.to_bytes).
+    Args:
+        game (Game): The game in progress.
+        num_rollouts (int): The number of rollouts.
+        seed (int): Rollout k is played with get_game_seed(seed, k), so the estimate can be reproduced.
+        workers (int, optional): The number of worker processes; by default one per core.
+        chunk_size (int): The number of rollouts each task plays.
+    Returns:
+        dict: The summary of the rollouts (see get_rollout_summary), with player names as labels.
+    """
+
+    data = game.to_bytes()
+    seeds = [get_game_seed(seed, irollout) for irollout in range(num_rollouts)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_rollouts, data, seeds[start:start + chunk_size], type(game))
+                   for start in range(0, num_rollouts, chunk_size)]
+        outcomes = [outcome for future in futures for outcome in future.result()]
+    return get_rollout_summary(outcomes, [player.name for player in game.players])
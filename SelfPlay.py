@@ -0,0 +1,184 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from Experiment import get_game_seed
+from Profiling import profile_call
+from StateEncoder import ENCODING_VERSION, FEATURE_SIZE, encode_state, get_action_index, infer_action
+
+# one row per position: its features, the action the player to move took, and how
+# the game ended for that player (1 won, -1 another player won, 0 nobody won)
+DATASET_DTYPE = np.dtype([
+    ("features", np.float32, (FEATURE_SIZE,)),
+    ("action", np.int16),
+    ("outcome", np.int8),
+])
+
+
+class SelfPlayDataset:
+    """
+    A dataset of self-play positions on disk, which grows as more games are played.
+    The rows (see DATASET_DTYPE) are appended to a flat binary file and read back
+    through a memory map, so no run ever holds the whole dataset in memory.
+    The directory holds:
+        positions.bin   the rows
+        dataset.json    the encoding version, the number of rows and the number of games played
+    Attributes:
+        path (str): The dataset directory.
+        num_rows (int): The number of rows.
+        num_games (int): The number of games the rows come from.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows_path = os.path.join(path, "positions.bin")
+        self.metadata_path = os.path.join(path, "dataset.json")
+        os.makedirs(path, exist_ok=True)
+        self.num_rows = 0
+        self.num_games = 0
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path) as json_file:
+                metadata = json.load(json_file)
+            if metadata["encoding_version"] != ENCODING_VERSION or metadata["feature_size"] != FEATURE_SIZE:
+                raise ValueError(f"{path} holds encoding version {metadata['encoding_version']}, not {ENCODING_VERSION}")
+            self.num_rows = metadata["num_rows"]
+            self.num_games = metadata["num_games"]
+        # drop the tail of an append that was interrupted before the metadata was written
+        if os.path.exists(self.rows_path) and os.path.getsize(self.rows_path) != self.num_rows * DATASET_DTYPE.itemsize:
+            with open(self.rows_path, 'r+b') as rows_file:
+                rows_file.truncate(self.num_rows * DATASET_DTYPE.itemsize)
+
+    def write_metadata(self):
+        metadata = {
+            "encoding_version": ENCODING_VERSION,
+            "feature_size": FEATURE_SIZE,
+            "num_rows": self.num_rows,
+            "num_games": self.num_games,
+        }
+        tmp_path = f"{self.metadata_path}.tmp"
+        with open(tmp_path, 'w') as json_file:
+            json.dump(metadata, json_file, indent=4)
+        os.replace(tmp_path, self.metadata_path)
+
+    def append(self, rows, num_games):
+        """
+        Appends the rows of some games to the dataset.
+        """
+
+        with open(self.rows_path, 'ab') as rows_file:
+            rows.tofile(rows_file)
+        self.num_rows += len(rows)
+        self.num_games += num_games
+        self.write_metadata()
+
+    def get_rows(self):
+        """
+        Returns:
+            np.ndarray: A read-only memory map of all the rows.
+        """
+
+        if self.num_rows == 0:
+            return np.zeros(0, dtype=DATASET_DTYPE)
+        return np.memmap(self.rows_path, dtype=DATASET_DTYPE, mode='r', shape=(self.num_rows,))
+
+
+def play_self_play_games(game_class, num_players, max_turns, winning_points, strategy, strategies, seeds, profile=False):
+    """
+    Plays one game per seed, recording every position before each turn.
+    Args:
+        profile (bool): Whether to play the games under cProfile (see Experiment.play_games).
+    Returns:
+        np.ndarray: The rows of the games (see DATASET_DTYPE), game after game; with
+                    profile, a tuple of the rows and the raw stats of the profile.
+    """
+
+    if profile:
+        return profile_call(play_self_play_games, game_class, num_players, max_turns, winning_points, strategy,
+                            strategies, seeds)
+    games_rows = []
+    for seed in seeds:
+        game = game_class(
+            max_turns=max_turns,
+            num_players=num_players,
+            winning_points=winning_points,
+            strategy=strategy,
+            strategies=strategies,
+            seed=seed
+        )
+        features = []
+        actions = []
+        seats = []
+        state = game.get_state()
+        while not game.is_game_over():
+            game.take_turn()
+            if not game.validate_game_state():
+                raise RuntimeError("Game state is invalid.")
+            game.next_turn()
+            next_state = game.get_state()
+            features.append(encode_state(state))
+            actions.append(get_action_index(infer_action(state, next_state)))
+            seats.append(state.turn)
+            state = next_state
+
+        rows = np.zeros(len(features), dtype=DATASET_DTYPE)
+        if features:
+            rows["features"] = features
+            rows["action"] = actions
+            if game.winner is not None:
+                seats = np.array(seats)
+                rows["outcome"] = np.where(seats == game.players.index(game.winner), 1, -1)
+        games_rows.append(rows)
+    return np.concatenate(games_rows) if games_rows else np.zeros(0, dtype=DATASET_DTYPE)
+
+
+def generate_self_play(dataset, experiment, workers=None, chunk_size=20):
+    """
+    Plays the games of an experiment in a process pool and appends their positions
+    to a dataset, chunk by chunk as they finish.  Each run continues the game numbering
+    of the dataset, so with a seeded experiment every game of every run is a different one.
+    If the experiment profiles its games, they are profiled in the workers and the
+    profiles are merged into the experiment's profile_stats.
+    Args:
+        dataset (SelfPlayDataset): The dataset to grow.
+        experiment (Experiment): The games to play; its num_games are played in this run.
+        workers (int, optional): The number of worker processes; by default one per core.
+        chunk_size (int): The number of games each task plays.
+    Returns:
+        int: The number of rows appended.
+    """
+
+    config = experiment.get_game_config()
+    first_game = dataset.num_games
+    games = range(first_game, first_game + experiment.num_games)
+    if experiment.seed is None:
+        seeds = [None] * len(games)
+    else:
+        seeds = [get_game_seed(experiment.seed, igame) for igame in games]
+
+    # only keep a few chunks in flight, so finished chunks never pile up in memory
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+    num_rows = 0
+
+    def append_next():
+        start, future = pending.popleft()
+        rows = future.result()
+        if experiment.profile:
+            rows, raw_stats = rows
+            experiment.add_profile_stats(raw_stats)
+        dataset.append(rows, len(seeds[start:start + chunk_size]))
+        return len(rows)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(seeds), chunk_size):
+            future = executor.submit(play_self_play_games, seeds=seeds[start:start + chunk_size],
+                                     profile=experiment.profile, **config)
+            pending.append((start, future))
+            if len(pending) >= max_pending:
+                num_rows += append_next()
+        while pending:
+            num_rows += append_next()
+    return num_rows
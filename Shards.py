@@ -0,0 +1,299 @@
+import argparse
+import importlib
+import json
+import marshal
+import os
+import socket
+import time
+
+import numpy as np
+
+from Experiment import get_game_seed, play_games
+from Profiling import merge_stats
+from Results import RESULT_DTYPE
+
+# a lease that has not been renewed for this many seconds belongs to a crashed worker
+DEFAULT_LEASE_TIMEOUT = 300
+
+# how often an idle worker looks for units to claim, in seconds
+POLL_INTERVAL = 1.0
+
+
+def get_class_path(cls):
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def load_class(class_path):
+    module_name, class_name = class_path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def write_atomically(path, write):
+    """
+    Writes a file by writing a temporary file next to it and renaming it,
+    so that readers on any node see either nothing or the whole file.
+    Args:
+        write (callable): Called with the open (binary) temporary file.
+    """
+
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as tmp_file:
+        write(tmp_file)
+    os.replace(tmp_path, path)
+
+
+class ShardCoordinator:
+    """
+    Splits the games of one experiment into units of work in a spool directory
+    on a shared filesystem, so that workers on any number of nodes can play them
+    without any other coordination.
+    The spool directory holds:
+        job.json            the game configuration, master seed and number of games
+        units/<unit>.json   the range of games of each unit
+        leases/<unit>.lease the worker currently playing a unit; renewed while it plays
+        results/<unit>.npy  the results of each finished unit
+        results/<unit>.prof the raw profile stats of each finished unit, for a profiled job
+    A worker claims a unit by creating its lease file exclusively.  A lease that
+    has not been renewed for lease_timeout seconds is considered abandoned and the
+    unit can be claimed again by another worker.
+    Attributes:
+        spool_dir (str): The spool directory.
+        lease_timeout (float): The seconds after which a lease is abandoned.
+    """
+
+    def __init__(self, spool_dir, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.spool_dir = spool_dir
+        self.lease_timeout = lease_timeout
+        self.units_dir = os.path.join(spool_dir, "units")
+        self.leases_dir = os.path.join(spool_dir, "leases")
+        self.results_dir = os.path.join(spool_dir, "results")
+
+    def create_job(self, config, seed, num_games, unit_size=100, profile=False):
+        """
+        Writes the job and its units of work to the spool directory.
+        Args:
+            config (dict): The game configuration (see Experiment.get_game_config).
+            seed (int): The master seed; game i is played with get_game_seed(seed, i).
+            num_games (int): The number of games to play.
+            unit_size (int): The number of games per unit.
+            profile (bool): Whether the workers profile the games they play.
+        Returns:
+            list: The names of the units.
+        """
+
+        for directory in [self.units_dir, self.leases_dir, self.results_dir]:
+            os.makedirs(directory, exist_ok=True)
+        job = dict(config, game_class=get_class_path(config["game_class"]), seed=seed, num_games=num_games,
+                   profile=profile)
+        write_atomically(os.path.join(self.spool_dir, "job.json"), lambda f: f.write(json.dumps(job, indent=4).encode()))
+        units = []
+        for start in range(0, num_games, unit_size):
+            stop = min(start + unit_size, num_games)
+            unit = f"{start:012d}_{stop:012d}"
+            unit_json = json.dumps({"start": start, "stop": stop}).encode()
+            write_atomically(os.path.join(self.units_dir, f"{unit}.json"), lambda f: f.write(unit_json))
+            units.append(unit)
+        return units
+
+    @classmethod
+    def from_experiment(cls, experiment, spool_dir, unit_size=100, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        """
+        Creates the spool directory for the games of a seeded experiment.  If the
+        experiment profiles its games, so do the workers (see merge_profile_stats).
+        """
+
+        if experiment.seed is None:
+            raise ValueError("Only a seeded experiment can be sharded")
+        coordinator = cls(spool_dir, lease_timeout)
+        coordinator.create_job(experiment.get_game_config(), experiment.seed, experiment.num_games, unit_size,
+                               profile=experiment.profile)
+        return coordinator
+
+    def get_job(self):
+        with open(os.path.join(self.spool_dir, "job.json")) as json_file:
+            return json.load(json_file)
+
+    def get_units(self):
+        return sorted(file_name[:-len(".json")] for file_name in os.listdir(self.units_dir) if file_name.endswith(".json"))
+
+    def get_unit_range(self, unit):
+        with open(os.path.join(self.units_dir, f"{unit}.json")) as json_file:
+            unit_range = json.load(json_file)
+        return unit_range["start"], unit_range["stop"]
+
+    def get_result_path(self, unit):
+        return os.path.join(self.results_dir, f"{unit}.npy")
+
+    def get_profile_path(self, unit):
+        return os.path.join(self.results_dir, f"{unit}.prof")
+
+    def get_lease_path(self, unit):
+        return os.path.join(self.leases_dir, f"{unit}.lease")
+
+    def is_done(self, unit):
+        return os.path.exists(self.get_result_path(unit))
+
+    def get_pending_units(self):
+        return [unit for unit in self.get_units() if not self.is_done(unit)]
+
+    def is_lease_abandoned(self, unit):
+        try:
+            return time.time() - os.path.getmtime(self.get_lease_path(unit)) > self.lease_timeout
+        except FileNotFoundError:
+            return False
+
+    def claim(self, unit, worker_id):
+        """
+        Tries to take the lease of a unit, stealing it if it was abandoned.
+        Returns:
+            bool: True if this worker now holds the lease.
+        """
+
+        if self.is_done(unit):
+            return False
+        lease_path = self.get_lease_path(unit)
+        if self.is_lease_abandoned(unit):
+            # only one of the workers racing to steal it gets to rename it
+            abandoned_path = f"{lease_path}.{worker_id}.abandoned"
+            try:
+                os.rename(lease_path, abandoned_path)
+            except FileNotFoundError:
+                return False
+            if time.time() - os.path.getmtime(abandoned_path) <= self.lease_timeout:
+                # another worker stole it first, and this is its new lease: put it back
+                try:
+                    os.link(abandoned_path, lease_path)
+                except FileExistsError:
+                    pass
+                os.remove(abandoned_path)
+                return False
+            os.remove(abandoned_path)
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as lease_file:
+            lease_file.write(json.dumps({"worker": worker_id, "claimed": time.time()}))
+        return True
+
+    def renew(self, unit):
+        try:
+            os.utime(self.get_lease_path(unit))
+        except FileNotFoundError:
+            # the lease was taken over and released; the results are the same either way
+            pass
+
+    def release(self, unit):
+        try:
+            os.remove(self.get_lease_path(unit))
+        except FileNotFoundError:
+            pass
+
+    def run_unit(self, unit, job=None, heartbeat=10):
+        """
+        Plays the games of a unit (whose lease is held) and writes its results.
+        Args:
+            heartbeat (int): Renew the lease after this many games.
+        """
+
+        job = self.get_job() if job is None else job
+        config = {name: job[name] for name in ["num_players", "max_turns", "winning_points", "strategy", "strategies"]}
+        game_class = load_class(job["game_class"])
+        profile = job.get("profile", False)
+        start, stop = self.get_unit_range(unit)
+        results = []
+        profile_stats = None
+        for igame in range(start, stop, heartbeat):
+            seeds = [get_game_seed(job["seed"], i) for i in range(igame, min(igame + heartbeat, stop))]
+            played = play_games(game_class=game_class, seeds=seeds, profile=profile, **config)
+            if profile:
+                played, raw_stats = played
+                profile_stats = merge_stats(profile_stats, raw_stats)
+            results.append(played)
+            self.renew(unit)
+        results = np.concatenate(results) if results else np.zeros(0, dtype=RESULT_DTYPE)
+        # written before the results, so a finished unit of a profiled job always has its profile
+        if profile_stats is not None:
+            write_atomically(self.get_profile_path(unit), lambda f: marshal.dump(profile_stats.stats, f))
+        write_atomically(self.get_result_path(unit), lambda f: np.save(f, results))
+        self.release(unit)
+
+    def run_worker(self, worker_id=None, max_units=None, wait=True):
+        """
+        Claims and plays units until every unit is done.
+        Args:
+            worker_id (str, optional): Names this worker in its leases; by default host and pid.
+            max_units (int, optional): Stop after playing this many units.
+            wait (bool): Whether to wait for units leased by other workers, in case
+                         their leases are abandoned, rather than returning.
+        Returns:
+            int: The number of units this worker played.
+        """
+
+        worker_id = f"{socket.gethostname()}-{os.getpid()}" if worker_id is None else worker_id
+        job = self.get_job()
+        num_units = 0
+        while max_units is None or num_units < max_units:
+            pending = self.get_pending_units()
+            if not pending:
+                break
+            claimed = next((unit for unit in pending if self.claim(unit, worker_id)), None)
+            if claimed is None:
+                if not wait:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            self.run_unit(claimed, job)
+            num_units += 1
+        return num_units
+
+    def merge(self):
+        """
+        Combines the results of all the units, which must all be done.
+        Returns:
+            np.ndarray: The results of all the games (see Results.RESULT_DTYPE), in order.
+        """
+
+        pending = self.get_pending_units()
+        if pending:
+            raise RuntimeError(f"{len(pending)} units are not done yet, e.g. {pending[0]}")
+        results = [np.load(self.get_result_path(unit)) for unit in self.get_units()]
+        return np.concatenate(results) if results else np.zeros(0, dtype=RESULT_DTYPE)
+
+    def merge_profile_stats(self, stats=None):
+        """
+        Combines the profiles of the units of a profiled job.
+        Args:
+            stats (pstats.Stats, optional): Stats to add them to, e.g. an experiment's profile_stats.
+        Returns:
+            pstats.Stats or None: The merged stats; None if no unit was profiled.
+        """
+
+        for unit in self.get_units():
+            path = self.get_profile_path(unit)
+            if os.path.exists(path):
+                with open(path, 'rb') as profile_file:
+                    stats = merge_stats(stats, marshal.load(profile_file))
+        return stats
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Play the units of a sharded experiment, or merge their results.")
+    parser.add_argument("command", choices=["work", "merge"])
+    parser.add_argument("spool_dir")
+    parser.add_argument("--lease-timeout", type=float, default=DEFAULT_LEASE_TIMEOUT)
+    parser.add_argument("--output", default="results.npy", help="where merge writes the results")
+    args = parser.parse_args()
+
+    coordinator = ShardCoordinator(args.spool_dir, args.lease_timeout)
+    if args.command == "work":
+        print(f"played {coordinator.run_worker()} units")
+    else:
+        np.save(args.output, coordinator.merge())
+        stats = coordinator.merge_profile_stats()
+        if stats is not None:
+            stats.dump_stats(f"{args.output}.pstats")
+
+if __name__ == "__main__":
+    main()
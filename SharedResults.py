@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from Experiment import get_game_seed, play_games
+from Results import RESULT_DTYPE
+
+
+def attach_shared_memory(name):
+    """
+    Attaches to shared memory created by another process without registering it with
+    this process's resource tracker.  Before Python 3.13 attaching registers it too, and
+    a tracker that did not create it warns of a leak and unlinks it when this process
+    exits; a worker can't simply unregister it either, as its tracker is usually its
+    parent's, which would then fail to unregister it when it unlinks it.
+    Returns:
+        shared_memory.SharedMemory: The attached shared memory.
+    """
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedResultBuffer:
+    """
+    A preallocated results array (see Results.RESULT_DTYPE) in shared memory.
+    Worker processes attach to it by name and write the records of their games
+    straight into their slots, so no results are pickled back to the parent,
+    which reads them through a NumPy view of the same memory.
+    Attributes:
+        num_games (int): The number of records in the buffer.
+        name (str): The name worker processes attach to the buffer with.
+        results (np.ndarray): The view of the records.
+    """
+
+    def __init__(self, num_games, name=None):
+        self.num_games = num_games
+        size = max(num_games * RESULT_DTYPE.itemsize, 1)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.name = self.shm.name
+        self.results = np.ndarray((num_games,), dtype=RESULT_DTYPE, buffer=self.shm.buf)
+
+    def close(self):
+        """
+        Detaches from the shared memory.  Any other views of the results must be gone by now.
+        """
+
+        self.results = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory once every process has closed it.  On POSIX, the
+        views of processes that are still attached stay valid until they close it.
+        """
+
+        self.shm.unlink()
+
+
+def play_games_into_buffer(name, num_games, start, seeds, config, profile=False):
+    """
+    Plays games in a worker process, writing their records into slots start, start + 1, ...
+    of a SharedResultBuffer.
+    Args:
+        profile (bool): Whether to profile the games (see Experiment.play_games).
+    Returns:
+        tuple: The number of games played, the worker's process id, the seconds it took
+               and the raw stats of the profile (None without profile).
+    """
+
+    start_time = time.perf_counter()
+    buffer = SharedResultBuffer(num_games, name=name)
+    raw_stats = None
+    try:
+        played = play_games(seeds=seeds, out=buffer.results[start:start + len(seeds)], profile=profile, **config)
+        if profile:
+            played, raw_stats = played
+        # the view of the buffer must be gone before it is closed
+        del played
+    finally:
+        buffer.close()
+    return len(seeds), os.getpid(), time.perf_counter() - start_time, raw_stats
+
+
+def run_shared(experiment, workers=None, chunk_size=50):
+    """
+    Plays the games of an experiment in a process pool, collecting the results
+    in shared memory, and adds them to the experiment without copying them.
+    The buffer is unlinked right away; the experiment's view keeps it mapped.
+    If the experiment profiles its games, each task is profiled in its worker and the
+    profiles are merged into the experiment's profile_stats.  If it publishes live
+    metrics (see Experiment.start_progress), they are updated as each task finishes.
+    Args:
+        experiment (Experiment): The experiment; if it has a seed, game i is played with get_game_seed(seed, i).
+        workers (int, optional): The number of worker processes; by default one per core.
+        chunk_size (int): The number of games each task plays.
+    Returns:
+        SharedResultBuffer: The buffer holding the results (keep it for as long as the results are used).
+    """
+
+    num_games = experiment.num_games
+    config = experiment.get_game_config()
+    if experiment.seed is None:
+        seeds = [None] * num_games
+    else:
+        seeds = [get_game_seed(experiment.seed, igame) for igame in range(num_games)]
+
+    buffer = SharedResultBuffer(num_games)
+    experiment.progress = progress = experiment.start_progress(num_games)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for start in range(0, num_games, chunk_size):
+                future = executor.submit(play_games_into_buffer, buffer.name, num_games, start,
+                                         seeds[start:start + chunk_size], config, experiment.profile)
+                futures[future] = start
+            num_played = 0
+            for future in as_completed(futures):
+                num_games_played, worker, busy_seconds, raw_stats = future.result()
+                if raw_stats is not None:
+                    experiment.add_profile_stats(raw_stats)
+                num_played += num_games_played
+                if progress is not None:
+                    start = futures[future]
+                    progress.add_results(buffer.results[start:start + num_games_played], f"pid{worker}", busy_seconds)
+    finally:
+        buffer.unlink()
+        if progress is not None:
+            progress.close()
+    if num_played != num_games:
+        raise RuntimeError(f"The workers played {num_played} of {num_games} games")
+    experiment.add_results(buffer.results)
+    experiment.shared_results = buffer
+    return buffer
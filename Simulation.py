@@ -0,0 +1,144 @@
+import copy
+import queue
+import threading
+import time
+
+from Experiment import get_game_seed
+
+# the most snapshots published per second while turns are being taken
+MAX_SNAPSHOTS_PER_SECOND = 30
+
+
+class SimulationThread(threading.Thread):
+    """
+    Plays a game in a background thread, so that whoever watches it (e.g. the
+    pygame UI) and the game itself never wait on each other.
+    After turns are taken, a snapshot of the game (a deep copy that is never
+    changed afterwards) is published to the `snapshots` queue, which only ever
+    holds the latest one.  Snapshots are published at most MAX_SNAPSHOTS_PER_SECOND
+    times a second, and always when the game is over.
+    Attributes:
+        game (Game): The game being played.  Only this thread may touch it once started.
+        turns_per_second (float): How fast turns are taken, unless fast forwarding.
+        paused (bool): Whether turns are only taken when a step is requested.
+        fast_forward (bool): Whether turns are taken as fast as possible.
+        snapshots (queue.Queue): The latest snapshot of the game.
+        on_snapshot (callable, optional): Called (from this thread) after each snapshot is published.
+    """
+
+    def __init__(self, game, turns_per_second=2.0, paused=False, on_snapshot=None):
+        super().__init__(daemon=True)
+        self.game = game
+        self.turns_per_second = turns_per_second
+        self.paused = paused
+        self.fast_forward = False
+        self.on_snapshot = on_snapshot
+        self.snapshots = queue.Queue(maxsize=1)
+        self.game_over = False
+        self.num_steps_requested = 0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.last_published = 0.0
+        self.publish()
+
+    @classmethod
+    def from_experiment(cls, experiment, igame=0, **kwargs):
+        """
+        Creates a simulation of one of the games of an experiment.
+        If the experiment has a seed, this is exactly its game number igame.
+        """
+
+        config = experiment.get_game_config()
+        game_class = config.pop("game_class")
+        seed = None if experiment.seed is None else get_game_seed(experiment.seed, igame)
+        return cls(game_class(seed=seed, **config), **kwargs)
+
+    def set_turns_per_second(self, turns_per_second):
+        self.turns_per_second = max(turns_per_second, 0.1)
+        self.wake.set()
+
+    def set_paused(self, paused):
+        self.paused = paused
+        self.wake.set()
+
+    def set_fast_forward(self, fast_forward):
+        self.fast_forward = fast_forward
+        self.wake.set()
+
+    def step(self):
+        """
+        Requests that one turn is taken, even when paused.
+        """
+
+        with self.lock:
+            self.num_steps_requested += 1
+        self.wake.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def get_latest_snapshot(self):
+        """
+        Returns:
+            Game or None: The latest snapshot, or None if there is no new one since the last call.
+        """
+
+        try:
+            return self.snapshots.get_nowait()
+        except queue.Empty:
+            return None
+
+    def publish(self):
+        snapshot = copy.deepcopy(self.game)
+        # only keep the latest snapshot
+        try:
+            self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        self.snapshots.put(snapshot)
+        self.last_published = time.monotonic()
+        if self.on_snapshot is not None:
+            self.on_snapshot()
+
+    def take_turn(self):
+        """
+        Takes one turn of the game, the same way Game.play_game does.
+        """
+
+        self.game.take_turn()
+        if not self.game.validate_game_state():
+            raise RuntimeError("Game state is invalid.")
+        self.game.next_turn()
+        self.game_over = self.game.is_game_over()
+
+    def run(self):
+        self.game_over = self.game.is_game_over()
+        next_turn_time = time.monotonic()
+        while not self.stopped.is_set() and not self.game_over:
+            with self.lock:
+                stepping = self.num_steps_requested > 0
+                if stepping:
+                    self.num_steps_requested -= 1
+            if not stepping:
+                if self.paused:
+                    self.wake.wait()
+                    self.wake.clear()
+                    next_turn_time = time.monotonic()
+                    continue
+                if not self.fast_forward:
+                    delay = next_turn_time - time.monotonic()
+                    if delay > 0:
+                        # wake early if the controls change
+                        if self.wake.wait(delay):
+                            self.wake.clear()
+                        continue
+                    next_turn_time = max(next_turn_time, time.monotonic() - 1.0) + 1.0 / self.turns_per_second
+
+            self.take_turn()
+
+            if not self.game_over and (stepping or time.monotonic() - self.last_published >= 1.0 / MAX_SNAPSHOTS_PER_SECOND):
+                self.publish()
+        if self.game_over:
+            self.publish()
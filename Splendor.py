@@ -1,10 +1,11 @@
 from typing import Optional
 import random
-import copy
+import struct
 
 from CardsLevel0 import AllCardsLevel0
 from CardsLevel1 import AllCardsLevel1
 from CardsLevel2 import AllCardsLevel2
+from Instrumentation import TurnInstrumentation, instrumented
 import logging
 
 logging.basicConfig(level=logging.WARNING)
@@ -12,12 +13,104 @@ logging.basicConfig(level=logging.WARNING)
 RANDOM_STRATEGY = "RANDOM"
 CHEAPEST_STRATEGY = "CHEAPEST"
 POINTS_STRATEGY = "POINTS"
-STRATEGIES = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY]
+# picks the action a trained Evaluator.ValueEvaluator rates best
+LEARNED_STRATEGY = "LEARNED"
+# picks the action scoring highest under tunable weights (see Heuristic)
+HEURISTIC_STRATEGY = "HEURISTIC"
+# buys the first card it can afford, otherwise takes the coins that help most towards the whole market
+PLANNER_STRATEGY = "PLANNER"
+STRATEGIES = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY, LEARNED_STRATEGY, HEURISTIC_STRATEGY, PLANNER_STRATEGY]
 
 COLORS = ["red", "blue", "green", "white", "black"]
 
 COLORS_DICT = {color: 0 for color in COLORS}
 
+# the color of the 'wild' coins that can stand in for any other color
+GOLD = "gold"
+
+# the ways a game can end
+FINAL_STATES = ["winning_points", "max_turns", "players_stuck"]
+
+def get_card_catalog():
+    """
+    Lists every card of the game once, in a fixed order: by level, then color, then as
+    listed in the CardsLevel modules.  A card's position in this list is its card_id.
+    Returns:
+        list: A (level, color, points, cost) tuple per card.
+    """
+
+    catalog = []
+    for level, allCards in enumerate([AllCardsLevel0, AllCardsLevel1, AllCardsLevel2]):
+        for color, costs in allCards.items():
+            for cost in costs:
+                points = cost.get("points", 0)
+                cost = {cost_color: amount for cost_color, amount in cost.items() if cost_color != "points"}
+                catalog.append((level, color, points, cost))
+    return catalog
+
+CARD_CATALOG = get_card_catalog()
+# the points of all the cards of the catalog
+CATALOG_POINTS = sum(points for level, color, points, cost in CARD_CATALOG)
+
+# the noble tiles of the game; each visits the first player whose cards reach its requirements
+NOBLE_POINTS = 3
+NOBLE_CATALOG = [
+    {"red": 4, "green": 4},
+    {"red": 4, "black": 4},
+    {"blue": 4, "green": 4},
+    {"blue": 4, "white": 4},
+    {"white": 4, "black": 4},
+    {"blue": 3, "white": 3, "black": 3},
+    {"blue": 3, "green": 3, "white": 3},
+    {"red": 3, "blue": 3, "green": 3},
+    {"red": 3, "green": 3, "black": 3},
+    {"red": 3, "white": 3, "black": 3},
+]
+
+# bonus counts are packed into one integer, a byte per color; the top bit of each byte
+# is a guard bit, so comparing all the colors at once is a single subtraction
+BONUS_SHIFTS = {color: 8 * index for index, color in enumerate(COLORS)}
+BONUS_GUARD = sum(0x80 << shift for shift in BONUS_SHIFTS.values())
+
+def pack_bonuses(counts):
+    """
+    Args:
+        counts (dict): A count (below 128) per color.
+    Returns:
+        int: The counts packed a byte per color (see BONUS_SHIFTS).
+    """
+
+    return sum(count << BONUS_SHIFTS[color] for color, count in counts.items())
+
+def meets_requirements(packed_bonuses, packed_requirements):
+    """
+    Returns:
+        bool: Whether every packed bonus count is at least the packed requirement of its color.
+    """
+
+    # a byte's guard bit survives the subtraction exactly when its bonus >= its requirement
+    return ((packed_bonuses | BONUS_GUARD) - packed_requirements) & BONUS_GUARD == BONUS_GUARD
+
+# the packed binary layout of a Game (see Game.to_bytes)
+STATE_VERSION = 2
+STATE_MAX_PLAYERS = 4
+# stands for None (no final state, no winner, no strategy, a card out of the game)
+NONE_BYTE = 0xFF
+NONE_SHORT = 0xFFFF
+# a card location byte with this bit set is a position in its level's deck, otherwise a player seat
+DECK_BIT = 0x80
+# header, bank (colors and gold), per player (strategy, coins of each color and gold),
+# location of each card, location of each noble: 15 + 6 + 28 + 90 + 10 = 149 bytes.
+# A byte per card of the catalog keeps the whole order of every deck, so a game
+# unpacked goes on exactly like the one packed (see EngineDiff.PackedEngine), and
+# unpacking is a single pass; the market ids alone could not say what comes up next.
+STATE_STRUCT = struct.Struct(
+    "<BBBBBBHHBHBB"
+    + f"{len(COLORS) + 1}B"
+    + f"{STATE_MAX_PLAYERS * (len(COLORS) + 2)}B"
+    + f"{len(CARD_CATALOG)}B"
+    + f"{len(NOBLE_CATALOG)}B")
+
 class Card:
     """
     Represents a card in the game Splendor.
@@ -27,14 +120,16 @@ class Card:
         level (int, optional): The level of the card. Defaults to 0.
         cost (dict, optional): The cost to acquire the card, represented as a dictionary where keys are colors and values are the number of coins required. Defaults to None.
         owner (str, optional): The owner of the card. Defaults to None.
+        card_id (int, optional): The card's position in the CARD_CATALOG, for cards dealt by a Game. Defaults to None.
     """    
 
-    def __init__(self,  color: str, level: Optional[int]=0, points: Optional[int]=0, cost: Optional[dict]=None, owner: Optional[str] = None):
+    def __init__(self,  color: str, level: Optional[int]=0, points: Optional[int]=0, cost: Optional[dict]=None, owner: Optional[str] = None, card_id: Optional[int] = None):
         self.points = points
         self.color = color
         self.level = level
         self.owner = owner
         self.cost = cost
+        self.card_id = card_id
 
     def get_filtered_cost(self):
         """
@@ -107,16 +202,69 @@ class Coin:
         return f"Coin(color={self.color}, owner={self.owner}, wild={self.wild})"
 
 
+class Payment:
+
+    """
+    Records what a player spends to buy a card.
+    Attributes:
+        card (Card): The card being paid for.
+        bonuses (dict): Per color, how much of the cost is covered by the player's cards.
+        coins (dict): Per color, how many coins of that color are paid.
+        gold (int): How many wild coins are paid to cover what is still missing.
+    """
+
+    def __init__(self, card: Card, bonuses: dict, coins: dict, gold: int = 0):
+        self.card = card
+        self.bonuses = bonuses
+        self.coins = coins
+        self.gold = gold
+
+    def get_num_coins(self):
+        """
+        Returns:
+            int: The total number of coins (including wild ones) this payment spends.
+        """
+
+        return sum(self.coins.values()) + self.gold
+
+    def __repr__(self) -> str:
+        return f"Payment(card={self.card}, bonuses={self.bonuses}, coins={self.coins}, gold={self.gold})"
+
+
 class Noble:
 
     """
     Represents a Noble in the game Splendor
+    Attributes:
+        points (int): The points the noble is worth.
+        colors (list): The colors of cards the noble requires.
+        owner (str): The player the noble visited, if any.
+        requirements (dict, optional): The number of cards of each color the noble requires.
+        noble_id (int, optional): The noble's position in the NOBLE_CATALOG, for nobles dealt by a Game.
+        packed_requirements (int or None): The requirements packed like Player.packed_bonuses;
+            None for a noble without requirements, which never visits anyone.
     """
     
-    def __init__(self, points: int, colors: list, owner: str):
+    def __init__(self, points: int, colors: list, owner: str, requirements: Optional[dict] = None, noble_id: Optional[int] = None):
         self.points = points
         self.colors = colors
         self.owner = owner
+        self.requirements = requirements
+        self.noble_id = noble_id
+        self.packed_requirements = pack_bonuses(requirements) if requirements else None
+
+    @classmethod
+    def from_catalog(cls, noble_id):
+        requirements = NOBLE_CATALOG[noble_id]
+        return cls(points=NOBLE_POINTS, colors=list(requirements), owner=None, requirements=dict(requirements), noble_id=noble_id)
+
+    def can_visit(self, player):
+        """
+        Returns:
+            bool: Whether the player's cards reach the noble's requirements.
+        """
+
+        return self.packed_requirements is not None and meets_requirements(player.packed_bonuses, self.packed_requirements)
 
     def __repr__(self) -> str:
         return f"Noble(points={self.points}, colors={self.colors}, owner={self.owner})"
@@ -127,10 +275,17 @@ class Player:
     Attributes:
         name (str): The name of the player.
         strategy (str): The strategy used by the player.
-        coins (list): The list of coins the player has.
+        coins (list): The list of coins the player has.  Assigning a new list recounts
+            coin_counts; coins are added with add_coin.
+        coin_counts (dict): The number of coins of each color (and gold, once the player
+            has had some), kept up to date with coins.
         cards (list): The list of cards the player has.
         nobles (list): The list of nobles the player has.
         max_coins (int): The maximum number of coins a player can have.
+        packed_bonuses (int): The number of cards of each color, packed (see pack_bonuses)
+            and kept up to date by add_card.
+        instrumentation (Instrumentation.TurnInstrumentation, optional): Times the player's
+            affordability checks, when the game is instrumented.
     """
 
     
@@ -140,14 +295,38 @@ class Player:
         self.coins = []
         self.cards = []
         self.nobles = []
+        self.packed_bonuses = 0
+        self.instrumentation = None
 
         self.max_coins = 10
 
+    @property
+    def coins(self):
+        return self._coins
+
+    @coins.setter
+    def coins(self, coins):
+        self._coins = coins
+        self.coin_counts = dict(COLORS_DICT)
+        for coin in coins:
+            self.coin_counts[coin.color] = self.coin_counts.get(coin.color, 0) + 1
+
     def add_coin(self, coin: Coin):
-        self.coins.append(coin)
+        self._coins.append(coin)
+        self.coin_counts[coin.color] = self.coin_counts.get(coin.color, 0) + 1
+
+    def get_bonus(self, color):
+        """
+        Returns:
+            int: The number of cards of a color the player has, read from packed_bonuses.
+        """
+
+        return (self.packed_bonuses >> BONUS_SHIFTS[color]) & 0xFF if color in BONUS_SHIFTS else 0
 
     def add_card(self, card: Card):
         self.cards.append(card)
+        if card.color in BONUS_SHIFTS:
+            self.packed_bonuses += 1 << BONUS_SHIFTS[card.color]
 
     def add_noble(self, noble: Noble):
         self.nobles.append(noble)
@@ -173,19 +352,13 @@ class Player:
     def get_coins_dict(self):
         """
         Generate a dictionary representing the count of each coin color.
-        This method iterates through the list of coins and counts the number of coins for each color.
+        The counts are kept up to date in coin_counts, so this is a copy of them.
         The result is a dictionary where the keys are the colors and the values are the counts of coins of that color.
         Returns:
             dict: A dictionary with coin colors as keys and their respective counts as values.
         """
 
-        coins_dict = {color: 0 for color in COLORS}
-        for coin in self.coins:
-            if coin.color in coins_dict:
-                coins_dict[coin.color] += 1
-            else:
-                coins_dict[coin.color] = 1
-        return coins_dict
+        return dict(self.coin_counts)
 
     def get_cards_dict(self):
         """
@@ -219,12 +392,7 @@ class Player:
                   of cards and coins for each color.
         """
 
-        colors_dict = {}
-        cards_dict = self.get_cards_dict()
-        coins_dict = self.get_coins_dict()
-        for color in COLORS:
-            colors_dict[color] = cards_dict[color] + coins_dict[color]
-        return colors_dict
+        return {color: self.get_bonus(color) + self.coin_counts[color] for color in COLORS}
 
     def get_cost_difference(self, card: Card):
         """
@@ -242,7 +410,54 @@ class Player:
             diff[color] = colorCost - player[color]
         logging.warning(f"Cost difference for {self.name} and {card}: {diff}")    
         return diff
+
+    def get_turns_to_afford(self, card: Card):
+        """
+        How far the player really is from a card: unlike get_cost_difference, this follows the
+        rules for taking coins (three of different colors or two of one) and max_coins.
+        Each call is a lookup in a precomputed table (see AffordTable).
+        Args:
+            card (Card): The card the player wants to buy.
+        Returns:
+            int: The fewest turns of taking coins before the player can buy the card,
+                 or AffordTable.UNREACHABLE if their room for coins runs out first.
+        """
+
+        from AffordTable import get_turns_to_afford
+        colors_dict = self.get_colors_dict()
+        shortfall = tuple(max(card.cost.get(color, 0) - colors_dict[color], 0) for color in COLORS)
+        return get_turns_to_afford(shortfall, self.max_coins - len(self.coins), self.coin_counts.get(GOLD, 0))
         
+    def get_payment(self, card: Card):
+        """
+        Works out exactly what the player would spend to buy a given card.
+        Each color of the cost is covered first by the player's cards of that color,
+        then by coins of that color, and whatever is still missing by wild (gold) coins.
+        The player's bonuses and coins are read from packed_bonuses and coin_counts, so
+        this takes a step per color of the cost.
+        Args:
+            card (Card): The card to pay for.
+        Returns:
+            Payment or None: The payment for the card, or None if the player cannot afford it.
+        """
+
+        coin_counts = self.coin_counts
+        gold_available = coin_counts.get(GOLD, 0)
+
+        bonuses = {}
+        coins = {}
+        gold = 0
+        for color, cost in card.cost.items():
+            bonus = min(cost, self.get_bonus(color))
+            pay = min(cost - bonus, coin_counts.get(color, 0))
+            bonuses[color] = bonus
+            coins[color] = pay
+            gold += cost - bonus - pay
+        if gold > gold_available:
+            return None
+        return Payment(card, bonuses, coins, gold)
+
+    @instrumented("affordability")
     def can_afford_card(self, card: Card):
         """
         Determines if the player can afford a given card based on their current resources.
@@ -253,11 +468,7 @@ class Player:
             bool: True if the player can afford the card, False otherwise.
         """
 
-        colors_dict = self.get_colors_dict()
-        for color, cost in card.cost.items():
-            if colors_dict.get(color, 0) < cost:
-                return False
-        return True
+        return self.get_payment(card) is not None
 
     def can_take_coin(self):
         """
@@ -288,6 +499,14 @@ class Game:
         winning_points (int): The number of points needed to win the game.
         shuffle (bool): Whether to shuffle the cards at the start of the game.
         strategy (str): The strategy used by the players.
+        seed (int, optional): Seeds the game's own random number generator, so the game
+            can be replayed exactly.  By default it is seeded from the system.
+        evaluator (Evaluator.ValueEvaluator, optional): Rates positions for the LEARNED strategy.
+            By default it is loaded from Evaluator.DEFAULT_WEIGHTS_PATH when first needed.
+        heuristic_weights (dict, optional): The weights of the HEURISTIC strategy.
+            By default they are loaded from Heuristic.DEFAULT_HEURISTIC_PATH when first needed.
+        instrumentation (Instrumentation.TurnInstrumentation, optional): Times the phases of
+            turns and counts why turns were stuck; off (None) unless enable_instrumentation is called.
     """
     def __init__(self, 
         num_players=4,
@@ -295,14 +514,28 @@ class Game:
         winning_points=15,
         shuffle=True,
         strategy=None,
-        strategies=None
+        strategies=None,
+        seed=None
         ):
 
+        self.init_settings(num_players, max_turns, winning_points, shuffle, strategy, strategies, seed)
+        self.init_game()
+
+    def init_settings(self, num_players, max_turns, winning_points, shuffle, strategy, strategies, seed):
+        """
+        Sets the settings and counters of a game, before anything is dealt.
+        """
+
         self.num_players = num_players
         self.winning_points = winning_points
         self.shuffle = shuffle
         self.strategy = strategy
         self.strategies = strategies
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.evaluator = None
+        self.heuristic_weights = None
+        self.instrumentation = None
 
         self.cards = [[],[],[]]
 
@@ -328,8 +561,7 @@ class Game:
   
         self.num_cards_visible = 4
 
-
-        self.init_game()
+        self.num_nobles = min(num_players + 1, len(NOBLE_CATALOG))
 
     def init_game(self):
         """
@@ -337,8 +569,9 @@ class Game:
         - Creates players based on the number of players specified in `self.num_players`.
         - Initializes the current player to the first player in the list.
         - Creates stacks of coins for each color specified in `COLORS`.
-        - Deep copies card levels from predefined card sets and creates card objects for each card.
+        - Creates card objects for each card of the CARD_CATALOG.
         - Shuffles the cards if `self.shuffle` is set to True.
+        - Deals one noble more than there are players, at random if `self.shuffle` is set to True.
         - Calculates the maximum total points available in the game.
         - Calculates the total number of cards across all levels.
         """
@@ -353,23 +586,27 @@ class Game:
         # make stacks of coins of each color
         self.colors = COLORS #["red", "blue", "green", "white", "black"]
         self.coins = {color: [Coin(color, None) for _ in range(self.num_coins_per_color)] for color in self.colors}
+        # wild coins are only ever returned here; they are not dealt yet
+        self.gold = []
 
-        allCardsLevel0 = copy.deepcopy(AllCardsLevel0)
-        allCardsLevel1 = copy.deepcopy(AllCardsLevel1)
-        allCardsLevel2 = copy.deepcopy(AllCardsLevel2)
-        allCardLevels = [allCardsLevel0, allCardsLevel1, allCardsLevel2]
-        for level, allCards in enumerate(allCardLevels):
-            for color, costs in allCards.items():
-                for cost in costs:
-                    points = cost.pop("points", 0)
-                    card = Card(color=color, level=level, points=points, cost=cost)
-                    self.add_card(card, level)
+        for card_id, (level, color, points, cost) in enumerate(CARD_CATALOG):
+            card = Card(color=color, level=level, points=points, cost=dict(cost), card_id=card_id)
+            self.add_card(card, level)
         if self.shuffle:    
             for level in range(self.num_card_levels):    
-                random.shuffle(self.cards[level])
-        self.max_total_points = sum(card.points for level in self.cards for card in level)
+                self.random.shuffle(self.cards[level])
+
+        noble_ids = list(range(len(NOBLE_CATALOG)))
+        if self.shuffle:
+            self.random.shuffle(noble_ids)
+        for noble_id in noble_ids[:self.num_nobles]:
+            self.add_noble(Noble.from_catalog(noble_id))
+
+        self.max_total_points = sum(card.points for level in self.cards for card in level) + sum(noble.points for noble in self.nobles)
 
         self.num_cards = len(self.cards[0]) + len(self.cards[1]) + len(self.cards[2])
+        # built on first use by get_deck_tracker, then kept up to date by buy_card
+        self.deck_tracker = None
 
     def get_winner(self):
         """
@@ -447,6 +684,7 @@ class Game:
                 break
         return took_coin
 
+    @instrumented("coin_selection")
     def take_next_coins(self, current_player):
         """
         Allows the current player to take coins up to the maximum allowed per turn.
@@ -509,6 +747,7 @@ class Game:
         # if not
         return False
     
+    @instrumented("coin_selection")
     def take_coins_for_card(self, current_player, card):
         """
         Allows the current player to take coins for a specified card.
@@ -553,6 +792,7 @@ class Game:
 
         return [color for color, coins in self.coins.items() if not coins]
     
+    @instrumented("coin_selection")
     def take_random_coins(self, current_player: Player):
         """
         Allows the current player to take random coins up to the maximum allowed per turn.
@@ -592,10 +832,11 @@ class Game:
         available_colors = [color for color, coins in self.coins.items() if coins and color not in disallowed_colors]
         if not available_colors:
             return None
-        color = random.choice(available_colors)
+        color = self.random.choice(available_colors)
         return self.take_coin_of_color(current_player, color)
         
 
+    @instrumented("card_evaluation")
     def buy_random_card(self, current_player):
         """
         Attempts to buy a random card for the current player.
@@ -621,6 +862,7 @@ class Game:
                     logging.info(f"{current_player.name} {current_player.get_colors_dict()} cannot buy {card}")    
         return False
 
+    @instrumented("card_evaluation")
     def buy_points_card(self, current_player):
 
         # well first just buy any card with points that can be afforded
@@ -645,6 +887,7 @@ class Game:
         
         return points_card, False
     
+    @instrumented("card_evaluation")
     def buy_cheapest_card(self, current_player):
         """
         Allows the current player to buy the cheapest available card from the visible cards.
@@ -680,6 +923,7 @@ class Game:
         
         return cheapest_card, False
     
+    @instrumented("card_evaluation")
     def buy_most_expensive_card(self, current_player):
         # TBF: this does not buy most expensive card yet, just buys
         # first one it can afford starting at the most expensive level
@@ -687,19 +931,7 @@ class Game:
         last_card = None
         for level in range(self.num_card_levels - 1, -1, -1):
             for card in self.cards[level][:self.num_cards_visible]:
-                if self.can_buy_card(current_player, card):
-                    # remove card from board and add to player
-                    current_player.add_card(card)
-                    self.cards[level].remove(card)
-                    # remove coins from Player and add back to board
-                    for color, amount in card.cost.items():
-                        for _ in range(amount):
-                            for coin in current_player.coins:
-                                if coin.color == color:
-                                    current_player.coins.remove(coin)
-                                    self.coins[color].append(coin)
-                                    break
-                    logging.info(f"{current_player.name} buys {card}")
+                if self.buy_card(current_player, card):
                     bought_card = True
                     last_card = card
                     break
@@ -709,6 +941,47 @@ class Game:
                 break
         return bought_card, last_card
 
+    @instrumented("payment")
+    def pay_for_card(self, player: Player, card: Card):
+        """
+        Makes a player pay for a card, returning the spent coins to the board.
+        The payment is worked out up front (see Player.get_payment) and then
+        applied in a single pass over the player's coins, so either the whole
+        cost is paid or nothing changes.
+        Args:
+            player (Player): The player paying for the card.
+            card (Card): The card being paid for.
+        Returns:
+            Payment or None: What was paid, or None if the player cannot afford the card.
+        """
+
+        payment = player.get_payment(card)
+        if payment is None:
+            return None
+
+        num_player_coins = len(player.coins)
+        to_pay = {color: amount for color, amount in payment.coins.items() if amount > 0}
+        gold_to_pay = payment.gold
+        kept_coins = []
+        for coin in player.coins:
+            if coin.wild and gold_to_pay > 0:
+                gold_to_pay -= 1
+                coin.owner = None
+                self.gold.append(coin)
+            elif not coin.wild and to_pay.get(coin.color, 0) > 0:
+                to_pay[coin.color] -= 1
+                coin.owner = None
+                self.coins[coin.color].append(coin)
+            else:
+                kept_coins.append(coin)
+        player.coins = kept_coins
+
+        # dbl check: the player spent exactly what the payment says
+        assert len(player.coins) == num_player_coins - payment.get_num_coins()
+
+        logging.info(f"{player.name} pays {payment}")
+        return payment
+
     def buy_card(self, player: Player, card: Card):
         """
         Allows a player to buy a card if they have the necessary resources.
@@ -725,55 +998,34 @@ class Game:
             bool: True if the player successfully buys the card, False otherwise.
         """
         logging.info(f"Player {player} buying card {card}")
-        if self.can_buy_card(player, card):
-            # make a copy of the games coins to double check how many coins player spends
-            org_game_coins = copy.deepcopy(self.coins)
-
-            # now pay for the card
-            for color, amount in card.cost.items():
-                logging.info(f"card costs {amount} {color}")
-                needs_coins = amount
-                # for _ in range(amount):
-                if True:
-                    # first pay using cards
-                    for player_card in player.cards:
-                        if player_card.color == color:
-                            logging.info(f"player has card of color {color}")
-                            needs_coins -= 1
-                # pay the reminaing balance in coins            
-                if needs_coins > 0:
-                    for _ in range(needs_coins):           
-                        for coin in player.coins:
-                            if coin.color == color:
-                                logging.info(f"{player.name} spends coin {color}")
-                                # remove coin from player and give back to board
-                                player.coins.remove(coin)
-                                self.coins[color].append(coin)
-                                break
-
-            # dbl check: how many more coins does the game now have?
-            diffCoins = {}
-            for color, coins in self.coins.items(): 
-                if color in org_game_coins:
-                    diff = len(coins) - len(org_game_coins[color])
-                    diffCoins[color] = diff
-                    # logging.warning(f"game has {diff} more {color} coins")
-                    # dbl check: does the player's cards make up the difference in price?
-                    cards_dict = player.get_cards_dict()
-                    if color in card.cost and color in cards_dict:
-                        # TBF: make exception class
-                        if not card.cost[color] <= diff + cards_dict[color]:
-                            logging.error(f"ERROR: color coin {color} card cost {card.cost[color]} > diff {diff} + cards_dict {cards_dict[color]}")
-                            assert card.cost[color] <= diff + cards_dict[color]
-            
-            # add card to player and remove from game board
-            player.add_card(card)
-            self.cards[card.level].remove(card)
+        if self.pay_for_card(player, card) is None:
+            return False
 
-            logging.info(f"{player.name} buys {card}")
-            return True
-        return False
+        # add card to player and remove from game board
+        player.add_card(card)
+        position = self.cards[card.level].index(card)
+        self.cards[card.level].remove(card)
+        if self.deck_tracker is not None:
+            if position >= self.num_cards_visible:
+                self.deck_tracker.remove(card.card_id)
+            elif len(self.cards[card.level]) >= self.num_cards_visible:
+                self.deck_tracker.remove(self.cards[card.level][self.num_cards_visible - 1].card_id)
+
+        logging.info(f"{player.name} buys {card}")
+        return True
     
+    def get_deck_tracker(self):
+        """
+        Returns:
+            DeckTracker.DeckTracker: What the cards behind the market may be, for strategies
+                                     that look ahead at refills of the market.
+        """
+
+        if self.deck_tracker is None:
+            from DeckTracker import DeckTracker
+            self.deck_tracker = DeckTracker.from_game(self)
+        return self.deck_tracker
+
     def take_coin_for_card(self, current_player: Player, card: Card, disallowed_colors: list):
         """
         Attempts to take a coin for the current player to help them purchase a specified card.
@@ -832,11 +1084,15 @@ class Game:
 
         return took_coin
     
-    def take_turn(self):
+    @instrumented("turn")
+    def take_turn(self, action=None):
         """
         Executes the actions for the current player's turn.
         The current player is determined and their turn is announced. 
         The player's strategy is checked, and the appropriate action is taken.
+        Args:
+            action (GameState.BuyCard, GameState.TakeCoins or GameState.Pass, optional):
+                Play this action instead of the player's strategy, e.g. one chosen by an outside agent.
         Returns:
             None
         """
@@ -846,18 +1102,89 @@ class Game:
         logging.info(f"{current_player.name}'s turn using strategy {current_player.strategy}")
 
         took_turn = False
-        if current_player.strategy == RANDOM_STRATEGY:
+        if action is not None:
+            took_turn = self.take_action(current_player, action)
+        elif current_player.strategy == RANDOM_STRATEGY:
             took_turn = self.take_turn_random_strategy(current_player)
         elif current_player.strategy == POINTS_STRATEGY:
             took_turn = self.take_turn_points_strategy(current_player)
         elif current_player.strategy == CHEAPEST_STRATEGY:
             took_turn = self.take_turn_cheapest_strategy(current_player)
+        elif current_player.strategy == LEARNED_STRATEGY:
+            took_turn = self.take_turn_learned_strategy(current_player)
+        elif current_player.strategy == HEURISTIC_STRATEGY:
+            took_turn = self.take_turn_heuristic_strategy(current_player)
+        elif current_player.strategy == PLANNER_STRATEGY:
+            took_turn = self.take_turn_planner_strategy(current_player)
         else:
             raise "Only one supported strategy currently"
         if not took_turn:
             self.num_stuck_turns += 1
+            if self.instrumentation is not None:
+                self.instrumentation.add_stuck_turn(self.get_stuck_cause(current_player))
         else:
             self.num_stuck_turns = 0    
+        if self.instrumentation is not None:
+            self.instrumentation.num_turns += 1
+        self.visit_noble(current_player)
+
+    def enable_instrumentation(self, instrumentation=None):
+        """
+        Starts timing the phases of turns and counting why turns were stuck.
+        Args:
+            instrumentation (Instrumentation.TurnInstrumentation, optional): Where to record
+                the game; by default a new one.
+        Returns:
+            Instrumentation.TurnInstrumentation: The instrumentation of the game.
+        """
+
+        self.instrumentation = TurnInstrumentation() if instrumentation is None else instrumentation
+        self.instrumentation.num_games += 1
+        for player in self.players:
+            player.instrumentation = self.instrumentation
+        return self.instrumentation
+
+    def get_stuck_cause(self, player: Player):
+        """
+        Works out why a player could do nothing on their turn.
+        Returns:
+            str: One of Instrumentation.STUCK_CAUSES: the player holds as many coins as they
+                 may, the bank has no coins left, the bank has none of the colors the
+                 player still needs for the cards of the market, or (otherwise) the
+                 player could not afford any card.
+        """
+
+        if not player.can_take_coin():
+            return "coin_cap"
+        if not self.are_coins_available():
+            return "bank_empty"
+        colors_dict = player.get_colors_dict()
+        needed_colors = {color for level in range(self.num_card_levels)
+                         for card in self.cards[level][:self.num_cards_visible]
+                         for color, cost in card.cost.items() if cost > colors_dict.get(color, 0)}
+        if not any(self.coins[color] for color in needed_colors if color in self.coins):
+            return "no_needed_color"
+        return "no_affordable_card"
+
+    def visit_noble(self, player: Player):
+        """
+        At the end of a player's turn, the first noble on the board whose requirements the
+        player's cards reach visits them (at most one per turn).  Each check compares all
+        the colors at once (see meets_requirements).
+        Args:
+            player (Player): The player whose turn ends.
+        Returns:
+            Noble or None: The noble that visited the player, if any.
+        """
+
+        for noble in self.nobles:
+            if noble.can_visit(player):
+                self.nobles.remove(noble)
+                noble.owner = player.name
+                player.add_noble(noble)
+                logging.info(f"{noble} visits {player.name}")
+                return noble
+        return None
 
     def take_turn_cheapest_strategy(self, current_player):
         """
@@ -905,6 +1232,106 @@ class Game:
             return self.take_random_coins(current_player)
         return bought_card
     
+    @instrumented("card_evaluation")
+    def take_turn_learned_strategy(self, current_player):
+        """
+        Executes a turn for the given player with the action the evaluator rates best
+        (see Evaluator.ValueEvaluator.choose_action).
+        Args:
+            current_player (Player): The player whose turn it is to take an action.
+        Returns:
+            bool: True if the player did something, False if they were stuck.
+        """
+
+        if self.evaluator is None:
+            from Evaluator import get_evaluator
+            self.evaluator = get_evaluator()
+        action = self.evaluator.choose_action(self.get_state())
+        return self.take_action(current_player, action)
+
+    @instrumented("card_evaluation")
+    def take_turn_heuristic_strategy(self, current_player):
+        """
+        Executes a turn for the given player with the action that scores highest under
+        the heuristic weights (see Heuristic.choose_heuristic_action).
+        Args:
+            current_player (Player): The player whose turn it is to take an action.
+        Returns:
+            bool: True if the player did something, False if they were stuck.
+        """
+
+        from Heuristic import choose_heuristic_action, get_heuristic_weights
+        if self.heuristic_weights is None:
+            self.heuristic_weights = get_heuristic_weights()
+        action = choose_heuristic_action(self.get_state(), self.heuristic_weights)
+        return self.take_action(current_player, action)
+
+    def take_turn_planner_strategy(self, current_player):
+        """
+        Executes a turn for the given player: buy the first card they can afford,
+        otherwise take the coins that make the most progress towards the cards of the
+        market (see take_planned_coins).
+        Args:
+            current_player (Player): The player whose turn it is to take an action.
+        Returns:
+            bool: True if the player did something, False if they were stuck.
+        """
+
+        for level in range(self.num_card_levels):
+            for card in self.cards[level][:self.num_cards_visible]:
+                if current_player.can_afford_card(card):
+                    return self.buy_card(current_player, card)
+        return self.take_planned_coins(current_player)
+
+    @instrumented("coin_selection")
+    def take_planned_coins(self, current_player, targets=None):
+        """
+        Takes the coins that make the most progress towards some target cards, weighing
+        every legal take at once (see CoinPlanner.plan_coin_take).
+        Args:
+            current_player (Player): The player whose turn it is.
+            targets (list, optional): (card_id, weight) per target card; by default the market.
+        Returns:
+            bool: True if coins were taken, False if none could be.
+        """
+
+        from CoinPlanner import plan_coin_take
+        action = plan_coin_take(self.get_state(), targets)
+        if action is None:
+            return False
+        return self.take_action(current_player, action)
+
+    def take_action(self, current_player, action):
+        """
+        Plays an action (see GameState) for the current player, without passing the turn on.
+        Args:
+            current_player (Player): The player whose turn it is.
+            action (GameState.BuyCard, GameState.TakeCoins or GameState.Pass): The action.
+        Returns:
+            bool: True if the player did something, False if they passed.
+        Raises:
+            ValueError: If the action is not legal; nothing is played then.
+        """
+
+        from GameState import BuyCard, TakeCoins, is_legal_take
+        if isinstance(action, BuyCard):
+            for level in range(self.num_card_levels):
+                for card in self.cards[level][:self.num_cards_visible]:
+                    if card.card_id == action.card_id:
+                        if not self.buy_card(current_player, card):
+                            raise ValueError(f"{current_player.name} cannot afford {card}")
+                        return True
+            raise ValueError(f"Card {action.card_id} is not in the market")
+        if isinstance(action, TakeCoins):
+            if not is_legal_take(self.get_state(), action.colors):
+                raise ValueError(f"{current_player.name} may not take {action.colors}")
+            for color in action.colors:
+                self.take_coin_of_color(current_player, color)
+            if len(action.colors) == 2 and action.colors[0] == action.colors[1]:
+                self.num_turns_take_two_coins += 1
+            return True
+        return False
+
     def play_game(self, interactive=True):
         """
         Play a game of Splendor.
@@ -953,7 +1380,7 @@ class Game:
             return True
         # Example condition: game ends when a player has 15 points
         for player in self.players:
-            if sum(card.points for card in player.cards) >= self.winning_points:
+            if player.get_total_points() >= self.winning_points:
                 logging.info(f"{player.name} wins the game with strategy {player.strategy}!")
                 self.winner = player
                 self.final_state = "winning_points"
@@ -969,6 +1396,168 @@ class Game:
         
         return False
 
+    def to_bytes(self):
+        """
+        Packs the state of the game into STATE_STRUCT.size bytes: the settings and
+        counters of the game, the number of coins of each color in the bank and in each
+        player's purse, where each card of the CARD_CATALOG is (its position in its
+        level's deck, the first num_cards_visible being the market, or the player owning it)
+        and where each noble of the NOBLE_CATALOG is (on the board, or with the player it visited).
+        Players' bonuses and points follow from the cards and nobles they own.
+        The state of the random number generator is not included.
+        Returns:
+            bytes: The packed state.
+        """
+
+        if len(self.players) > STATE_MAX_PLAYERS:
+            raise ValueError(f"Only games of up to {STATE_MAX_PLAYERS} players can be packed")
+
+        locations = [NONE_BYTE] * len(CARD_CATALOG)
+        for cards in self.cards:
+            for position, card in enumerate(cards):
+                locations[card.card_id] = DECK_BIT | position
+        noble_locations = [NONE_BYTE] * len(NOBLE_CATALOG)
+        for position, noble in enumerate(self.nobles):
+            noble_locations[noble.noble_id] = DECK_BIT | position
+        players = []
+        for seat, player in enumerate(self.players):
+            for card in player.cards:
+                locations[card.card_id] = seat
+            for noble in player.nobles:
+                noble_locations[noble.noble_id] = seat
+            coins_dict = player.get_coins_dict()
+            players.append(STRATEGIES.index(player.strategy) if player.strategy is not None else NONE_BYTE)
+            players += [coins_dict[color] for color in COLORS] + [coins_dict.get(GOLD, 0)]
+        players += [0] * (STATE_MAX_PLAYERS * (len(COLORS) + 2) - len(players))
+
+        return STATE_STRUCT.pack(
+            STATE_VERSION,
+            1 if self.shuffle else 0,
+            len(self.players),
+            self.turn,
+            self.players.index(self.current_player),
+            self.winning_points,
+            NONE_SHORT if self.max_turns is None else self.max_turns,
+            self.num_turns,
+            self.num_stuck_turns,
+            self.num_turns_take_two_coins,
+            NONE_BYTE if self.final_state is None else FINAL_STATES.index(self.final_state),
+            NONE_BYTE if self.winner is None else self.players.index(self.winner),
+            *[len(self.coins[color]) for color in COLORS],
+            len(self.gold),
+            *players,
+            *locations,
+            *noble_locations)
+
+    @classmethod
+    def from_bytes(cls, data, seed=None):
+        """
+        Recreates a game from the state packed by to_bytes.
+        Args:
+            data (bytes): The packed state.
+            seed (int, optional): Seeds the random number generator of the new game.
+        Returns:
+            Game: The game.
+        """
+
+        values = STATE_STRUCT.unpack(data)
+        (version, flags, num_players, turn, current_seat, winning_points, max_turns, num_turns,
+         num_stuck_turns, num_turns_take_two_coins, final_state, winner) = values[:12]
+        if version != STATE_VERSION:
+            raise ValueError(f"Cannot unpack state version {version}, only {STATE_VERSION}")
+        bank = values[12:12 + len(COLORS) + 1]
+        player_size = len(COLORS) + 2
+        players = values[18:18 + STATE_MAX_PLAYERS * player_size]
+        locations = values[18 + STATE_MAX_PLAYERS * player_size:-len(NOBLE_CATALOG)]
+        noble_locations = values[-len(NOBLE_CATALOG):]
+
+        strategies = [None if players[seat * player_size] == NONE_BYTE else STRATEGIES[players[seat * player_size]]
+                      for seat in range(num_players)]
+        # nothing is dealt: the cards, nobles and coins all come from the packed state
+        game = cls.__new__(cls)
+        game.init_settings(
+            num_players=num_players,
+            max_turns=None if max_turns == NONE_SHORT else max_turns,
+            winning_points=winning_points,
+            shuffle=bool(flags & 1),
+            strategy=None,
+            strategies=strategies,
+            seed=seed)
+        game.players = [Player(name=f"player{seat + 1}", strategy=strategy) for seat, strategy in enumerate(strategies)]
+        game.colors = COLORS
+        game.deck_tracker = None
+
+        # the cards of each deck by their position in it
+        decks = [{} for _ in range(game.num_card_levels)]
+        for card_id, location in enumerate(locations):
+            if location == NONE_BYTE:
+                continue
+            level, color, points, cost = CARD_CATALOG[card_id]
+            card = Card(color, level, points, dict(cost), None, card_id)
+            if location & DECK_BIT:
+                decks[level][location & ~DECK_BIT] = card
+            else:
+                game.players[location].add_card(card)
+        game.cards = [[deck[position] for position in range(len(deck))] for deck in decks]
+        game.num_cards = len(CARD_CATALOG)
+
+        board_nobles = []
+        for noble_id, location in enumerate(noble_locations):
+            if location == NONE_BYTE:
+                continue
+            noble = Noble.from_catalog(noble_id)
+            if location & DECK_BIT:
+                board_nobles.append((location & ~DECK_BIT, noble))
+            else:
+                noble.owner = game.players[location].name
+                game.players[location].add_noble(noble)
+        game.nobles = [noble for _, noble in sorted(board_nobles, key=lambda item: item[0])]
+        game.num_nobles = len(game.nobles) + sum(len(player.nobles) for player in game.players)
+        game.max_total_points = CATALOG_POINTS + NOBLE_POINTS * game.num_nobles
+
+        game.coins = {color: [Coin(color, None) for _ in range(count)] for color, count in zip(COLORS, bank)}
+        game.gold = [Coin(GOLD, None, wild=True) for _ in range(bank[-1])]
+        for seat, player in enumerate(game.players):
+            counts = players[seat * player_size + 1:(seat + 1) * player_size]
+            for color, count in zip(COLORS, counts):
+                player.coins += [Coin(color, player.name) for _ in range(count)]
+            player.coins += [Coin(GOLD, player.name, wild=True) for _ in range(counts[-1])]
+
+        game.turn = turn
+        game.current_player = game.players[current_seat]
+        game.num_turns = num_turns
+        game.num_stuck_turns = num_stuck_turns
+        game.num_turns_take_two_coins = num_turns_take_two_coins
+        game.final_state = None if final_state == NONE_BYTE else FINAL_STATES[final_state]
+        game.winner = None if winner == NONE_BYTE else game.players[winner]
+        return game
+
+    def get_state(self):
+        """
+        Returns:
+            GameState.GameState: An immutable snapshot of the game, to branch from with GameState.step.
+        """
+
+        from GameState import get_game_state
+        return get_game_state(self)
+
+    def set_state(self, state):
+        """
+        Makes the game match a GameState.GameState of it.
+        """
+
+        from GameState import set_game_state
+        set_game_state(self, state)
+
+    def step(self, action):
+        """
+        Plays an action of the current player (see GameState.step) and passes the turn on.
+        """
+
+        from GameState import step
+        self.current_player = self.get_current_player()
+        self.set_state(step(self.get_state(), action))
+
     def can_buy_card(self, player: Player, card: Card):
         return player.can_afford_card(card)
 
@@ -1002,6 +1591,7 @@ class Game:
         self.describe_coins()
         self.describe_cards()
 
+    @instrumented("validation")
     def validate_game_state(self):
         """
         Validates the current state of the game by checking the following:
@@ -1027,9 +1617,13 @@ class Game:
             return False
 
         # Validate the total number of nobles
+        total_nobles = len(self.nobles) + sum(len(player.nobles) for player in self.players)
+        if total_nobles != self.num_nobles:
+            logging.info(f"Noble count mismatch: {total_nobles} != {self.num_nobles}")
+            return False
 
         # Validate the total number of points
-        total_points = sum(card.points for level in self.cards for card in level)
+        total_points = sum(card.points for level in self.cards for card in level) + sum(noble.points for noble in self.nobles)
         player_points = sum(player.get_total_points() for player in self.players)
         assert self.max_total_points > 0
         if total_points + player_points != self.max_total_points:
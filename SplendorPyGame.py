@@ -1,7 +1,10 @@
+import os
 import pygame
 import sys
+from functools import lru_cache
 
 from Splendor import Game, RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY
+from Simulation import SimulationThread
 
 # Constants
 SCREEN_WIDTH = 1200
@@ -12,6 +15,10 @@ PLAYER_CARD_WIDTH = 25
 PLAYER_CARD_HEIGHT = 25
 COIN_RADIUS = 10
 FONT_SIZE = 24
+# the most frames drawn per second
+MAX_FPS = 30
+# posted by the simulation thread when it publishes a new snapshot of the game
+SNAPSHOT_EVENT = pygame.USEREVENT + 1
 
 # Colors
 WHITE = (255, 255, 255)
@@ -28,85 +35,146 @@ COLORS_MAP = {
     "black": BLACK
 }
 
-# Initialize Pygame
-pygame.init()
-
-
-
-# Set up the display
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Splendor Game")
-
-# Font
-font = pygame.font.Font(None, FONT_SIZE)
-
-def initPyGame():
-    pass
-    # game = Game(num_players=3, max_turns=None)
-    # game.describe()
-    # game.play_game()
-    # game.describe()
-
-
-def draw_text(text, x, y, color=BLACK):
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x, y))
-
-def draw_card(card, x, y):
-    pygame.draw.rect(screen, BLACK, (x - 2, y - 2, CARD_WIDTH + 4, CARD_HEIGHT + 4))  # Draw border
-    pygame.draw.rect(screen, COLORS_MAP[card.color], (x, y, CARD_WIDTH, CARD_HEIGHT))
+# set by initPyGame: the surface everything is drawn on, and the font of all text
+screen = None
+font = None
+
+def initPyGame(headless=False):
+    """
+    Initializes pygame, the screen and the font.
+    Args:
+        headless (bool): If True, no window is opened: the SDL dummy video driver is used
+                         and the screen is an offscreen surface (e.g. for rendering replays).
+    Returns:
+        pygame.Surface: The screen.
+    """
+    global screen, font
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    # Initialize Pygame
+    pygame.init()
+
+    if headless:
+        screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    else:
+        # Set up the display
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("Splendor Game")
+
+    # Font
+    font = pygame.font.Font(None, FONT_SIZE)
+    # the cached surfaces were rendered with the previous font, if pygame was initialized before
+    for get_surface in [get_text_surface, get_card_surface, get_coin_surface, get_player_surface]:
+        get_surface.cache_clear()
+    return screen
+
+
+@lru_cache(maxsize=1024)
+def get_text_surface(text, color=BLACK):
+    return font.render(text, True, color)
+
+def draw_text(text, x, y, color=BLACK, surface=None):
+    surface = screen if surface is None else surface
+    surface.blit(get_text_surface(text, color), (x, y))
+
+def get_card_key(card):
+    """
+    Returns what a card looks like, for caching its pre-rendered surface.
+    """
+    return (card.color, card.points, tuple(card.get_filtered_cost().items()))
+
+@lru_cache(maxsize=256)
+def get_card_surface(card_key):
+    """
+    Renders a card (including its border) once, for any card that looks like card_key.
+    """
+    color, points, cost = card_key
+    surface = pygame.Surface((CARD_WIDTH + 4, CARD_HEIGHT + 4))
+    x, y = 2, 2
+    pygame.draw.rect(surface, BLACK, (x - 2, y - 2, CARD_WIDTH + 4, CARD_HEIGHT + 4))  # Draw border
+    pygame.draw.rect(surface, COLORS_MAP[color], (x, y, CARD_WIDTH, CARD_HEIGHT))
 
     offset = 20
 
     # Draw white rectangle underneath points and coins
-    pygame.draw.rect(screen, WHITE, (x + offset, y + offset, CARD_WIDTH - 2*offset, 90))
+    pygame.draw.rect(surface, WHITE, (x + offset, y + offset, CARD_WIDTH - 2*offset, 90))
 
-    draw_text(f"Points: {card.points}", x + offset, y + offset)
+    draw_text(f"Points: {points}", x + offset, y + offset, surface=surface)
     # draw_text(f"Cost: {card.get_filtered_cost()}", x + 5, y + 30)
     ci = 0
 
     coin_seperation = COIN_RADIUS * 2
     coin_y_offset = 60
-    for color, numCoins in card.get_filtered_cost().items():
+    for coin_color, numCoins in cost:
         cx = x + offset + (ci * coin_seperation)
-        draw_coin(color, cx, y + 5 + coin_y_offset)
-        draw_text(str(numCoins), cx, y + offset + coin_y_offset + COIN_RADIUS)
+        draw_coin(coin_color, cx, y + 5 + coin_y_offset, surface=surface)
+        draw_text(str(numCoins), cx, y + offset + coin_y_offset + COIN_RADIUS, surface=surface)
         ci += 1
-
-def draw_coin(color, x, y):   
-    pygame.draw.circle(screen, BLACK, (x, y), COIN_RADIUS + 2)  # Draw border
-    pygame.draw.circle(screen, COLORS_MAP[color], (x, y), COIN_RADIUS)
+    return surface
+
+def draw_card(card, x, y, surface=None):
+    surface = screen if surface is None else surface
+    surface.blit(get_card_surface(get_card_key(card)), (x - 2, y - 2))
+
+@lru_cache(maxsize=None)
+def get_coin_surface(color):
+    surface = pygame.Surface((2 * COIN_RADIUS + 4, 2 * COIN_RADIUS + 4), pygame.SRCALPHA)
+    center = (COIN_RADIUS + 2, COIN_RADIUS + 2)
+    pygame.draw.circle(surface, BLACK, center, COIN_RADIUS + 2)  # Draw border
+    pygame.draw.circle(surface, COLORS_MAP[color], center, COIN_RADIUS)
+    return surface
+
+def draw_coin(color, x, y, surface=None):
+    surface = screen if surface is None else surface
+    surface.blit(get_coin_surface(color), (x - COIN_RADIUS - 2, y - COIN_RADIUS - 2))
     # draw_text(coin.color, x - COIN_RADIUS, y + COIN_RADIUS + 5)
 
-def draw_player_card(color, card_count, x, y):
-    pygame.draw.rect(screen, BLACK, (x - 2, y - 2, PLAYER_CARD_WIDTH + 4, PLAYER_CARD_HEIGHT + 4))  # Draw border
-    pygame.draw.rect(screen, COLORS_MAP[color], (x, y, PLAYER_CARD_WIDTH, PLAYER_CARD_HEIGHT))
+def draw_player_card(color, card_count, x, y, surface=None):
+    surface = screen if surface is None else surface
+    pygame.draw.rect(surface, BLACK, (x - 2, y - 2, PLAYER_CARD_WIDTH + 4, PLAYER_CARD_HEIGHT + 4))  # Draw border
+    pygame.draw.rect(surface, COLORS_MAP[color], (x, y, PLAYER_CARD_WIDTH, PLAYER_CARD_HEIGHT))
     text_color = BLACK if color == "white" else WHITE
-    draw_text(str(card_count), x + PLAYER_CARD_WIDTH // 2, y + PLAYER_CARD_HEIGHT // 2, color=text_color)
-        
-def draw_player(player, x, y):
-    pygame.draw.rect(screen, BLACK, (x - 2, y - 2, SCREEN_WIDTH // 4 + 4, 204))  # Draw border
-    pygame.draw.rect(screen, WHITE, (x, y, SCREEN_WIDTH // 4, 200))
-    draw_text(f"{player.name}\{player.strategy}", x, y)
-    draw_text(f"Points: {player.get_total_points()}", x, y + 30)
+    draw_text(str(card_count), x + PLAYER_CARD_WIDTH // 2, y + PLAYER_CARD_HEIGHT // 2, color=text_color, surface=surface)
+
+def get_player_key(player):
+    """
+    Returns what a player's panel looks like, for caching its pre-rendered surface.
+    """
+    return (player.name, player.strategy, player.get_total_points(),
+            tuple(player.get_coins_dict().items()), tuple(player.get_cards_dict().items()))
+
+PLAYER_PANEL_MARGIN = COIN_RADIUS + 2
+
+@lru_cache(maxsize=64)
+def get_player_surface(player_key):
+    """
+    Renders a player's panel (including its border) once, for any player that looks like player_key.
+    """
+    name, strategy, points, coins, cards = player_key
+    # the coins stick out to the left of the panel
+    surface = pygame.Surface((PLAYER_PANEL_MARGIN + SCREEN_WIDTH // 4 + 4, 204), pygame.SRCALPHA)
+    x, y = PLAYER_PANEL_MARGIN + 2, 2
+    pygame.draw.rect(surface, BLACK, (x - 2, y - 2, SCREEN_WIDTH // 4 + 4, 204))  # Draw border
+    pygame.draw.rect(surface, WHITE, (x, y, SCREEN_WIDTH // 4, 200))
+    draw_text(f"{name}\\{strategy}", x, y, surface=surface)
+    draw_text(f"Points: {points}", x, y + 30, surface=surface)
     
     # Draw player's coins
-    for i, (color, count) in enumerate(player.get_coins_dict().items()):
-        draw_coin(color, x + i * (COIN_RADIUS * 2 + 10), y + 60) # + j * (COIN_RADIUS * 2 + 10))
-        draw_text(str(count), x + i * (COIN_RADIUS * 2 + 10), y + 80)
-        # print(f"coin {i}: {(color, count)}")
-        # for j in range(count):
-            # draw_coin(type('Coin', (object,), {'color': color}), x + i * (COIN_RADIUS * 2 + 10), y + 60 + j * (COIN_RADIUS * 2 + 10))
-            # draw_coin(color, x + i * (COIN_RADIUS * 2 + 10), y + 60 + j * (COIN_RADIUS * 2 + 10))
+    for i, (color, count) in enumerate(coins):
+        draw_coin(color, x + i * (COIN_RADIUS * 2 + 10), y + 60, surface=surface) # + j * (COIN_RADIUS * 2 + 10))
+        draw_text(str(count), x + i * (COIN_RADIUS * 2 + 10), y + 80, surface=surface)
     
     # Draw player's cards
     cnt = 0
-    for i, (color, count) in enumerate(player.get_cards_dict().items()):
+    for i, (color, count) in enumerate(cards):
         if count > 0:
-            draw_player_card(color, count, x + (cnt * PLAYER_CARD_WIDTH), y+120)
+            draw_player_card(color, count, x + (cnt * PLAYER_CARD_WIDTH), y+120, surface=surface)
             cnt += 1
-        # for j in range(count):
-            # draw_player_card(type('Card', (object,), {'color': color, 'points': 0, 'get_filtered_cost': lambda: ''}), x + i * (CARD_WIDTH + 10), y + 120 + j * (CARD_HEIGHT + 10))
+    return surface
+
+def draw_player(player, x, y, surface=None):
+    surface = screen if surface is None else surface
+    surface.blit(get_player_surface(get_player_key(player)), (x - PLAYER_PANEL_MARGIN - 2, y - 2))
 
 def draw_player_old(player, x, y):
     draw_text(player.name, x, y)
@@ -114,90 +182,198 @@ def draw_player_old(player, x, y):
     draw_text(f"Coins: {player.get_coins_dict()}", x, y + 60)
     draw_text(f"Cards: {player.get_cards_dict()}", x, y + 90)
 
-def playSplendorPyGame():
-
-   
-    # game = Game(num_players=4, max_turns=None, winning_points=1, strategy=CHEAPEST_STRATEGY)
-    strategies = [POINTS_STRATEGY, CHEAPEST_STRATEGY, RANDOM_STRATEGY]   
-    game = Game(num_players=3, max_turns=None, winning_points=15, strategies=strategies)
-
-    print(f"Players: {game.players}")
-    initPyGame()
-
-    game_over = False
-
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-
-        screen.fill(WHITE)
+# where the parts of the board are drawn
+HEADER_RECT = pygame.Rect(0, 0, 290, 330)
+BUTTON_RECT = pygame.Rect(10, 100, 100, 40)
+BANK_X = SCREEN_WIDTH // 2
+BANK_Y = SCREEN_HEIGHT - 250
+BANK_RECT = pygame.Rect(BANK_X - COIN_RADIUS - 12, BANK_Y - COIN_RADIUS - 2, 5 * (COIN_RADIUS * 2 + 10) + 24, 50)
+PLAYERS_Y = SCREEN_HEIGHT - 200
+PLAYERS_RECT = pygame.Rect(0, PLAYERS_Y - 2, SCREEN_WIDTH, 204)
+
+def get_card_position(level, j):
+    return 300 + j * (CARD_WIDTH + 10), 10 + (2 - level) * (CARD_HEIGHT + 10)
+
+class BoardRenderer:
+    """
+    Draws a game onto a surface, redrawing only the parts of the board that
+    changed since the last time it was drawn.
+    The board is split into regions (the header, each card slot, the bank's
+    coins and the players); each region has a key describing what is shown in it,
+    and a region is redrawn only when its key changes.
+    """
+
+    def __init__(self, surface):
+        self.surface = surface
+        self.keys = {}
+
+    def invalidate(self):
+        """
+        Forces the whole board to be redrawn next time.
+        """
+        self.keys = {}
+
+    def get_regions(self, game, status=()):
+        """
+        Returns a dict of region name to (rect, key, draw function) for the game.
+        """
+        winner = game.get_winner() if game.final_state == "winning_points" else None
+        header_key = (game.turn, game.num_turns, game.current_player.name, sum(len(cards) for cards in game.cards),
+                      game.num_stuck_turns, game.final_state, winner.name if winner else None, tuple(status))
+        regions = {"header": (HEADER_RECT, header_key, lambda: self.draw_header(header_key))}
 
+        for level in [2, 1, 0]:
+            cards = game.cards[level][:game.num_cards_visible]
+            for j in range(game.num_cards_visible):
+                x, y = get_card_position(level, j)
+                rect = pygame.Rect(x - 2, y - 2, CARD_WIDTH + 4, CARD_HEIGHT + 4)
+                if j < len(cards):
+                    card = cards[j]
+                    regions[f"card{level}{j}"] = (rect, get_card_key(card), lambda card=card, x=x, y=y: draw_card(card, x, y, self.surface))
+                else:
+                    regions[f"card{level}{j}"] = (rect, None, lambda: None)
+
+        bank_key = tuple((color, len(coins)) for color, coins in game.coins.items())
+        regions["bank"] = (BANK_RECT, bank_key, lambda: self.draw_bank(bank_key))
+
+        players = list(game.players)
+        players_key = tuple(get_player_key(player) for player in players)
+        regions["players"] = (PLAYERS_RECT, players_key, lambda: self.draw_players(players))
+        return regions
+
+    def draw_header(self, header_key):
+        turn, num_turns, current_player, cards_left, num_stuck_turns, final_state, winner, status = header_key
         # Draw turn and active player
-        draw_text(f"Turn: {game.turn}", 10, 10)
-        draw_text(f"Num Turns: {game.num_turns}", 10, 40)
-        draw_text(f"Current Player: {game.current_player.name}", 10, 70)
+        draw_text(f"Turn: {turn}", 10, 10, surface=self.surface)
+        draw_text(f"Num Turns: {num_turns}", 10, 40, surface=self.surface)
+        draw_text(f"Current Player: {current_player}", 10, 70, surface=self.surface)
 
         # Draw "Take Turn" button
-        button_rect = pygame.Rect(10, 100, 100, 40)
-        pygame.draw.rect(screen, BLUE, button_rect)
-        draw_text("Take Turn", 20, 110, WHITE)
+        pygame.draw.rect(self.surface, BLUE, BUTTON_RECT)
+        draw_text("Take Turn", 20, 110, WHITE, surface=self.surface)
 
         # Draw number of cards left
-        draw_text(f"Cards Left: {sum(len(cards) for cards in game.cards)}", 10, 150)
-        draw_text(f"# turns stuck: {game.num_stuck_turns}", 10, 180)
-       
-        # Check if the game is over
-        if game.is_game_over():
-            draw_text(game.final_state, 10, 210)
-            winner = game.get_winner()
-            if winner and game.final_state == "winning_points":
-                draw_text(f"Winner: {winner.name}", 10, 240)
-    
-        # Draw players at the bottom in a horizontal line
-        for i, player in enumerate(game.players):
-            draw_player(player, 10 + i * 200, SCREEN_HEIGHT - 200)
+        draw_text(f"Cards Left: {cards_left}", 10, 150, surface=self.surface)
+        draw_text(f"# turns stuck: {num_stuck_turns}", 10, 180, surface=self.surface)
 
+        if final_state is not None:
+            draw_text(final_state, 10, 210, surface=self.surface)
+            if winner:
+                draw_text(f"Winner: {winner}", 10, 240, surface=self.surface)
 
+        for i, line in enumerate(status):
+            draw_text(line, 10, 270 + i * 30, surface=self.surface)
 
+    def draw_bank(self, bank_key):
         # Draw coins in the middle of the screen
-        for i, (color, coins) in enumerate(game.coins.items()):
-            draw_coin(color, SCREEN_WIDTH // 2 + i * (COIN_RADIUS * 2 + 10), SCREEN_HEIGHT - 250)
-            draw_text(str(len(coins)), SCREEN_WIDTH // 2 + i * (COIN_RADIUS * 2 + 10) - 10, (SCREEN_HEIGHT - 250) + COIN_RADIUS + 5)
+        for i, (color, num_coins) in enumerate(bank_key):
+            draw_coin(color, BANK_X + i * (COIN_RADIUS * 2 + 10), BANK_Y, surface=self.surface)
+            draw_text(str(num_coins), BANK_X + i * (COIN_RADIUS * 2 + 10) - 10, BANK_Y + COIN_RADIUS + 5, surface=self.surface)
 
+    def draw_players(self, players):
+        # Draw players at the bottom in a horizontal line
+        # (the panels overlap, so they are always drawn together, in order)
+        for i, player in enumerate(players):
+            draw_player(player, 10 + i * 200, PLAYERS_Y, self.surface)
+
+    def render(self, game, status=()):
+        """
+        Redraws the regions of the board that changed.
+        status is a list of extra lines of text to show in the header.
+        Returns:
+            list: The rects that were redrawn, for pygame.display.update.
+        """
+        dirty_rects = []
+        for name, (rect, key, draw) in self.get_regions(game, status).items():
+            if name in self.keys and self.keys[name] == key:
+                continue
+            self.surface.fill(WHITE, rect)
+            draw()
+            self.keys[name] = key
+            dirty_rects.append(rect)
+        return dirty_rects
+
+def get_simulation_status(simulation):
+    """
+    Returns the lines of text describing the simulation's controls.
+    """
+    if simulation.game_over:
+        state = "Game over"
+    elif simulation.paused:
+        state = "Paused (space: play)"
+    elif simulation.fast_forward:
+        state = "Fast forward (f: normal)"
+    else:
+        state = "Playing (space: pause)"
+    return [f"Speed: {simulation.turns_per_second:g} turns/s (up/down)", state]
+
+def playSplendorPyGame(game=None, auto_play=False, turns_per_second=2.0):
+    """
+    Shows a game being played.  The game is played by a SimulationThread, and
+    the latest snapshot it publishes is drawn, at most MAX_FPS times a second.
+    The "Take Turn" button takes a single turn; space pauses or plays the game,
+    up and down change the turns per second, and f toggles fast forward.
+    Args:
+        game (Game, optional): The game to show; by default a new 3 player game.
+        auto_play (bool): Whether to start playing right away, rather than paused.
+        turns_per_second (float): How fast turns are taken while playing.
+    """
+
+    if game is None:
+        # game = Game(num_players=4, max_turns=None, winning_points=1, strategy=CHEAPEST_STRATEGY)
+        strategies = [POINTS_STRATEGY, CHEAPEST_STRATEGY, RANDOM_STRATEGY]   
+        game = Game(num_players=3, max_turns=None, winning_points=15, strategies=strategies)
 
-        # Draw visible cards
-        # for level, cards in enumerate(game.cards):
-        # Draw visible cards
-        for level in [2, 1, 0]:
-            cards = game.cards[level]
-            y_position = 10 + (2 - level) * (CARD_HEIGHT + 10)
-            for j, card in enumerate(cards[:game.num_cards_visible]):
-                draw_card(card, 300 + j * (CARD_WIDTH + 10), y_position)
-        # for level in [2, 1, 0]:
-        #     cards = game.cards[level]    
-        #     for j, card in enumerate(cards[:game.num_cards_visible]):
-        #         draw_card(card, 300 + j * (CARD_WIDTH + 10), 10 + level * (CARD_HEIGHT + 10))
-
-
-        # Check for button click
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            if button_rect.collidepoint(event.pos) and can_take_turn and not game_over:
-                game.take_turn()
-                game.next_turn()
-                # game.describe()
-                can_take_turn = False
-                if not game.validate_game_state():
-                    print("Game state is invalid.")
-                    return
-                if game.is_game_over():
-                    print("Game Over")
-                    game_over = True
-        else:
-            can_take_turn = True        
-
-        pygame.display.flip()
+    print(f"Players: {game.players}")
+    initPyGame()
+
+    simulation = SimulationThread(
+        game,
+        turns_per_second=turns_per_second,
+        paused=not auto_play,
+        on_snapshot=lambda: pygame.event.post(pygame.event.Event(SNAPSHOT_EVENT)))
+    snapshot = simulation.get_latest_snapshot()
+    simulation.start()
+
+    clock = pygame.time.Clock()
+    renderer = BoardRenderer(screen)
+    screen.fill(WHITE)
+    pygame.display.flip()
+
+    while True:
+        # block until something happens (including a new snapshot), so an unchanged board costs no CPU
+        for event in [pygame.event.wait()] + pygame.event.get():
+            if event.type == pygame.QUIT:
+                simulation.stop()
+                pygame.quit()
+                sys.exit()
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                screen.fill(WHITE)
+                renderer.invalidate()
+            # Check for button click
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if BUTTON_RECT.collidepoint(event.pos):
+                    simulation.step()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    simulation.set_paused(not simulation.paused)
+                elif event.key == pygame.K_f:
+                    simulation.set_fast_forward(not simulation.fast_forward)
+                elif event.key == pygame.K_UP:
+                    simulation.set_turns_per_second(simulation.turns_per_second * 2)
+                elif event.key == pygame.K_DOWN:
+                    simulation.set_turns_per_second(simulation.turns_per_second / 2)
+
+        latest = simulation.get_latest_snapshot()
+        if latest is not None:
+            snapshot = latest
+            if snapshot.final_state is not None:
+                print(f"Game Over: {snapshot.final_state}")
+
+        dirty_rects = renderer.render(snapshot, get_simulation_status(simulation))
+        if dirty_rects:
+            pygame.display.update(dirty_rects)
+        clock.tick(MAX_FPS)
 
 def main():
     playSplendorPyGame()
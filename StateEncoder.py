@@ -0,0 +1,96 @@
+from itertools import combinations
+
+import numpy as np
+
+from GameState import GOLD_INDEX, BuyCard, Pass, TakeCoins
+from Splendor import CARD_CATALOG, COLORS, NOBLE_CATALOG, STATE_MAX_PLAYERS
+
+# bump whenever the layout of the features changes, so old datasets are not mixed with new ones
+ENCODING_VERSION = 2
+
+# the layout of the features: the bank, then per seat (starting with the player to move)
+# its coins, bonuses and points, then which cards are in the market, then which nobles
+# are on the board, then whose turn it is
+BANK_SIZE = len(COLORS) + 1
+PLAYER_SIZE = (len(COLORS) + 1) + len(COLORS) + 1
+MARKET_SIZE = len(CARD_CATALOG)
+NOBLES_SIZE = len(NOBLE_CATALOG)
+TURN_SIZE = STATE_MAX_PLAYERS + 1
+PLAYERS_OFFSET = BANK_SIZE
+MARKET_OFFSET = PLAYERS_OFFSET + STATE_MAX_PLAYERS * PLAYER_SIZE
+NOBLES_OFFSET = MARKET_OFFSET + MARKET_SIZE
+TURN_OFFSET = NOBLES_OFFSET + NOBLES_SIZE
+FEATURE_SIZE = TURN_OFFSET + TURN_SIZE
+
+# every action a player can take, each known by its index here
+ACTIONS = (
+    [BuyCard(card_id) for card_id in range(len(CARD_CATALOG))]
+    + [TakeCoins(colors) for num_colors in range(1, 4) for colors in combinations(COLORS, num_colors)]
+    + [TakeCoins((color, color)) for color in COLORS]
+    + [Pass()])
+ACTION_INDEX = {action: index for index, action in enumerate(ACTIONS)}
+
+
+def encode_state(state, out=None, seat=None):
+    """
+    Encodes a GameState from the point of view of the player to move as FEATURE_SIZE numbers.
+    Args:
+        state (GameState): The state to encode.
+        out (np.ndarray, optional): A float32 vector of FEATURE_SIZE to write the features into.
+        seat (int, optional): Encode from the point of view of this seat instead, as if it
+                              were its turn, e.g. to look at the position a player's action
+                              leads to the way that player's positions are trained on.
+    Returns:
+        np.ndarray: The features.
+    """
+
+    features = np.zeros(FEATURE_SIZE, dtype=np.float32) if out is None else out
+    if out is not None:
+        features[:] = 0
+    features[:BANK_SIZE] = state.bank
+    seat = state.turn if seat is None else seat
+    num_players = len(state.players)
+    for offset in range(num_players):
+        player = state.players[(seat + offset) % num_players]
+        start = PLAYERS_OFFSET + offset * PLAYER_SIZE
+        features[start:start + len(COLORS) + 1] = player.coins
+        features[start + len(COLORS) + 1:start + PLAYER_SIZE - 1] = player.bonuses
+        features[start + PLAYER_SIZE - 1] = player.points
+    for deck in state.decks:
+        for card_id in deck[:state.rules.num_cards_visible]:
+            features[MARKET_OFFSET + card_id] = 1
+    for noble_id in state.nobles:
+        features[NOBLES_OFFSET + noble_id] = 1
+    features[TURN_OFFSET + seat] = 1
+    features[TURN_OFFSET + STATE_MAX_PLAYERS] = state.num_turns
+    return features
+
+
+def infer_action(before, after):
+    """
+    Works out which action the player to move in one state took to reach the next one,
+    e.g. around a turn taken by one of the Game strategies.
+    Returns:
+        BuyCard, TakeCoins or Pass: The action.
+    """
+
+    player = before.players[before.turn]
+    played = after.players[before.turn]
+    if len(played.cards) > len(player.cards):
+        return BuyCard(played.cards[-1])
+    colors = []
+    for index, color in enumerate(COLORS):
+        colors += [color] * (played.coins[index] - player.coins[index])
+    if colors:
+        return TakeCoins(tuple(colors))
+    assert played.coins[GOLD_INDEX] == player.coins[GOLD_INDEX]
+    return Pass()
+
+
+def get_action_index(action):
+    """
+    Returns:
+        int: The index of the action in ACTIONS.
+    """
+
+    return ACTION_INDEX[action]
@@ -0,0 +1,220 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Splendor import Game
+from Splendor import RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY
+from Aggregator import ResultsAggregator
+from Experiment import get_game_seed, play_games
+
+# the experiment parameters a sweep can vary, and their defaults
+SWEEP_PARAMETERS = {
+    "num_players": 4,
+    "max_turns": None,
+    "winning_points": 15,
+    "strategy": RANDOM_STRATEGY,
+    "strategies": None,
+}
+
+# the columns of the sweep's summary table, after the cell's parameters
+SUMMARY_COLUMNS = [
+    "num_games", "num_turns_mean", "num_turns_std",
+    "winning_points_fraction", "max_turns_fraction", "players_stuck_fraction",
+    "two_coin_percentage_mean", "average_score_mean", "strategy_wins",
+]
+
+
+def expand_grid(grid):
+    """
+    Expands a grid of experiment parameters into the list of its cells.
+    Args:
+        grid (dict): Maps each parameter in SWEEP_PARAMETERS to the list of values to try.
+                     Parameters that are left out keep their default.
+    Returns:
+        list: One dict of all the SWEEP_PARAMETERS per cell.  Cells whose strategies
+              lineup has fewer strategies than players are left out.
+    """
+
+    unknown = set(grid) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    names = list(SWEEP_PARAMETERS)
+    values = [grid.get(name, [SWEEP_PARAMETERS[name]]) for name in names]
+    cells = []
+    for combination in itertools.product(*values):
+        cell = dict(zip(names, combination))
+        if cell["strategies"] is not None:
+            if len(cell["strategies"]) < cell["num_players"]:
+                continue
+            cell["strategies"] = list(cell["strategies"][:cell["num_players"]])
+        cells.append(cell)
+    return cells
+
+
+def get_cell_key(cell, num_games, seed):
+    """
+    Returns:
+        str: A key that changes whenever anything that affects the cell's results changes.
+    """
+
+    config = dict(cell, num_games=num_games, seed=seed)
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class Sweep:
+    """
+    Runs an experiment for every cell of a grid of parameters.
+    The games of all cells are split into chunks that are scheduled on one shared
+    pool of worker processes, so no worker idles while a cell finishes.
+    Each cell's summary is saved under the sweep's directory, and running the sweep
+    again only plays the cells whose configuration changed.
+    Attributes:
+        name (str): The name of the sweep, and of the directory its results go in.
+        grid (dict): The grid of parameters (see expand_grid).
+        num_games (int): The number of games played per cell.
+        game_class (class): The class representing the game to be played.
+        seed (int): The master seed of every cell.
+        workers (int, optional): The number of worker processes; by default one per core.
+        chunk_size (int): The number of games in each unit of work.
+    """
+
+    def __init__(self, name, grid, num_games, game_class=Game, seed=0, workers=None, chunk_size=50):
+        self.name = name
+        self.grid = grid
+        self.num_games = num_games
+        self.game_class = game_class
+        self.seed = seed
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cells = expand_grid(grid)
+        self.results_dir = os.path.join(os.getcwd(), name)
+        self.cells_dir = os.path.join(self.results_dir, "cells")
+
+    def get_cells(self):
+        return self.cells
+
+    def get_cell_path(self, cell):
+        return os.path.join(self.cells_dir, f"{get_cell_key(cell, self.num_games, self.seed)}.json")
+
+    def get_invalidated_cells(self):
+        """
+        Returns:
+            list: The cells that have no saved summary for their current configuration.
+        """
+
+        return [cell for cell in self.cells if not os.path.exists(self.get_cell_path(cell))]
+
+    def get_cell_chunks(self, cell):
+        """
+        Returns:
+            list: The seeds of the cell's games, split into chunks of at most chunk_size.
+        """
+
+        seeds = [get_game_seed(self.seed, igame) for igame in range(self.num_games)]
+        return [seeds[start:start + self.chunk_size] for start in range(0, len(seeds), self.chunk_size)]
+
+    def get_cell_summary(self, cell, aggregator):
+        """
+        Reduces a cell's aggregated results to a row of the summary table.
+        Returns:
+            dict: The cell's parameters followed by the SUMMARY_COLUMNS.
+        """
+
+        strategies = cell["strategies"] or [cell["strategy"]] * cell["num_players"]
+        labels = [f"player{i + 1}={strategy}" for i, strategy in enumerate(strategies)]
+        summary = aggregator.get_summary(labels)
+        num_games = summary["num_games"]
+        row = dict(cell)
+        row["num_games"] = num_games
+        row["num_turns_mean"] = summary["num_turns_mean"]
+        row["num_turns_std"] = summary["num_turns_std"]
+        for state, count in summary["final_states"].items():
+            row[f"{state}_fraction"] = count / num_games if num_games else None
+        row["two_coin_percentage_mean"] = summary["two_coin_percentage_mean"]
+        row["average_score_mean"] = summary["average_score_mean"]
+        row["strategy_wins"] = summary["strategy_wins"]
+        return row
+
+    def run(self, only_invalidated=True):
+        """
+        Plays the games of the sweep's cells and saves their summaries.
+        Args:
+            only_invalidated (bool): If True, cells that already have a saved summary
+                                     for their current configuration are not played again.
+        Returns:
+            list: The summary table, one row per cell (see get_cell_summary).
+        """
+
+        os.makedirs(self.cells_dir, exist_ok=True)
+        cells = self.get_invalidated_cells() if only_invalidated else self.cells
+
+        aggregators = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            for icell, cell in enumerate(cells):
+                strategies = cell["strategies"] or [cell["strategy"]] * cell["num_players"]
+                aggregators[icell] = ResultsAggregator(cell["num_players"], strategies, max_num_turns=cell["max_turns"])
+                for seeds in self.get_cell_chunks(cell):
+                    future = executor.submit(
+                        play_games, self.game_class, cell["num_players"], cell["max_turns"],
+                        cell["winning_points"], cell["strategy"], cell["strategies"], seeds)
+                    futures[future] = icell
+            for future in as_completed(futures):
+                aggregators[futures[future]].add_results(future.result())
+
+        for icell, cell in enumerate(cells):
+            with open(self.get_cell_path(cell), 'w') as json_file:
+                json.dump(self.get_cell_summary(cell, aggregators[icell]), json_file, indent=4)
+
+        table = self.get_table()
+        self.write_table(table)
+        return table
+
+    def get_table(self):
+        """
+        Returns:
+            list: The saved summary of every cell that has one, in the order of the grid.
+        """
+
+        table = []
+        for cell in self.cells:
+            path = self.get_cell_path(cell)
+            if os.path.exists(path):
+                with open(path) as json_file:
+                    table.append(json.load(json_file))
+        return table
+
+    def write_table(self, table):
+        """
+        Writes the summary table as summary.csv and summary.json in the sweep's directory.
+        """
+
+        with open(os.path.join(self.results_dir, "summary.json"), 'w') as json_file:
+            json.dump(table, json_file, indent=4)
+        with open(os.path.join(self.results_dir, "summary.csv"), 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=list(SWEEP_PARAMETERS) + SUMMARY_COLUMNS)
+            writer.writeheader()
+            for row in table:
+                row = dict(row)
+                row["strategies"] = "|".join(row["strategies"]) if row["strategies"] else ""
+                row["strategy_wins"] = json.dumps(row["strategy_wins"])
+                writer.writerow(row)
+
+
+def main():
+
+    strategies = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY, POINTS_STRATEGY]
+    grid = {
+        "num_players": [2, 3, 4],
+        "winning_points": list(range(1, 16)),
+        "strategies": [strategies],
+    }
+    sweep = Sweep("PlayersPointsSweep", grid, 100)
+    for row in sweep.run():
+        print(row)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+
+import numpy as np
+
+from Evaluator import ValueEvaluator
+from SelfPlay import SelfPlayDataset
+from Splendor import STATE_MAX_PLAYERS
+from StateEncoder import TURN_OFFSET
+
+# the feature holding the number of turns played, which is 0 exactly at the start of each game
+NUM_TURNS_FEATURE = TURN_OFFSET + STATE_MAX_PLAYERS
+
+
+def get_game_slices(rows):
+    """
+    Finds the games in the rows of a SelfPlayDataset, which are stored one after another.
+    Returns:
+        list: A slice of the rows per game.
+    """
+
+    starts = np.flatnonzero(rows["features"][:, NUM_TURNS_FEATURE] == 0).tolist()
+    return [slice(start, stop) for start, stop in zip(starts, starts[1:] + [len(rows)])]
+
+
+def get_standardization(rows, chunk_size=100000):
+    """
+    Works out the mean and standard deviation of each feature, a chunk of rows at a time.
+    Returns:
+        tuple: The mean and the standard deviation (1 for constant features).
+    """
+
+    total = 0.0
+    total_squares = 0.0
+    for start in range(0, len(rows), chunk_size):
+        features = np.asarray(rows["features"][start:start + chunk_size], dtype=np.float64)
+        total = total + features.sum(axis=0)
+        total_squares = total_squares + (features ** 2).sum(axis=0)
+    mean = total / max(len(rows), 1)
+    std = np.sqrt(np.maximum(total_squares / max(len(rows), 1) - mean ** 2, 0))
+    std[std < 1e-6] = 1
+    return mean, std
+
+
+def get_lambda_returns(values, outcome, lam):
+    """
+    The lambda-returns of the positions a player saw during one game, for offline TD(lambda):
+    the return of the last position is the outcome, and of every other position a blend of
+    the value of the next position and the return of the next position.
+    Args:
+        values (np.ndarray): The current estimates of the player's positions, in order.
+        outcome (float): How the game ended for the player.
+        lam (float): 0 bootstraps from the next position only (TD(0)), 1 uses the outcome (Monte Carlo).
+    Returns:
+        np.ndarray: The lambda-return of each position.
+    """
+
+    returns = np.empty(len(values), dtype=np.float32)
+    next_return = outcome
+    for index in range(len(values) - 1, -1, -1):
+        returns[index] = next_return
+        next_return = (1 - lam) * values[index] + lam * next_return
+    return returns
+
+
+def train_batch(evaluator, rows, lam, learning_rate):
+    """
+    Takes one gradient step towards the lambda-returns of the positions of some games.
+    Returns:
+        float: The mean squared error before the step.
+    """
+
+    outputs = evaluator.forward(rows["features"])
+    values = outputs[-1][:, 0]
+    seats = rows["features"][:, TURN_OFFSET:TURN_OFFSET + STATE_MAX_PLAYERS].argmax(axis=1)
+    starts = np.flatnonzero(rows["features"][:, NUM_TURNS_FEATURE] == 0).tolist()
+    targets = np.empty(len(rows), dtype=np.float32)
+    for start, stop in zip(starts, starts[1:] + [len(rows)]):
+        for seat in np.unique(seats[start:stop]):
+            indices = start + np.flatnonzero(seats[start:stop] == seat)
+            targets[indices] = get_lambda_returns(values[indices], float(rows["outcome"][indices[0]]), lam)
+
+    errors = values - targets
+    # back-propagate the mean squared error through the tanh layers
+    delta = (errors * (1 - values ** 2))[:, None] / len(rows)
+    for layer in range(len(evaluator.layers) - 1, -1, -1):
+        weights, biases = evaluator.layers[layer]
+        layer_input = outputs[layer]
+        weights_gradient = layer_input.T @ delta
+        biases_gradient = delta.sum(axis=0)
+        if layer > 0:
+            delta = (delta @ weights.T) * (1 - layer_input ** 2)
+        evaluator.layers[layer] = (weights - learning_rate * weights_gradient, biases - learning_rate * biases_gradient)
+    return float((errors ** 2).mean())
+
+
+def train_td_lambda(evaluator, rows, epochs=10, lam=0.7, learning_rate=0.05, batch_games=64, seed=0):
+    """
+    Trains an evaluator offline on self-play games with TD(lambda), a batch of games at
+    a time so the rows (e.g. the memory map of a SelfPlayDataset) never all have to be in memory.
+    The evaluator's standardization is fitted to the rows first.
+    Args:
+        evaluator (ValueEvaluator): The evaluator to train, in place.
+        rows (np.ndarray): Rows of a SelfPlayDataset.
+        epochs (int): The number of passes over the games.
+        lam (float): The lambda of TD(lambda).
+        learning_rate (float): The step size of gradient descent.
+        batch_games (int): The number of games per gradient step.
+        seed (int): Seeds the order the games are visited in.
+    Returns:
+        list: The mean squared error of each epoch.
+    """
+
+    mean, std = get_standardization(rows)
+    evaluator.mean = mean.astype(np.float32)
+    evaluator.std = std.astype(np.float32)
+    games = get_game_slices(rows)
+    rng = np.random.default_rng(seed)
+    losses = []
+    for epoch in range(epochs):
+        order = rng.permutation(len(games))
+        epoch_losses = []
+        for start in range(0, len(order), batch_games):
+            batch = [games[igame] for igame in sorted(order[start:start + batch_games])]
+            batch_rows = np.concatenate([rows[game] for game in batch])
+            epoch_losses.append(train_batch(evaluator, batch_rows, lam, learning_rate))
+        losses.append(float(np.mean(epoch_losses)) if epoch_losses else 0.0)
+    return losses
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Train the evaluator of the LEARNED strategy on a self-play dataset.")
+    parser.add_argument("dataset_dir")
+    parser.add_argument("--output", default="weights.npz")
+    parser.add_argument("--hidden", type=int, nargs="*", default=[], help="hidden layer sizes; none for a linear evaluator")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lam", type=float, default=0.7)
+    parser.add_argument("--learning-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    evaluator = ValueEvaluator.create(hidden_sizes=args.hidden)
+    losses = train_td_lambda(evaluator, SelfPlayDataset(args.dataset_dir).get_rows(),
+                             epochs=args.epochs, lam=args.lam, learning_rate=args.learning_rate)
+    for epoch, loss in enumerate(losses):
+        print(f"epoch {epoch}: mse {loss:.4f}")
+    evaluator.save(args.output)
+
+if __name__ == "__main__":
+    main()
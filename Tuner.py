@@ -0,0 +1,177 @@
+import argparse
+import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from Experiment import get_game_seed
+from Heuristic import DEFAULT_HEURISTIC_WEIGHTS, HEURISTIC_FEATURES, save_heuristic_weights
+from Splendor import Game, HEURISTIC_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY, RANDOM_STRATEGY
+
+# the game numbers of one round of one generation start at generation * GENERATION_GAMES + round * ROUND_GAMES
+GENERATION_GAMES = 2**24
+ROUND_GAMES = 2**20
+
+
+def play_candidate_games(weights, opponents, num_players, max_turns, winning_points, seed, igames):
+    """
+    Plays one game per game number with the HEURISTIC strategy and the given weights in
+    one seat and opponents from the pool in the others.  The candidate's seat and
+    opponents rotate with the game number, so every candidate playing the same game
+    numbers faces exactly the same games.
+    Returns:
+        int: The number of games the candidate won.
+    """
+
+    num_wins = 0
+    for igame in igames:
+        seat = igame % num_players
+        strategies = [opponents[(igame + iopponent) % len(opponents)] for iopponent in range(num_players - 1)]
+        strategies.insert(seat, HEURISTIC_STRATEGY)
+        game = Game(num_players=num_players, max_turns=max_turns, winning_points=winning_points,
+                    strategies=strategies, seed=get_game_seed(seed, igame))
+        game.heuristic_weights = weights
+        game.play_game(interactive=False)
+        if game.winner is game.players[seat]:
+            num_wins += 1
+    return num_wins
+
+
+class HeuristicTuner:
+    """
+    Tunes the weights of the HEURISTIC strategy against a fixed pool of opponents with a
+    simple genetic algorithm: each generation mutates the best weights so far into a
+    population of candidates, and successive halving picks the best of them.  Every
+    candidate still in the running plays the same new games each round, and the worse
+    half is dropped after each round while the survivors' games double, so clearly weak
+    candidates only ever cost a few games.
+    Attributes:
+        opponents (list): The strategies of the opponent pool.
+        history (list): The best candidate of each generation, with its win rate and games.
+        num_games_played (int): The games played so far.
+    """
+
+    def __init__(self, opponents, num_players=2, population_size=16, num_elites=2, generations=5, min_games=8,
+                 max_turns=300, winning_points=15, mutation_scale=0.5, seed=0, workers=None, chunk_size=8):
+        self.opponents = opponents
+        self.num_players = num_players
+        self.population_size = population_size
+        self.num_elites = num_elites
+        self.generations = generations
+        self.min_games = min_games
+        self.max_turns = max_turns
+        self.winning_points = winning_points
+        self.mutation_scale = mutation_scale
+        self.seed = seed
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.history = []
+        self.num_games_played = 0
+
+    def mutate(self, weights):
+        return {name: weights[name] + self.random.gauss(0, self.mutation_scale) for name in HEURISTIC_FEATURES}
+
+    def get_population(self, elites):
+        """
+        Returns:
+            list: The elites, then mutations of them up to population_size candidates.
+        """
+
+        population = [dict(weights) for weights in elites]
+        while len(population) < self.population_size:
+            population.append(self.mutate(elites[len(population) % len(elites)]))
+        return population
+
+    def play_round(self, executor, candidates, igames):
+        """
+        Plays the same games with each candidate, in parallel.
+        Returns:
+            list: The number of wins of each candidate.
+        """
+
+        chunks = [igames[start:start + self.chunk_size] for start in range(0, len(igames), self.chunk_size)]
+        futures = [[executor.submit(play_candidate_games, weights, self.opponents, self.num_players,
+                                    self.max_turns, self.winning_points, self.seed, chunk) for chunk in chunks]
+                   for weights in candidates]
+        self.num_games_played += len(candidates) * len(igames)
+        return [sum(future.result() for future in candidate_futures) for candidate_futures in futures]
+
+    def successive_halving(self, executor, population, generation):
+        """
+        Narrows a population down to num_elites candidates.
+        Returns:
+            list: The surviving candidates, best first, as (weights, win rate, games played).
+        """
+
+        wins = [0] * len(population)
+        games = [0] * len(population)
+        survivors = list(range(len(population)))
+        num_games = self.min_games
+        iround = 0
+        while True:
+            first_game = generation * GENERATION_GAMES + iround * ROUND_GAMES
+            round_wins = self.play_round(executor, [population[index] for index in survivors],
+                                         list(range(first_game, first_game + num_games)))
+            for index, num_wins in zip(survivors, round_wins):
+                wins[index] += num_wins
+                games[index] += num_games
+            survivors.sort(key=lambda index: wins[index] / games[index], reverse=True)
+            if len(survivors) <= self.num_elites:
+                break
+            survivors = survivors[:max(len(survivors) // 2, self.num_elites)]
+            num_games *= 2
+            iround += 1
+        return [(population[index], wins[index] / games[index], games[index]) for index in survivors]
+
+    def run(self):
+        """
+        Returns:
+            dict: The best weights found.
+        """
+
+        elites = [dict(DEFAULT_HEURISTIC_WEIGHTS)]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for generation in range(self.generations):
+                ranked = self.successive_halving(executor, self.get_population(elites), generation)
+                elites = [weights for weights, win_rate, num_games in ranked]
+                self.history.append(ranked[0])
+                logging.info(f"generation {generation}: best win rate {ranked[0][1]:.3f} over {ranked[0][2]} games")
+        return self.get_best_weights()
+
+    def get_best_weights(self):
+        """
+        Returns:
+            dict: The weights of the last generation's best candidate.
+        """
+
+        return self.history[-1][0] if self.history else dict(DEFAULT_HEURISTIC_WEIGHTS)
+
+    def write_strategy_file(self, path):
+        weights, win_rate, num_games = self.history[-1]
+        save_heuristic_weights(path, weights, win_rate=win_rate, num_games=num_games,
+                               opponents=self.opponents, num_players=self.num_players)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Tune the weights of the HEURISTIC strategy.")
+    parser.add_argument("--output", default="heuristic.json")
+    parser.add_argument("--opponents", nargs="+", default=[CHEAPEST_STRATEGY, POINTS_STRATEGY, RANDOM_STRATEGY])
+    parser.add_argument("--num-players", type=int, default=2)
+    parser.add_argument("--population-size", type=int, default=16)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--min-games", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    tuner = HeuristicTuner(args.opponents, num_players=args.num_players, population_size=args.population_size,
+                           generations=args.generations, min_games=args.min_games, seed=args.seed, workers=args.workers)
+    tuner.run()
+    tuner.write_strategy_file(args.output)
+    for generation, (weights, win_rate, num_games) in enumerate(tuner.history):
+        print(f"generation {generation}: win rate {win_rate:.3f} over {num_games} games")
+    print(f"played {tuner.num_games_played} games, wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
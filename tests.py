@@ -1,6 +1,47 @@
+import asyncio
 from copy import copy
+import random
+import json
+import multiprocessing
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
 import unittest
-from Splendor import Game, Player, Coin, Card, Noble, COLORS, COLORS_DICT
+import urllib.request
+import numpy as np
+from Splendor import Game, Player, Coin, Card, Noble, COLORS, COLORS_DICT, GOLD, STATE_STRUCT, CARD_CATALOG
+from Splendor import NOBLE_CATALOG, NOBLE_POINTS, STATE_MAX_PLAYERS, pack_bonuses, meets_requirements
+from Splendor import RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY, LEARNED_STRATEGY, HEURISTIC_STRATEGY, PLANNER_STRATEGY
+from GameState import step, get_legal_actions, get_final_state, TakeCoins, BuyCard, Pass
+from Experiment import Experiment, play_games, get_game_seed
+from Rollouts import run_rollouts, get_wilson_interval
+from StateEncoder import encode_state, infer_action, get_action_index, ACTIONS, FEATURE_SIZE, MARKET_OFFSET, NOBLES_OFFSET, TURN_OFFSET, PLAYERS_OFFSET, PLAYER_SIZE
+from SelfPlay import SelfPlayDataset, generate_self_play
+from Evaluator import ValueEvaluator
+from TDTrainer import train_td_lambda, get_lambda_returns, get_game_slices
+from AffordTable import build_afford_table, get_afford_table, get_turns_to_afford, UNREACHABLE
+from CoinPlanner import plan_coin_take
+from GameState import CARD_COSTS
+from DeckTracker import DeckTracker
+from EngineDiff import ReferenceEngine, PackedEngine, run_lockstep, compare_games, compare_outcomes
+from EngineDiff import run_statistical, get_chi_square_p_value
+from Instrumentation import STUCK_CAUSES
+from Profiling import get_collapsed_stacks
+from Progress import ExperimentProgress
+from Heuristic import DEFAULT_HEURISTIC_WEIGHTS, HEURISTIC_FEATURES, UNREACHABLE_TURNS, get_heuristic_features, choose_heuristic_action, load_heuristic_weights
+from Tuner import HeuristicTuner
+from GameServer import AgentSession, GameServer, StandInAgent
+from Sweep import Sweep, expand_grid
+from ResultCache import ResultCache, get_cache_key
+from Simulation import SimulationThread
+from Shards import ShardCoordinator
+from SharedResults import SharedResultBuffer, run_shared
+from ReplayRenderer import save_png_sequence, save_gif, get_experiment_replay_jobs, render_replays
+import SplendorPyGame
+from Aggregator import ResultsAggregator, RunningStats, Histogram
+from Results import get_game_result, results_to_array, get_final_state_counts, get_win_counts, get_summary, FINAL_STATES
 
 class TestGame(unittest.TestCase):
 
@@ -149,6 +190,807 @@ class TestGame(unittest.TestCase):
 
         self.assertTrue(game.validate_game_state())
 
+    def test_seeded_games_repeat(self):
+        results = []
+        for i in range(2):
+            game = Game(num_players=3, strategy=RANDOM_STRATEGY, seed=7)
+            game.play_game(interactive=False)
+            results.append(get_game_result(game))
+        self.assertEqual(results[0], results[1])
+
+    def test_pay_for_card_uses_cards_coins_and_gold(self):
+        game = Game(shuffle=False)
+        player = game.players[0]
+        cost = copy(COLORS_DICT)
+        cost["red"] = 3
+        cost["blue"] = 1
+        card = Card(points=1, color="green", level=0, cost=cost, owner=None)
+
+        player.add_card(Card(points=0, color="red", level=0, cost=copy(COLORS_DICT), owner=player.name))
+        game.take_coin_of_color(player, "red")
+        game.take_coin_of_color(player, "blue")
+        game.take_coin_of_color(player, "green")
+        player.add_coin(Coin(GOLD, owner=player.name, wild=True))
+
+        payment = game.pay_for_card(player, card)
+
+        self.assertEqual(payment.bonuses["red"], 1)
+        self.assertEqual(payment.coins["red"], 1)
+        self.assertEqual(payment.coins["blue"], 1)
+        self.assertEqual(payment.gold, 1)
+        self.assertEqual(payment.get_num_coins(), 3)
+        # only the green coin is left
+        self.assertEqual([coin.color for coin in player.coins], ["green"])
+        self.assertEqual(len(game.coins["red"]), 6)
+        self.assertEqual(len(game.coins["blue"]), 6)
+        self.assertEqual(len(game.gold), 1)
+
+    def test_pay_for_card_cannot_afford(self):
+        game = Game(shuffle=False)
+        player = game.players[0]
+        card = game.cards[0][0]
+        game.take_coin_of_color(player, "green")
+
+        self.assertIsNone(game.pay_for_card(player, card))
+        # nothing was spent
+        self.assertEqual(len(player.coins), 1)
+        self.assertEqual(len(game.coins["green"]), 5)
+
+    def test_buy_most_expensive_card_uses_cards(self):
+        game = Game(shuffle=False)
+        player = game.players[0]
+
+        # black card costs 3 green
+        card = game.cards[0][0]
+        player.add_card(Card(points=0, color="green", level=0, cost=copy(COLORS_DICT), owner=player.name))
+        for i in range(2):
+            game.take_coin_of_color(player, "green")
+        # only leave the level 0 cards on the board
+        game.cards[1] = []
+        game.cards[2] = []
+
+        bought_card, last_card = game.buy_most_expensive_card(player)
+
+        self.assertTrue(bought_card)
+        self.assertEqual(last_card, card)
+        self.assertEqual(len(player.coins), 0)
+        self.assertEqual(len(game.coins["green"]), 6)
+
+    def test_state_bytes_round_trip(self):
+        game = Game(num_players=3, strategies=[RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3)
+        for i in range(40):
+            game.take_turn()
+            game.next_turn()
+        data = game.to_bytes()
+        self.assertEqual(len(data), STATE_STRUCT.size)
+        self.assertEqual(STATE_STRUCT.size, 149)
+        self.assertEqual(len(Game().to_bytes()), len(data))
+
+        copied = Game.from_bytes(data)
+
+        self.assertEqual(copied.to_bytes(), data)
+        self.assertTrue(copied.validate_game_state())
+        self.assertEqual(copied.players.index(copied.current_player), game.players.index(game.current_player))
+        self.assertEqual(copied.num_turns, game.num_turns)
+        for player, copied_player in zip(game.players, copied.players):
+            self.assertEqual(copied_player.strategy, player.strategy)
+            self.assertEqual(copied_player.get_coins_dict(), player.get_coins_dict())
+            self.assertEqual(copied_player.get_total_points(), player.get_total_points())
+        for cards, copied_cards in zip(game.cards, copied.cards):
+            self.assertEqual([card.card_id for card in copied_cards], [card.card_id for card in cards])
+
+    def test_state_bytes_keep_playing(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=5)
+        for i in range(10):
+            game.take_turn()
+            game.next_turn()
+        copied = Game.from_bytes(game.to_bytes(), seed=11)
+        game.random.seed(11)
+        for i in range(10):
+            for g in [game, copied]:
+                g.take_turn()
+                g.next_turn()
+        self.assertEqual(copied.to_bytes(), game.to_bytes())
+
+class TestGameState(unittest.TestCase):
+
+    def setUp(self):
+        self.game = Game(num_players=3, strategies=[RANDOM_STRATEGY] * 3, seed=1)
+        self.state = self.game.get_state()
+
+    def test_step_shares_unchanged_parts(self):
+        branch = step(self.state, TakeCoins(("red", "blue", "green")))
+
+        # the original is untouched
+        self.assertEqual(self.state.bank, (6, 6, 6, 6, 6, 0))
+        self.assertEqual(branch.bank, (5, 5, 5, 6, 6, 0))
+        self.assertEqual(branch.players[0].coins, (1, 1, 1, 0, 0, 0))
+        self.assertEqual(branch.turn, 1)
+        self.assertIs(branch.decks, self.state.decks)
+        self.assertIs(branch.players[1], self.state.players[1])
+        self.assertIs(branch.rules, self.state.rules)
+
+    def test_illegal_actions(self):
+        with self.assertRaises(ValueError):
+            step(self.state, BuyCard(self.state.decks[2][0]))
+        with self.assertRaises(ValueError):
+            step(self.state, TakeCoins(("red", "red", "blue")))
+        state = step(step(step(self.state, Pass()), Pass()), Pass())
+        self.assertEqual(get_final_state(state), ("players_stuck", None))
+
+    def test_engine_rejects_illegal_actions(self):
+        data = self.game.to_bytes()
+        for action in [TakeCoins(("red", "red", "blue")), TakeCoins(("red", "gold")), BuyCard(self.state.decks[2][0])]:
+            with self.assertRaises(ValueError):
+                self.game.take_turn(action)
+            self.assertEqual(self.game.to_bytes(), data)
+
+        # two of a color need min_coins_for_two of it in the bank
+        self.game.coins["red"] = self.game.coins["red"][:3]
+        with self.assertRaises(ValueError):
+            self.game.take_turn(TakeCoins(("red", "red")))
+        self.assertEqual(len(self.game.players[0].coins), 0)
+
+    def test_random_playout_keeps_totals(self):
+        rng = random.Random(0)
+        state = self.state
+        while get_final_state(state)[0] is None:
+            state = step(state, rng.choice(get_legal_actions(state)))
+            coins = [sum(column) for column in zip(state.bank, *(player.coins for player in state.players))]
+            self.assertEqual(coins, [6, 6, 6, 6, 6, 0])
+            self.assertEqual(sum(len(deck) for deck in state.decks) + sum(len(player.cards) for player in state.players),
+                             len(CARD_CATALOG))
+        final_state, winner = get_final_state(state)
+        self.assertEqual(final_state, "winning_points")
+        self.assertGreaterEqual(state.players[winner].points, self.state.rules.winning_points)
+
+        # the game can be brought to the end of the playout
+        self.game.set_state(state)
+        self.assertTrue(self.game.validate_game_state())
+        self.assertEqual(self.game.get_state(), state)
+        self.assertTrue(self.game.is_game_over())
+        self.assertEqual(self.game.players.index(self.game.winner), winner)
+
+    def test_game_step_matches_engine(self):
+        other = Game(num_players=3, strategies=[RANDOM_STRATEGY] * 3, seed=1)
+        for color in ["white", "black", "red"]:
+            other.take_coin_of_color(other.players[0], color)
+        other.next_turn()
+
+        self.game.step(TakeCoins(("white", "black", "red")))
+
+        self.assertEqual(self.game.to_bytes(), other.to_bytes())
+
+class TestRollouts(unittest.TestCase):
+
+    def test_wilson_interval(self):
+        low, high = get_wilson_interval(0, 10)
+        self.assertEqual(low, 0.0)
+        self.assertGreater(high, 0.0)
+        low, high = get_wilson_interval(5, 10)
+        self.assertLess(low, 0.5)
+        self.assertGreater(high, 0.5)
+        self.assertEqual(get_wilson_interval(0, 0), (None, None))
+
+    def test_run_rollouts(self):
+        game = Game(num_players=3, strategies=[RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=2)
+        for i in range(30):
+            game.take_turn()
+            game.next_turn()
+        data = game.to_bytes()
+
+        summary = run_rollouts(game, 12, seed=4, workers=2, chunk_size=5)
+
+        self.assertEqual(game.to_bytes(), data)
+        self.assertEqual(summary["num_rollouts"], 12)
+        probabilities = [win["probability"] for win in summary["win_probabilities"].values()]
+        self.assertAlmostEqual(sum(probabilities) + summary["no_winner"]["probability"], 1.0)
+        for win in summary["win_probabilities"].values():
+            self.assertLessEqual(win["low"], win["probability"])
+            self.assertGreaterEqual(win["high"], win["probability"])
+        self.assertGreater(summary["remaining_turns_mean"], 0)
+        self.assertEqual(run_rollouts(game, 12, seed=4, workers=1), summary)
+
+class TestSelfPlay(unittest.TestCase):
+
+    def test_encode_state(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3)
+        game.step(TakeCoins(("red", "red")))
+        state = game.get_state()
+
+        features = encode_state(state)
+
+        self.assertEqual(features.shape, (FEATURE_SIZE,))
+        self.assertEqual(list(features[:6]), [4, 6, 6, 6, 6, 0])
+        # the player to move comes first, the player who took the coins second
+        self.assertEqual(features[6], 0)
+        self.assertEqual(features[6 + 12], 2)
+        self.assertEqual(features[MARKET_OFFSET:NOBLES_OFFSET].sum(), 12)
+        self.assertEqual(features[NOBLES_OFFSET:TURN_OFFSET].sum(), 3)
+        self.assertEqual(features[TURN_OFFSET + 1], 1)
+
+    def test_infer_action(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3)
+        before = game.get_state()
+        action = TakeCoins(("red", "green", "black"))
+        after = step(before, action)
+        self.assertEqual(infer_action(before, after), action)
+        self.assertEqual(ACTIONS[get_action_index(action)], action)
+        self.assertEqual(infer_action(before, step(before, Pass())), Pass())
+
+    def test_generate_grows_dataset(self):
+        experiment = Experiment("self_play", Game, 6, max_turns=200, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=9)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            num_rows = generate_self_play(SelfPlayDataset(tmp_dir), experiment, workers=2, chunk_size=2)
+            more_rows = generate_self_play(SelfPlayDataset(tmp_dir), experiment, workers=2, chunk_size=4)
+
+            dataset = SelfPlayDataset(tmp_dir)
+            rows = dataset.get_rows()
+            self.assertEqual(dataset.num_games, 12)
+            self.assertEqual(len(rows), num_rows + more_rows)
+            # the second run played other games
+            self.assertNotEqual(len(rows[:num_rows]), 0)
+            self.assertFalse(np.array_equal(rows[:num_rows]["action"][:50], rows[num_rows:]["action"][:50]))
+            self.assertTrue(set(np.unique(rows["outcome"])) <= {-1, 0, 1})
+            self.assertTrue((rows["features"][:, :6].sum(axis=1) <= 30).all())
+
+class TestEvaluator(unittest.TestCase):
+
+    def test_save_and_load(self):
+        evaluator = ValueEvaluator.create(hidden_sizes=(8,), seed=1)
+        features = np.ones((3, FEATURE_SIZE), dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "weights.npz")
+            evaluator.save(path)
+            loaded = ValueEvaluator.load(path)
+        self.assertTrue(np.allclose(loaded.evaluate(features), evaluator.evaluate(features)))
+
+    def test_learned_strategy_plays(self):
+        game = Game(num_players=2, strategies=[LEARNED_STRATEGY, CHEAPEST_STRATEGY], seed=3, max_turns=300)
+        game.evaluator = ValueEvaluator.create(seed=2)
+        state = game.get_state()
+        self.assertIn(game.evaluator.choose_action(state), get_legal_actions(state))
+
+        game.play_game(interactive=False)
+
+        self.assertIsNotNone(game.final_state)
+        self.assertTrue(game.validate_game_state())
+        self.assertGreater(len(game.players[0].cards), 0)
+
+    def test_scores_positions_as_trained(self):
+        class CoinsEvaluator(ValueEvaluator):
+            # likes the coins of the seat the position is seen from, and of the seat two after it
+            def evaluate(self, features):
+                self.features = features.copy()
+                own = features[:, PLAYERS_OFFSET:PLAYERS_OFFSET + len(COLORS)].sum(axis=1)
+                third = PLAYERS_OFFSET + 2 * PLAYER_SIZE
+                return own + features[:, third:third + len(COLORS)].sum(axis=1)
+
+        evaluator = CoinsEvaluator.create(seed=1)
+        state = Game(num_players=3, strategy=CHEAPEST_STRATEGY, seed=5).get_state()
+        actions = get_legal_actions(state)
+
+        # from the next seat's point of view the mover is the seat two after it, so
+        # hurting the next seat would mean taking as few coins as possible
+        action = evaluator.choose_action(state)
+        self.assertEqual(sum(step(state, action).players[0].coins), 3)
+        for row, action in zip(evaluator.features, actions):
+            self.assertTrue(np.array_equal(row, encode_state(step(state, action), seat=0)))
+            # the seat one-hot the TD targets are grouped by
+            self.assertEqual(row[TURN_OFFSET:TURN_OFFSET + STATE_MAX_PLAYERS].argmax(), 0)
+
+    def test_lambda_returns(self):
+        values = np.array([0.2, 0.4, 0.6], dtype=np.float32)
+        self.assertTrue(np.allclose(get_lambda_returns(values, 1.0, 0.0), [0.4, 0.6, 1.0]))
+        self.assertTrue(np.allclose(get_lambda_returns(values, 1.0, 1.0), [1.0, 1.0, 1.0]))
+        self.assertTrue(np.allclose(get_lambda_returns(values, -1.0, 0.5), [0.1, -0.2, -1.0]))
+
+    def test_train_td_lambda(self):
+        experiment = Experiment("self_play", Game, 10, max_turns=200, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=9)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset = SelfPlayDataset(tmp_dir)
+            generate_self_play(dataset, experiment, workers=2)
+            rows = dataset.get_rows()
+            self.assertEqual(len(get_game_slices(rows)), 10)
+
+            evaluator = ValueEvaluator.create(hidden_sizes=(16,))
+            losses = train_td_lambda(evaluator, rows, epochs=5, batch_games=4)
+
+        self.assertEqual(len(losses), 5)
+        self.assertLess(losses[-1], losses[0])
+
+class TestHeuristic(unittest.TestCase):
+
+    def test_heuristic_strategy_plays(self):
+        game = Game(num_players=2, strategies=[HEURISTIC_STRATEGY, CHEAPEST_STRATEGY], seed=3, max_turns=300)
+        game.heuristic_weights = DEFAULT_HEURISTIC_WEIGHTS
+        game.play_game(interactive=False)
+        self.assertIsNotNone(game.final_state)
+        self.assertTrue(game.validate_game_state())
+
+    def test_heuristic_features(self):
+        game = Game(num_players=2, strategies=[HEURISTIC_STRATEGY, CHEAPEST_STRATEGY], seed=3)
+        state = game.get_state()
+        features = get_heuristic_features(step(state, TakeCoins(("red", "red"))), 0, TakeCoins(("red", "red")))
+        self.assertEqual(features["coins"], 2)
+        self.assertEqual(features["two_coins"], 1)
+        self.assertEqual(choose_heuristic_action(state, {"two_coins": 1.0}), TakeCoins(("red", "red")))
+
+    def test_turns_feature(self):
+        state = Game(num_players=2, strategies=[HEURISTIC_STRATEGY, CHEAPEST_STRATEGY], seed=3).get_state()
+        after = step(state, TakeCoins(("red", "red")))
+        self.assertEqual(get_heuristic_features(after, 0, TakeCoins(("red", "red")), with_turns=False)["turns"], 0)
+        self.assertLessEqual(get_heuristic_features(after, 0, TakeCoins(("red", "red")))["turns"], UNREACHABLE_TURNS)
+
+        # a player with no room for coins can reach no card
+        full = after._replace(rules=after.rules._replace(max_coins=0))
+        self.assertEqual(get_heuristic_features(full, 0, TakeCoins(("red", "red")))["turns"], UNREACHABLE_TURNS)
+
+    def test_tuner_halves_candidates(self):
+        tuner = HeuristicTuner([RANDOM_STRATEGY], population_size=4, num_elites=1, generations=2,
+                               min_games=2, max_turns=200, workers=2, chunk_size=2)
+        best = tuner.run()
+
+        self.assertEqual(set(best), set(HEURISTIC_FEATURES))
+        self.assertEqual(len(tuner.history), 2)
+        # 4 candidates play 2 games, 2 play 4 more, then 1 plays 8 more, per generation
+        self.assertEqual(tuner.num_games_played, 2 * (4 * 2 + 2 * 4 + 1 * 8))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "heuristic.json")
+            tuner.write_strategy_file(path)
+            self.assertEqual(load_heuristic_weights(path), best)
+
+class TestGameServer(unittest.TestCase):
+
+    def play(self, server, agents_games, path=None):
+        async def run():
+            address = await server.start(path=path)
+            port = None if path is not None else address[1]
+            results = await asyncio.gather(*(agent.play(games, port=port, path=path) for agent, games in agents_games))
+            await server.wait_for_games()
+            await server.close()
+            return results
+        return asyncio.run(run())
+
+    def test_concurrent_games(self):
+        server = GameServer(move_deadline=2.0)
+        games = [{"strategies": ["AGENT", CHEAPEST_STRATEGY], "seed": seed, "max_turns": 300} for seed in range(20)]
+
+        results, = self.play(server, [(StandInAgent("bot"), games)])
+
+        self.assertEqual(len(results), 20)
+        self.assertEqual(len(server.results), 20)
+        for message in results.values():
+            self.assertIn(message["final_state"], ["winning_points", "max_turns", "players_stuck"])
+        report = server.get_latency_report()["bot"]
+        self.assertGreater(report["num_moves"], 20)
+        self.assertEqual(report["num_timeouts"], 0)
+        self.assertLess(report["p50_ms"], 2000)
+
+    def test_missed_deadlines(self):
+        server = GameServer(move_deadline=0.01)
+        games = [{"strategies": ["AGENT", "AGENT"], "seed": 1, "max_turns": 6}]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results, = self.play(server, [(StandInAgent("slow", delay=0.05), games)],
+                                 path=os.path.join(tmp_dir, "server.sock"))
+
+        self.assertEqual(list(results.values())[0]["final_state"], "max_turns")
+        self.assertEqual(server.get_latency_report()["slow"]["num_timeouts"], 6)
+
+    def test_invalid_games_refused(self):
+        server = GameServer()
+        games = [{"strategies": ["AGENT", "NO_SUCH_STRATEGY"]}, {"strategies": ["AGENT"]},
+                 {"strategies": ["AGENT", CHEAPEST_STRATEGY], "seed": 1, "max_turns": 4},
+                 {"strategies": ["AGENT", CHEAPEST_STRATEGY], "max_turns": "4"},
+                 {"strategies": ["AGENT", CHEAPEST_STRATEGY], "winning_points": True, "seed": 1.5}]
+        agent = StandInAgent("bot")
+
+        results, = self.play(server, [(agent, games)])
+
+        self.assertEqual(len(results), 1)
+        errors = {error["ref"]: error["message"] for error in agent.errors}
+        self.assertEqual(sorted(errors), [0, 1, 3, 4])
+        self.assertIn("NO_SUCH_STRATEGY", errors[0])
+        self.assertIn("max_turns", errors[3])
+        self.assertIn("winning_points, seed", errors[4])
+
+    def test_sends_wait_for_agent(self):
+        class SlowWriter:
+            def __init__(self):
+                self.written = []
+                self.num_drained = 0
+
+            def write(self, data):
+                self.written.append(data)
+
+            async def drain(self):
+                await asyncio.sleep(0.01)
+                self.num_drained = len(self.written)
+
+        writer = SlowWriter()
+        session = AgentSession(GameServer(), writer, "bot")
+        asyncio.run(session.send({"type": "error", "message": "slow"}))
+        self.assertEqual(writer.num_drained, 1)
+        self.assertEqual(json.loads(writer.written[0])["message"], "slow")
+
+    def test_engine_errors_reported(self):
+        class FailingServer(GameServer):
+            @staticmethod
+            def take_turn(game, action):
+                raise RuntimeError("engine failure")
+
+        server = FailingServer()
+        agent = StandInAgent("bot")
+
+        results, = self.play(server, [(agent, [{"strategies": [CHEAPEST_STRATEGY, "AGENT"], "seed": 1}])])
+
+        self.assertEqual(results, {})
+        self.assertEqual(len(agent.errors), 1)
+        self.assertIn("engine failure", agent.errors[0]["message"])
+        self.assertEqual(server.results, [])
+
+class TestNobles(unittest.TestCase):
+
+    def test_nobles_dealt(self):
+        for num_players in range(2, 5):
+            game = Game(num_players=num_players, strategies=[CHEAPEST_STRATEGY] * num_players, seed=1)
+            self.assertEqual(len(game.nobles), num_players + 1)
+            self.assertEqual(len({noble.noble_id for noble in game.nobles}), num_players + 1)
+            self.assertTrue(game.validate_game_state())
+
+    def test_meets_requirements(self):
+        requirements = pack_bonuses({"red": 3, "green": 3, "black": 3})
+        self.assertTrue(meets_requirements(pack_bonuses({"red": 3, "green": 5, "black": 3, "blue": 1}), requirements))
+        self.assertFalse(meets_requirements(pack_bonuses({"red": 3, "green": 5, "black": 2, "blue": 9}), requirements))
+        self.assertFalse(meets_requirements(0, requirements))
+        self.assertTrue(meets_requirements(0, 0))
+
+    def test_visit_noble(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, CHEAPEST_STRATEGY], seed=1)
+        player = game.players[0]
+        noble = game.nobles[0]
+        for color, count in noble.requirements.items():
+            for _ in range(count):
+                player.add_card(Card(level=1, color=color, points=0, cost={}))
+        game.take_turn()
+
+        self.assertIn(noble, player.nobles)
+        self.assertNotIn(noble, game.nobles)
+        self.assertEqual(noble.owner, player.name)
+        self.assertEqual(len(game.nobles), 2)
+
+    def test_nobles_round_trip(self):
+        game = Game(num_players=3, strategies=[CHEAPEST_STRATEGY] * 3, seed=4)
+        game.play_game(interactive=False)
+        self.assertGreater(sum(len(player.nobles) for player in game.players), 0)
+
+        copied = Game.from_bytes(game.to_bytes())
+        self.assertEqual(copied.to_bytes(), game.to_bytes())
+        self.assertEqual([noble.noble_id for noble in copied.nobles], [noble.noble_id for noble in game.nobles])
+        self.assertEqual([player.get_total_points() for player in copied.players],
+                         [player.get_total_points() for player in game.players])
+        self.assertEqual([player.packed_bonuses for player in copied.players],
+                         [player.packed_bonuses for player in game.players])
+
+    def test_step_awards_noble(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, CHEAPEST_STRATEGY], seed=1)
+        state = game.get_state()
+        noble_id = state.nobles[0]
+        bonuses = tuple(NOBLE_CATALOG[noble_id].get(color, 0) for color in COLORS)
+        player = state.players[0]._replace(bonuses=bonuses, packed_bonuses=pack_bonuses(NOBLE_CATALOG[noble_id]))
+        state = state._replace(players=(player,) + state.players[1:])
+
+        after = step(state, TakeCoins(("red",)))
+
+        self.assertEqual(after.players[0].nobles, (noble_id,))
+        self.assertEqual(after.players[0].points, NOBLE_POINTS)
+        self.assertNotIn(noble_id, after.nobles)
+
+
+class TestAffordTable(unittest.TestCase):
+
+    def test_turns_follow_coin_rules(self):
+        table = build_afford_table()
+        self.assertEqual(get_turns_to_afford((0, 0, 0, 0, 0), 0, table=table), 0)
+        self.assertEqual(get_turns_to_afford((1, 1, 1, 0, 0), 10, table=table), 1)
+        self.assertEqual(get_turns_to_afford((2, 0, 0, 0, 0), 10, table=table), 1)
+        self.assertEqual(get_turns_to_afford((3, 0, 0, 0, 0), 10, table=table), 2)
+        self.assertEqual(get_turns_to_afford((1, 1, 1, 1, 0), 10, table=table), 2)
+        # three different colors a turn would fill the room with coins that are not needed
+        self.assertEqual(get_turns_to_afford((4, 0, 0, 0, 0), 4, table=table), 2)
+        self.assertEqual(get_turns_to_afford((4, 0, 0, 0, 0), 3, table=table), UNREACHABLE)
+        self.assertEqual(get_turns_to_afford((3, 0, 0, 0, 0), 10, gold=1, table=table), 1)
+
+    def test_shortfall_beyond_table(self):
+        table = build_afford_table()
+        self.assertEqual(get_turns_to_afford((8, 0, 0, 0, 0), 10, table=table), 4)
+        self.assertEqual(get_turns_to_afford((9, 1, 0, 0, 0), 10, table=table), 5)
+        self.assertEqual(get_turns_to_afford((11, 0, 0, 0, 0), 10, table=table), UNREACHABLE)
+        player = Player("Player 1")
+        card = Card(color="red", level=2, points=5, cost={"blue": 8})
+        self.assertEqual(player.get_turns_to_afford(card), 4)
+
+    def test_table_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "afford_table.npy")
+            table = get_afford_table(path)
+            self.assertIsInstance(table, np.memmap)
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(np.array_equal(table, build_afford_table()))
+            self.assertIs(get_afford_table(path), table)
+            del table
+            get_afford_table.cache_clear()
+
+    def test_player_turns_to_afford(self):
+        player = Player("Player 1")
+        card = Card(color="red", level=0, points=0, cost={"blue": 2, "green": 1})
+        # two blue and one green take two turns either way
+        self.assertEqual(player.get_turns_to_afford(card), 2)
+        player.add_coin(Coin("blue", player.name))
+        self.assertEqual(player.get_turns_to_afford(card), 1)
+        player.add_coin(Coin("blue", player.name))
+        player.add_card(Card(color="green", level=0, points=0, cost={}))
+        self.assertEqual(player.get_turns_to_afford(card), 0)
+
+
+class TestCoinPlanner(unittest.TestCase):
+
+    def get_state(self):
+        game = Game(num_players=2, strategies=[PLANNER_STRATEGY, CHEAPEST_STRATEGY], seed=3)
+        return game.get_state()
+
+    def test_plan_weighs_targets(self):
+        state = self.get_state()
+        three_green = 0
+        one_of_four = 3
+        self.assertEqual(CARD_COSTS[three_green], (0, 0, 3, 0, 0))
+        self.assertEqual(CARD_COSTS[one_of_four], (1, 1, 1, 1, 0))
+
+        # three different colors including green help both cards, two greens mostly the first
+        take = plan_coin_take(state, [(three_green, 1.0), (one_of_four, 1.0)])
+        self.assertEqual(len(take.colors), 3)
+        self.assertIn("green", take.colors)
+        self.assertNotIn("black", take.colors)
+        take = plan_coin_take(state, [(three_green, 5.0), (one_of_four, 1.0)])
+        self.assertEqual(take.colors, ("green", "green"))
+
+    def test_partial_take_when_bank_short(self):
+        state = self.get_state()
+        state = state._replace(bank=(0, 0, 0, 1, 1, 5))
+        take = plan_coin_take(state)
+        self.assertEqual(sorted(take.colors), sorted(COLORS[3:]))
+        self.assertIsNone(plan_coin_take(state._replace(bank=(0, 0, 0, 0, 0, 5))))
+
+    def test_planner_strategy_plays(self):
+        game = Game(num_players=2, strategies=[PLANNER_STRATEGY, CHEAPEST_STRATEGY], seed=5, max_turns=300)
+        game.play_game(interactive=False)
+        self.assertIsNotNone(game.final_state)
+        self.assertTrue(game.validate_game_state())
+
+
+class TestDeckTracker(unittest.TestCase):
+
+    def test_tracker_follows_refills(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, PLANNER_STRATEGY], seed=2, max_turns=300)
+        tracker = game.get_deck_tracker()
+        while not game.is_game_over():
+            game.take_turn()
+            rebuilt = DeckTracker.from_game(game)
+            self.assertEqual(tracker.counts, rebuilt.counts)
+            self.assertEqual(tracker.num_unseen, rebuilt.num_unseen)
+        self.assertEqual(DeckTracker.from_state(game.get_state()).counts, tracker.counts)
+
+    def test_refill_distribution(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, CHEAPEST_STRATEGY], seed=2)
+        tracker = game.get_deck_tracker()
+        for level in range(3):
+            distribution = tracker.get_refill_distribution(level)
+            self.assertAlmostEqual(sum(distribution.values()), 1.0)
+            self.assertAlmostEqual(sum(tracker.get_color_probabilities(level).values()), 1.0)
+            self.assertIs(tracker.get_refill_distribution(level), distribution)
+
+    def test_hypergeometric_probability(self):
+        # 2 red cards among 5 unseen: P(at least one red in 2 draws) = 1 - C(3, 2) / C(5, 2)
+        red = [card_id for card_id, (level, color, points, cost) in enumerate(CARD_CATALOG)
+               if level == 0 and color == "red"][:2]
+        other = [card_id for card_id, (level, color, points, cost) in enumerate(CARD_CATALOG)
+                 if level == 0 and color != "red"][:3]
+        tracker = DeckTracker([red + other, [], []])
+        self.assertAlmostEqual(tracker.get_refill_probability(0, color="red"), 2 / 5)
+        self.assertAlmostEqual(tracker.get_refill_probability(0, color="red", draws=2), 1 - 3 / 10)
+        self.assertEqual(tracker.get_refill_probability(1, color="red"), 0.0)
+
+        tracker.remove(red[0])
+        tracker.remove(red[1])
+        self.assertEqual(tracker.get_refill_probability(0, color="red", draws=2), 0.0)
+
+
+class DriftingEngine(ReferenceEngine):
+    """
+    An engine that miscounts the turns taking two coins from its fourth turn on.
+    """
+
+    def play_turn(self):
+        super().play_turn()
+        if self.game.num_turns == 4:
+            self.game.num_turns_take_two_coins += 1
+
+
+class TestEngineDiff(unittest.TestCase):
+
+    game_kwargs = dict(num_players=2, strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], max_turns=200)
+
+    def test_packed_engine_agrees(self):
+        self.assertIsNone(run_lockstep(PackedEngine, 4, seed=1, workers=2, chunk_size=2, **self.game_kwargs))
+
+    def test_reports_first_divergence(self):
+        divergence = compare_games(DriftingEngine, 1, range(2, 4), self.game_kwargs)
+
+        self.assertEqual(divergence.game_number, 2)
+        self.assertEqual(divergence.seed, get_game_seed(1, 2))
+        self.assertEqual(divergence.turn, 4)
+        self.assertEqual(divergence.path, "state.num_turns_take_two_coins")
+        self.assertEqual(divergence.alternate, divergence.reference + 1)
+
+    def test_statistical_mode(self):
+        self.assertAlmostEqual(get_chi_square_p_value(3.841, 1), 0.05, places=3)
+        self.assertAlmostEqual(get_chi_square_p_value(9.488, 4), 0.05, places=3)
+        outcomes = [("winning_points", 0, 40), ("winning_points", 1, 44), ("max_turns", None, 200)]
+        comparison = compare_outcomes(outcomes, outcomes)
+        self.assertEqual(comparison["outcome_p_value"], 1.0)
+        self.assertEqual(comparison["turns_p_value"], 1.0)
+
+        comparison = run_statistical(PackedEngine, 40, workers=2, chunk_size=10, **self.game_kwargs)
+        self.assertTrue(comparison["agree"])
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_off_by_default(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=1, max_turns=50)
+        game.play_game(interactive=False)
+        self.assertIsNone(game.instrumentation)
+
+    def test_game_phases_and_stuck_causes(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, RANDOM_STRATEGY], seed=1, max_turns=300)
+        instrumentation = game.enable_instrumentation()
+        game.play_game(interactive=False)
+
+        self.assertEqual(instrumentation.num_turns, game.num_turns)
+        self.assertEqual(instrumentation.phase_calls["turn"], game.num_turns)
+        self.assertGreater(instrumentation.phase_calls["affordability"], 0)
+        self.assertGreater(instrumentation.phase_seconds["card_evaluation"], 0)
+        self.assertEqual(set(instrumentation.stuck_causes), set(STUCK_CAUSES))
+        self.assertEqual(instrumentation.stack, [])
+
+    def test_stuck_cause(self):
+        game = Game(num_players=2, strategies=[CHEAPEST_STRATEGY, CHEAPEST_STRATEGY], seed=1)
+        player = game.players[0]
+        self.assertEqual(game.get_stuck_cause(player), "no_affordable_card")
+        game.coins = {color: [] for color in COLORS}
+        self.assertEqual(game.get_stuck_cause(player), "bank_empty")
+        player.coins = [Coin("red", player.name) for _ in range(player.max_coins)]
+        self.assertEqual(game.get_stuck_cause(player), "coin_cap")
+
+    def test_experiment_aggregates(self):
+        experiment = Experiment("TestInstrumented", Game, 4, max_turns=100, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3, instrument=True)
+        experiment.run()
+
+        self.assertEqual(experiment.instrumentation.num_games, 4)
+        self.assertEqual(experiment.instrumentation.num_turns, sum(game.num_turns for game in experiment.get_results()))
+        self.assertEqual(sum(game.instrumentation.phase_calls["turn"] for game in experiment.get_results()),
+                         experiment.instrumentation.phase_calls["turn"])
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profile_in_process(self):
+        experiment = Experiment("TestProfiled", Game, 3, max_turns=100, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3, profile=True)
+        experiment.run()
+
+        functions = {name for filename, line, name in experiment.profile_stats.stats}
+        self.assertIn("take_turn", functions)
+        stacks = get_collapsed_stacks(experiment.profile_stats)
+        self.assertTrue(any(stack[-1].startswith("Splendor.py:get_payment") for stack in stacks))
+
+    def test_profile_workers(self):
+        experiment = Experiment("TestProfiledShared", Game, 8, max_turns=100, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3, profile=True)
+        run_shared(experiment, workers=2, chunk_size=2)
+
+        play_game_calls = [stat[1] for (filename, line, name), stat in experiment.profile_stats.stats.items()
+                           if name == "play_game" and filename.endswith("Splendor.py")]
+        # every worker's games are in the merged profile
+        self.assertEqual(play_game_calls, [8])
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                experiment.analyze_results()
+            finally:
+                os.chdir(cwd)
+            results_dir = os.path.join(tmp_dir, "TestProfiledShared")
+            stats = pstats.Stats(os.path.join(results_dir, "profile.pstats"))
+            self.assertEqual(stats.total_calls, experiment.profile_stats.total_calls)
+            with open(os.path.join(results_dir, "profile.collapsed")) as stacks_file:
+                lines = stacks_file.read().splitlines()
+            self.assertTrue(lines)
+            for line in lines:
+                stack, microseconds = line.rsplit(" ", 1)
+                self.assertGreater(int(microseconds), 0)
+                self.assertTrue(stack)
+
+    def test_profile_self_play_and_shard_workers(self):
+        def count_calls(stats, function):
+            return sum(stat[1] for (filename, line, name), stat in stats.stats.items()
+                       if name == function and filename.endswith("Splendor.py"))
+
+        experiment = Experiment("TestProfiledSelfPlay", Game, 6, max_turns=100, num_players=2,
+                                strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3, profile=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            generate_self_play(SelfPlayDataset(tmp_dir), experiment, workers=2, chunk_size=2)
+            self.assertGreater(count_calls(experiment.profile_stats, "take_turn"), 0)
+
+            coordinator = ShardCoordinator.from_experiment(experiment, os.path.join(tmp_dir, "spool"), unit_size=4)
+            coordinator.run_worker("worker")
+            self.assertEqual(count_calls(coordinator.merge_profile_stats(), "play_game"), 6)
+
+
+class TestProgress(unittest.TestCase):
+
+    def get_results(self):
+        return results_to_array([(30, 2, FINAL_STATES.index("winning_points"), 0, [15, 9, 0, 0]),
+                                 (50, 5, FINAL_STATES.index("winning_points"), 1, [8, 16, 0, 0]),
+                                 (300, 0, FINAL_STATES.index("max_turns"), -1, [3, 4, 0, 0])])
+
+    def test_metrics(self):
+        progress = ExperimentProgress("test", 6, ["player1=CHEAPEST", "player2=POINTS"]).start()
+        progress.add_results(self.get_results(), worker="w1", busy_seconds=0.5)
+        progress.close()
+        metrics = progress.get_metrics()
+
+        self.assertEqual(metrics["games_completed"], 3)
+        self.assertEqual(metrics["turns_completed"], 380)
+        self.assertEqual(metrics["final_states"]["winning_points"], 2)
+        self.assertEqual(metrics["win_shares"], {"player1=CHEAPEST": 0.5, "player2=POINTS": 0.5})
+        self.assertEqual(metrics["workers"]["w1"]["games"], 3)
+        self.assertGreater(metrics["eta_seconds"], 0)
+
+    def test_prometheus_endpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            status_path = os.path.join(tmp_dir, "status.json")
+            with ExperimentProgress("test", 3, ["player1=CHEAPEST", "player2=POINTS"],
+                                    status_path=status_path, port=0) as progress:
+                progress.add_results(self.get_results())
+                with urllib.request.urlopen(f"http://127.0.0.1:{progress.port}/metrics") as response:
+                    text = response.read().decode()
+            self.assertIn('splendor_experiment_games_completed{experiment="test"} 3.0', text)
+            self.assertIn('splendor_experiment_final_states{experiment="test",final_state="max_turns"} 1.0', text)
+            self.assertIn("# TYPE splendor_experiment_games_per_second gauge", text)
+            with open(status_path) as json_file:
+                self.assertEqual(json.load(json_file)["eta_seconds"], 0)
+
+    def test_experiment_status_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            status_path = os.path.join(tmp_dir, "status.json")
+            experiment = Experiment("TestProgress", Game, 6, max_turns=100, num_players=2,
+                                    strategies=[CHEAPEST_STRATEGY, POINTS_STRATEGY], seed=3, status_path=status_path)
+            experiment.run()
+            with open(status_path) as json_file:
+                self.assertEqual(json.load(json_file)["games_completed"], 6)
+
+            run_shared(experiment, workers=2, chunk_size=2)
+            with open(status_path) as json_file:
+                status = json.load(json_file)
+            self.assertEqual(status["games_completed"], 6)
+            self.assertEqual(sum(worker["games"] for worker in status["workers"].values()), 6)
+
+
 class TestPlayer(unittest.TestCase):
 
     def setUp(self):
@@ -237,6 +1079,19 @@ class TestPlayer(unittest.TestCase):
         self.assertEqual(coins_dict["white"], 0)
         self.assertEqual(coins_dict["black"], 0) 
 
+    def test_counts_follow_coins_and_cards(self):
+        self.player.coins = [Coin("red", self.player.name), Coin("red", self.player.name), Coin(GOLD, self.player.name, wild=True)]
+        self.player.add_card(Card(color="blue", level=0, points=0, cost={}))
+        self.assertEqual(self.player.coin_counts["red"], 2)
+        self.assertEqual(self.player.get_bonus("blue"), 1)
+
+        payment = self.player.get_payment(Card(color="green", level=0, points=0, cost={"red": 3, "blue": 1}))
+        self.assertEqual((payment.bonuses, payment.coins, payment.gold), ({"red": 0, "blue": 1}, {"red": 2, "blue": 0}, 1))
+
+        self.player.coins = self.player.coins[:1]
+        self.assertEqual(self.player.get_coins_dict(), {"red": 1, "blue": 0, "green": 0, "white": 0, "black": 0})
+        self.assertIsNone(self.player.get_payment(Card(color="green", level=0, points=0, cost={"red": 3})))
+
     def test_get_cards_dict(self):  
         cards_dict = self.player.get_cards_dict()
         self.assertEqual(cards_dict["red"], 0)
@@ -341,6 +1196,413 @@ class TestCard(unittest.TestCase):
         self.card.cost = cost
         self.assertEqual(self.card.get_weighted_cost(), (2 + 3)/2.0)
 
+class TestResults(unittest.TestCase):
+
+    def setUp(self):
+        self.games = []
+        for i in range(5):
+            game = Game(num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY)
+            game.play_game(interactive=False)
+            self.games.append(game)
+        self.results = results_to_array([get_game_result(game) for game in self.games])
+
+    def test_get_game_result(self):
+        game = self.games[0]
+        num_turns, num_turns_take_two_coins, final_state, winner, scores = get_game_result(game)
+        self.assertEqual(num_turns, game.num_turns)
+        self.assertEqual(num_turns_take_two_coins, game.num_turns_take_two_coins)
+        if game.winner is not None:
+            self.assertEqual(game.players[winner], game.winner)
+        self.assertEqual(scores[:3], [player.get_total_points() for player in game.players])
+        self.assertEqual(scores[3], 0)
+
+    def test_final_state_and_win_counts(self):
+        final_states = get_final_state_counts(self.results)
+        self.assertEqual(sum(final_states.values()), len(self.games))
+        self.assertEqual(final_states["winning_points"], sum(game.final_state == "winning_points" for game in self.games))
+
+        wins = get_win_counts(self.results, ["a", "b", "c"])
+        for i, label in enumerate(["a", "b", "c"]):
+            self.assertEqual(wins[label], sum(game.winner is game.players[i] for game in self.games))
+
+    def test_get_summary(self):
+        summary = get_summary(self.results, 3, ["a", "b", "c"])
+        self.assertEqual(summary["num_games"], 5)
+        self.assertAlmostEqual(summary["num_turns_mean"], sum(game.num_turns for game in self.games) / 5)
+        # plain types, so it can be written as JSON
+        json.dumps(summary)
+
+class TestAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.strategies = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, CHEAPEST_STRATEGY]
+        self.records = []
+        for i in range(10):
+            game = Game(num_players=3, winning_points=1, strategies=self.strategies)
+            game.play_game(interactive=False)
+            self.records.append(get_game_result(game))
+        self.labels = ["a", "b", "c"]
+
+    def test_running_stats(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        stats = RunningStats()
+        for value in values:
+            stats.add(value)
+        mean = sum(values) / len(values)
+        self.assertAlmostEqual(stats.mean, mean)
+        self.assertAlmostEqual(stats.get_variance(), sum((v - mean) ** 2 for v in values) / len(values))
+        self.assertEqual((stats.min, stats.max), (1, 9))
+
+        first, second = RunningStats(), RunningStats()
+        for value in values[:3]:
+            first.add(value)
+        for value in values[3:]:
+            second.add(value)
+        first.merge(second)
+        self.assertAlmostEqual(first.mean, stats.mean)
+        self.assertAlmostEqual(first.get_variance(), stats.get_variance())
+
+    def test_histogram_quantile(self):
+        histogram = Histogram(0, 10, 10)
+        for value in range(10):
+            histogram.add(value)
+        histogram.add(100)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.overflow, 1)
+        self.assertAlmostEqual(histogram.get_quantile(0.5), 5.5)
+        self.assertEqual(histogram.get_quantile(1.0), 10)
+
+    def test_num_turns_range_follows_max_turns(self):
+        aggregator = ResultsAggregator(3, self.strategies, max_num_turns=50)
+        # a game that hit the limit, and one of a run without it
+        aggregator.add_results(results_to_array([(50, 0, 1, 0, [1, 0, 0, 0]), (80, 0, 0, 0, [15, 0, 0, 0])]))
+        self.assertEqual(aggregator.histograms["num_turns"].counts[50], 1)
+        self.assertEqual(aggregator.get_summary(self.labels)["histogram_overflow"]["num_turns"], 1)
+        self.assertEqual(ResultsAggregator(3, self.strategies).histograms["num_turns"].high, 501)
+
+    def test_add_matches_summary(self):
+        aggregator = ResultsAggregator(3, self.strategies)
+        for record in self.records:
+            aggregator.add(record)
+        summary = aggregator.get_summary(self.labels)
+        expected = get_summary(results_to_array(self.records), 3, self.labels)
+        self.assertEqual(summary["num_games"], 10)
+        self.assertAlmostEqual(summary["num_turns_mean"], expected["num_turns_mean"])
+        self.assertAlmostEqual(summary["num_turns_std"], expected["num_turns_std"])
+        self.assertEqual(summary["final_states"], expected["final_states"])
+        self.assertEqual(summary["player_wins"], expected["player_wins"])
+        self.assertEqual(summary["strategy_wins"][CHEAPEST_STRATEGY], expected["player_wins"]["b"] + expected["player_wins"]["c"])
+
+    def test_merge(self):
+        whole = ResultsAggregator(3, self.strategies)
+        whole.add_results(results_to_array(self.records))
+        first = ResultsAggregator(3, self.strategies)
+        second = ResultsAggregator(3, self.strategies)
+        for record in self.records[:4]:
+            first.add(record)
+        for record in self.records[4:]:
+            second.add(record)
+        first.merge(second)
+        merged_summary = first.get_summary(self.labels)
+        whole_summary = whole.get_summary(self.labels)
+        for key in ["num_turns_mean", "num_turns_std", "two_coin_percentage_mean", "average_score_mean"]:
+            self.assertAlmostEqual(merged_summary.pop(key), whole_summary.pop(key))
+        self.assertEqual(merged_summary, whole_summary)
+
+class TestExperiment(unittest.TestCase):
+
+    def test_analyze_results(self):
+        strategies = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY]
+        experiment = Experiment("TestExperiment", Game, 10, num_players=3, winning_points=1, strategies=strategies)
+        experiment.run()
+        self.assertEqual(len(experiment.get_results_array()), 10)
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                summary = experiment.analyze_results()
+            finally:
+                os.chdir(cwd)
+            results_dir = os.path.join(tmp_dir, "TestExperiment")
+            with open(os.path.join(results_dir, "summary.json")) as json_file:
+                self.assertEqual(json.load(json_file), summary)
+            self.assertTrue(os.path.exists(os.path.join(results_dir, "TestExperiment: Number of Turns Played.png")))
+
+    def test_analyze_streamed_results(self):
+        experiment = Experiment("TestStreamed", Game, 10, num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, keep_results=False)
+        experiment.run()
+        self.assertEqual(experiment.get_results(), [])
+        self.assertEqual(experiment.get_aggregator().get_num_games(), 10)
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                summary = experiment.analyze_results()
+            finally:
+                os.chdir(cwd)
+            self.assertEqual(sum(summary["final_states"].values()), 10)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "TestStreamed", "TestStreamed: Final States.png")))
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_expand_grid(self):
+        lineup = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY]
+        cells = expand_grid({"num_players": [2, 3, 4], "winning_points": [1, 2], "strategies": [lineup]})
+        # a lineup of 3 cannot seat 4 players
+        self.assertEqual(len(cells), 4)
+        self.assertEqual(cells[0]["strategies"], lineup[:2])
+        with self.assertRaises(ValueError):
+            expand_grid({"num_coins": [1]})
+
+    def test_run_only_invalidated(self):
+        sweep = Sweep("TestSweep", {"num_players": [2, 3], "winning_points": [1]}, 6, workers=2, chunk_size=4)
+        table = sweep.run()
+        self.assertEqual(len(table), 2)
+        self.assertEqual([row["num_games"] for row in table], [6, 6])
+        self.assertEqual(sweep.get_invalidated_cells(), [])
+        self.assertTrue(os.path.exists(os.path.join("TestSweep", "summary.csv")))
+
+        # the sweep's games are the same as playing them one after the other
+        cell = sweep.get_cells()[0]
+        results = play_games(Game, 2, None, 1, RANDOM_STRATEGY, None, sum(sweep.get_cell_chunks(cell), []))
+        self.assertAlmostEqual(table[0]["num_turns_mean"], results["num_turns"].mean())
+
+        sweep = Sweep("TestSweep", {"num_players": [2, 3], "winning_points": [1, 2]}, 6, workers=2, chunk_size=4)
+        self.assertEqual(len(sweep.get_invalidated_cells()), 2)
+        self.assertEqual(len(sweep.run()), 4)
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(cache_dir=self.tmp_dir.name)
+        self.strategies = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_experiment(self, num_games, seed=3, winning_points=1):
+        return Experiment("TestCache", Game, num_games, num_players=3, winning_points=winning_points,
+                          strategies=self.strategies, seed=seed, cache=self.cache)
+
+    def test_needs_seed(self):
+        with self.assertRaises(ValueError):
+            Experiment("TestCache", Game, 1, cache=self.cache)
+
+    def test_reuses_cached_games(self):
+        experiment = self.make_experiment(6)
+        experiment.run()
+        key = get_cache_key(experiment.get_game_config(), 3)
+        self.assertEqual(self.cache.get_ranges(key), [(0, 6)])
+
+        # the cached results are the ones of the seeded games
+        uncached = Experiment("TestCache", Game, 6, num_players=3, winning_points=1, strategies=self.strategies, seed=3)
+        uncached.run()
+        self.assertTrue((experiment.get_results_array() == uncached.get_results_array()).all())
+
+        # a longer experiment only plays the games that are missing
+        longer = self.make_experiment(10)
+        self.assertEqual(self.cache.get_missing_ranges(key, 0, 10), [(6, 10)])
+        longer.run()
+        self.assertEqual(self.cache.get_ranges(key), [(0, 6), (6, 10)])
+        self.assertTrue((longer.get_results_array()[:6] == uncached.get_results_array()).all())
+        self.assertEqual(longer.get_aggregator().get_num_games(), 10)
+
+        # other configurations or seeds are other entries
+        self.assertNotEqual(key, get_cache_key(self.make_experiment(6, seed=4).get_game_config(), 4))
+        self.assertNotEqual(key, get_cache_key(self.make_experiment(6, winning_points=2).get_game_config(), 3))
+
+    def test_evicts_least_recently_used(self):
+        results = results_to_array([(1, 0, 0, 0, [1, 0, 0, 0])] * 100)
+        self.cache.store("a" * 40, 0, 100, results)
+        self.cache.store("b" * 40, 0, 100, results)
+        entry_size = self.cache.get_size() // 2
+        os.utime(self.cache.get_range_path("a" * 40, 0, 100), (0, 0))
+        self.cache.max_bytes = entry_size
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertEqual(self.cache.get_ranges("a" * 40), [])
+        self.assertEqual(self.cache.get_ranges("b" * 40), [(0, 100)])
+
+    def test_tight_cap_keeps_games_being_loaded(self):
+        self.make_experiment(5).run()
+        self.cache.max_bytes = self.cache.get_size() + 50
+
+        experiment = self.make_experiment(10)
+        experiment.run()
+
+        self.assertEqual(experiment.get_aggregator().get_num_games(), 10)
+        self.assertLessEqual(self.cache.get_size(), self.cache.max_bytes)
+
+class TestSimulation(unittest.TestCase):
+
+    def test_fast_forward_to_game_over(self):
+        game = Game(num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=1)
+        simulation = SimulationThread(game, paused=False)
+        simulation.set_fast_forward(True)
+        simulation.start()
+        simulation.join(timeout=10)
+        self.assertFalse(simulation.is_alive())
+
+        snapshot = simulation.get_latest_snapshot()
+        self.assertIsNotNone(snapshot.final_state)
+        self.assertEqual(snapshot.num_turns, game.num_turns)
+        # snapshots are copies
+        self.assertIsNot(snapshot, game)
+        self.assertIsNone(simulation.get_latest_snapshot())
+
+    def test_step_while_paused(self):
+        game = Game(num_players=3, strategy=CHEAPEST_STRATEGY, seed=1)
+        simulation = SimulationThread(game, paused=True)
+        self.assertEqual(simulation.get_latest_snapshot().num_turns, 0)
+        simulation.start()
+        simulation.step()
+        snapshot = simulation.snapshots.get(timeout=10)
+        self.assertEqual(snapshot.num_turns, 1)
+        simulation.stop()
+        simulation.join(timeout=10)
+        self.assertEqual(game.num_turns, 1)
+
+    def test_from_experiment(self):
+        experiment = Experiment("TestSimulation", Game, 3, num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=5)
+        experiment.run()
+        simulation = SimulationThread.from_experiment(experiment, igame=2)
+        simulation.set_fast_forward(True)
+        simulation.start()
+        simulation.join(timeout=10)
+        self.assertEqual(simulation.game.num_turns, experiment.get_results_array()["num_turns"][2])
+
+class TestReplayRenderer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_png_sequence(self):
+        game = Game(num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=2)
+        paths = save_png_sequence(game, self.tmp_dir.name, every=5)
+        self.assertIsNotNone(game.final_state)
+        # the start, every 5th turn and the end
+        self.assertEqual(len(paths), 1 + game.num_turns // 5 + (1 if game.num_turns % 5 else 0))
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_save_gif(self):
+        game = Game(num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=2)
+        path = save_gif(game, os.path.join(self.tmp_dir.name, "game.gif"), every=5)
+        with open(path, "rb") as gif_file:
+            self.assertEqual(gif_file.read(6), b"GIF89a")
+
+    def test_render_experiment_replays(self):
+        experiment = Experiment("TestReplays", Game, 2, num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=4)
+        jobs = get_experiment_replay_jobs(experiment, [0, 1], self.tmp_dir.name, replay_format="png", every=10)
+        results = render_replays(jobs, workers=2)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "game1", "frame00000.png")))
+
+    def test_init_drops_surfaces_of_old_font(self):
+        SplendorPyGame.initPyGame(headless=True)
+        SplendorPyGame.get_text_surface("Points: 1")
+        SplendorPyGame.initPyGame(headless=True)
+        self.assertEqual(SplendorPyGame.get_text_surface.cache_info().currsize, 0)
+        SplendorPyGame.draw_text("Points: 1", 0, 0)
+
+def run_shard_worker(spool_dir, worker_id):
+    ShardCoordinator(spool_dir).run_worker(worker_id)
+
+class TestShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.experiment = Experiment("TestShards", Game, 10, num_players=3, winning_points=1, strategy=CHEAPEST_STRATEGY, seed=6)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_workers_merge_to_experiment(self):
+        coordinator = ShardCoordinator.from_experiment(self.experiment, self.tmp_dir.name, unit_size=3)
+        self.assertEqual(len(coordinator.get_units()), 4)
+
+        # processes standing in for workers on several nodes
+        workers = [multiprocessing.Process(target=run_shard_worker, args=(self.tmp_dir.name, f"node{i}")) for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=30)
+        self.assertEqual(coordinator.get_pending_units(), [])
+
+        self.experiment.run()
+        self.assertTrue((coordinator.merge() == self.experiment.get_results_array()).all())
+
+    def test_abandoned_lease_is_reassigned(self):
+        coordinator = ShardCoordinator.from_experiment(self.experiment, self.tmp_dir.name, unit_size=5)
+        coordinator.lease_timeout = 60
+        unit = coordinator.get_units()[0]
+        self.assertTrue(coordinator.claim(unit, "crashed"))
+        self.assertFalse(coordinator.claim(unit, "other"))
+        with self.assertRaises(RuntimeError):
+            coordinator.merge()
+
+        # the crashed worker never renews its lease
+        os.utime(coordinator.get_lease_path(unit), (0, 0))
+        self.assertEqual(coordinator.run_worker("other", wait=False), 2)
+        self.assertEqual(len(coordinator.merge()), 10)
+
+class TestSharedResults(unittest.TestCase):
+
+    def test_run_shared(self):
+        strategies = [RANDOM_STRATEGY, CHEAPEST_STRATEGY, POINTS_STRATEGY]
+        experiment = Experiment("TestShared", Game, 12, num_players=3, winning_points=1, strategies=strategies, seed=8)
+        buffer = run_shared(experiment, workers=2, chunk_size=5)
+        results = experiment.get_results_array()
+        # a view of the shared memory, not a copy
+        self.assertIs(results, buffer.results)
+        self.assertEqual(experiment.get_aggregator().get_num_games(), 12)
+
+        expected = Experiment("TestShared", Game, 12, num_players=3, winning_points=1, strategies=strategies, seed=8)
+        expected.run()
+        self.assertTrue((results == expected.get_results_array()).all())
+
+    def test_attach_by_name(self):
+        buffer = SharedResultBuffer(3)
+        try:
+            other = SharedResultBuffer(3, name=buffer.name)
+            other.results["num_turns"][1] = 42
+            other.close()
+            self.assertEqual(buffer.results["num_turns"][1], 42)
+        finally:
+            buffer.close()
+            buffer.unlink()
+
+    def test_attaching_process_leaves_buffer(self):
+        buffer = SharedResultBuffer(3)
+        try:
+            # a process with a resource tracker of its own, which must not unlink the buffer when it exits
+            code = ("from SharedResults import SharedResultBuffer; "
+                    f"other = SharedResultBuffer(3, name={buffer.name!r}); "
+                    "other.results['num_turns'][2] = 7; other.close()")
+            completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(completed.returncode, 0, completed.stderr)
+            self.assertNotIn("leaked", completed.stderr)
+            other = SharedResultBuffer(3, name=buffer.name)
+            self.assertEqual(other.results["num_turns"][2], 7)
+            other.close()
+        finally:
+            buffer.close()
+            buffer.unlink()
+
 if __name__ == "__main__":
     unittest.main()
 